@@ -6,16 +6,271 @@ Author: Andre Perkins
 
 import tables as tb
 import numpy as np
+import os
 import os.path as path
 import warnings
 import netCDF4 as ncf
 import numexpr as ne
 import multiprocessing as mp
 import cPickle as cpk
+import tempfile
+import shutil
+import time
+from collections import OrderedDict
+from functools import partial
 
-from Stats import run_mean, calc_anomaly
+from Stats import run_mean, calc_anomaly, _column_blocks, _BLOCK_BYTES
 from scipy.signal import detrend
 
+try:
+    from threadpoolctl import threadpool_limits
+except ImportError:
+    threadpool_limits = None
+
+
+def _finite_mask(data, max_mem=_BLOCK_BYTES):
+    """
+    Mask of the spatial points that are finite at every sample of data with
+    a leading sampling dimension.  Reduced over blocks of samples so no
+    full-size boolean array is created.
+    """
+    sample_size = max(1, int(np.prod(data.shape[1:])))
+    block = max(1, int(max_mem // sample_size))
+    valid = np.ones(data.shape[1:], dtype=np.bool)
+    for t0 in xrange(0, data.shape[0], block):
+        valid &= np.isfinite(data[t0:(t0 + block)]).all(axis=0)
+    return valid
+
+
+def _run_mean_bin(data, window_size, **kwargs):
+    """Running mean transform of a databin."""
+    return run_mean(data, window_size, **kwargs)[0]
+
+
+def _anomaly_bin(data, yr_size, climo):
+    """Anomaly transform of a databin."""
+    return calc_anomaly(data, yr_size, climo=climo)[0]
+
+
+def _scale_bin(data, scale):
+    """Scaling (area weighting) transform of a databin."""
+    return ne.evaluate('data * scale')
+
+
+def _compress_bin(data, valid_data, leading_time):
+    """Transform of a databin to its valid (unmasked) points."""
+    if leading_time:
+        return data[:, valid_data]
+    return data[valid_data]
+
+
+def _pipeline_step(data, step, kwargs, cols=slice(None)):
+    """
+    Apply a preprocessing pipeline step to the spatial columns cols of the
+    data.  Returns the result and the running mean edges if applicable.
+    """
+    if step == 'run_mean':
+        data, bedge, tedge = run_mean(data, kwargs['window_size'],
+                                      shave_yr=kwargs.get('shave_yr', False))
+        return data, (bedge, tedge)
+    elif step == 'anomaly':
+        climo = kwargs.get('climo')
+        if climo is not None:
+            climo = climo[:, cols]
+        return calc_anomaly(data, kwargs['yr_size'], climo=climo)
+    elif step == 'area_weight':
+        return _scale_bin(data, kwargs['scale'][cols]), None
+    elif step == 'detrend':
+        return detrend(data, axis=0, type='linear'), None
+
+
+def _apply_pipeline(data, steps):
+    """Databin transform applying resolved pipeline steps to full data."""
+    for step, kwargs in steps:
+        data = _pipeline_step(data, step, kwargs)[0]
+    return data
+
+
+def _writeable(data):
+    """Data, or a writeable copy of it if it is a read-only array."""
+    if isinstance(data, np.ndarray) and not data.flags.writeable:
+        return np.array(data)
+    return data
+
+
+def _owner(data):
+    """Array that owns the memory of a (possibly nested) view."""
+    while isinstance(data.base, np.ndarray):
+        data = data.base
+    return data
+
+
+class DataBins(object):
+    """
+    Budgeted store for the databins of a BaseDataObject.
+
+    Bins share memory with the arrays they are created from instead of
+    copying them, and are marked read-only so they can not be modified in
+    place.  Each bin created by a transform of another bin records the
+    transform so it can be recomputed on demand.  Bins that are not in keep
+    are only recorded.  When the in-memory bins exceed max_mem, the least
+    recently used bins are dropped if they can be recomputed or spilled to
+    a memmap scratch file otherwise.  Overwriting a bin invalidates the
+    recorded transforms of the bins created from it.
+
+    Parameters
+    ----------
+    max_mem: int, optional
+        Memory budget in bytes for bins held in memory.  Unlimited if None.
+    keep: iterable of str, optional
+        Keys of the bins to store.  All bins are stored if None.  Bins that
+        can not be recomputed (e.g. the original data) are always stored.
+    spill_dir: str, optional
+        Directory for the scratch files of spilled bins.  The system
+        temporary directory is used if None.
+    """
+
+    def __init__(self, max_mem=None, keep=None, spill_dir=None):
+        self.max_mem = max_mem
+        self.keep = None if keep is None else set(keep)
+        self.spill_dir = spill_dir
+        self._bins = OrderedDict()
+        self._chain = {}
+        self._tmp_dir = None
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['_bins'] = OrderedDict((name, np.array(data))
+                                     if isinstance(data, np.memmap)
+                                     else (name, data)
+                                     for name, data in self._bins.items())
+        state['_tmp_dir'] = None
+        return state
+
+    def __del__(self):
+        self.close()
+
+    def close(self):
+        """Remove the scratch files of spilled bins."""
+        if self._tmp_dir is not None:
+            for name, data in self._bins.items():
+                if isinstance(data, np.memmap):
+                    del self._bins[name]
+            shutil.rmtree(self._tmp_dir, ignore_errors=True)
+            self._tmp_dir = None
+
+    def __contains__(self, name):
+        return name in self._bins or name in self._chain
+
+    def keys(self):
+        return list(set(self._bins.keys()) | set(self._chain.keys()))
+
+    def get(self, name, default=None):
+        try:
+            return self[name]
+        except KeyError:
+            return default
+
+    def __setitem__(self, name, data):
+        self.add(name, data)
+
+    def __getitem__(self, name):
+        if name in self._bins:
+            data = self._bins.pop(name)
+            self._bins[name] = data
+            return data
+
+        if name not in self._chain:
+            raise KeyError(name)
+
+        parent, transform = self._chain[name]
+        data = transform(self[parent])
+        if self.keep is None or name in self.keep:
+            return self._store(name, data)
+        return data
+
+    def add(self, name, data, parent=None, transform=None):
+        """
+        Add a bin.  If it was created by a transform of a parent bin, the
+        transform is recorded so the bin can be dropped and recomputed.
+
+        Returns the data, as a read-only view if it is stored in memory.
+        """
+        if name in self:
+            self._invalidate_children(name)
+        self._bins.pop(name, None)
+        if transform is not None and parent in self and parent != name:
+            self._chain[name] = (parent, transform)
+        else:
+            self._chain.pop(name, None)
+
+        if (self.keep is None or name in self.keep or
+                name not in self._chain):
+            return self._store(name, data)
+        return data
+
+    def _invalidate_children(self, name):
+        """
+        Forget the transforms from a bin that is being replaced.  Stored
+        children keep their data and are no longer recomputed, children
+        that were dropped are removed along with their own children.
+        """
+        for child, (parent, _) in self._chain.items():
+            if parent == name:
+                del self._chain[child]
+                if child not in self._bins:
+                    self._invalidate_children(child)
+
+    @property
+    def nbytes(self):
+        """Bytes of memory owned by the bins held in memory."""
+        in_mem = {}
+        for data in self._bins.values():
+            if (isinstance(data, np.ndarray) and
+                    not isinstance(data, np.memmap)):
+                owner = _owner(data)
+                in_mem[id(owner)] = owner.nbytes
+        return sum(in_mem.values())
+
+    def _store(self, name, data):
+        if isinstance(data, np.ndarray) and not isinstance(data, np.memmap):
+            data = data.view()
+            data.flags.writeable = False
+        self._bins[name] = data
+        self._enforce_budget(protect=name)
+        return data
+
+    def _enforce_budget(self, protect=None):
+        if self.max_mem is None:
+            return
+
+        for name in list(self._bins.keys()):
+            if self.nbytes <= self.max_mem:
+                break
+            data = self._bins[name]
+            if (name == protect or not isinstance(data, np.ndarray) or
+                    isinstance(data, np.memmap)):
+                continue
+
+            if name in self._chain:
+                del self._bins[name]
+            else:
+                self._spill(name)
+
+    def _spill(self, name):
+        if self._tmp_dir is None:
+            self._tmp_dir = tempfile.mkdtemp(prefix='pylim_bins_',
+                                             dir=self.spill_dir)
+        filename = path.join(self._tmp_dir, name + '.dat')
+        data = self._bins[name]
+        out = np.memmap(filename, dtype=data.dtype, mode='w+',
+                        shape=data.shape)
+        out[:] = data
+        out.flush()
+        del out
+        self._bins[name] = np.memmap(filename, dtype=data.dtype, mode='r',
+                                     shape=data.shape)
+
 
 class BaseDataObject(object):
     """Data Input Object
@@ -49,6 +304,9 @@ class BaseDataObject(object):
     _ANOMALY = 'anomaly'
     _CLIMO = 'climo'
 
+    # Whether the original data databin needs its own copy of the input
+    _COPY_INPUT = True
+
     @staticmethod
     def _match_dims(shape, dim_coords):
         return {key: value[0] for key, value in dim_coords.items()
@@ -57,7 +315,8 @@ class BaseDataObject(object):
     def __init__(self, data, dim_coords=None, valid_data=None, force_flat=False,
                  save_none=False, time_units=None, time_cal=None,
                  is_anomaly=False, is_run_mean=False, is_detrended=False,
-                 is_area_weighted=False):
+                 is_area_weighted=False, max_mem=None, keep_bins=None,
+                 spill_dir=None):
         """
         Construction of a DataObject from input data.  If nan or
         infinite values are present, a compressed version of the data
@@ -84,27 +343,45 @@ class BaseDataObject(object):
             Data has been smoothed with a running mean.
         is_detrended: bool
             Data has been detrended.
+        max_mem: int, optional
+            Memory budget in bytes for the databins (see DataBins).
+        keep_bins: iterable of str, optional
+            Keys of the databins to store (e.g. BaseDataObject._ANOMALY).
+            Other databins are recomputed from their transforms when
+            accessed.  All databins are stored if None.
+        spill_dir: str, optional
+            Directory for databins spilled to scratch files.
+
+        Notes
+        -----
+        Databins are read-only and derived from a private copy of the input
+        data, so the input is not modified (e.g. by NaN masking) and later
+        edits of it don't reach the databins.  The data attribute is a
+        writeable copy when the current databin is held in memory.
         """
 
         assert data.ndim <= 4, 'Maximum of 4 dimensions are allowed.'
+
+        # Databins are derived from a private copy of the input, so later
+        # edits of the input can't change them
+        if self._COPY_INPUT and not save_none:
+            data = np.array(data)
+
         self._full_shp = data.shape
         self.data_dtype = data.dtype
         self.forced_flat = force_flat
         self.time_units = time_units
         self.time_cal = time_cal
         self._save_none = save_none
-        self._data_bins = {}
+        self._data_bins = DataBins(max_mem=max_mem, keep=keep_bins,
+                                   spill_dir=spill_dir)
         self._curr_data_key = None
 
         # Future possible data manipulation functionality
-        self.anomaly = None
         self.climo = None
         self.is_anomaly = is_anomaly
-        self.running_mean = None
         self.is_run_mean = is_run_mean
-        self.detrended = None
         self.is_detrended = is_detrended
-        self.area_weighted = None
         self.is_area_weighted = is_area_weighted
 
         # Match dimension coordinate vectors
@@ -150,12 +427,16 @@ class BaseDataObject(object):
 
             # Apply input mask if its spatial dimensions match data
             if not compressed:
-                # multplication broadcasts across leading sampling dimension if
+                # indexing broadcasts across leading sampling dimension if
                 # applicable
-                full_valid = np.ones(data.shape, dtype=np.bool) * valid_data
-                data[~full_valid] = np.nan
+                data = _writeable(data)
+                data[..., ~valid_data] = np.nan
             else:
-                assert np.all(np.isfinite(data)),\
+                if self._leading_time:
+                    all_finite = _finite_mask(data).all()
+                else:
+                    all_finite = np.isfinite(data).all()
+                assert all_finite,\
                     'Previously compressed data should not contain NaN data.'
                 self._full_shp = self._time_shp + list(valid_data.shape)
 
@@ -163,16 +444,16 @@ class BaseDataObject(object):
             self.is_masked = True
         else:
             # Check to see if non-finite data requires use of mask
-            if not np.alltrue(np.isfinite(data)):
-                if self._leading_time:
-                    valid_data = np.isfinite(data[0])
-                    for time in data:
-                        valid_data &= np.isfinite(time)
-                    full_valid = np.ones(data.shape, dtype=np.bool) * valid_data
-                    data[~full_valid] = np.nan
-                else:
-                    valid_data = np.isfinite(data)
+            if self._leading_time:
+                valid_data = _finite_mask(data)
+                # Points with any missing sample are masked entirely
+                if not valid_data.all():
+                    data = _writeable(data)
+                    data[:, ~valid_data] = np.nan
+            else:
+                valid_data = np.isfinite(data)
 
+            if not valid_data.all():
                 self.is_masked = True
                 self.valid_data = valid_data.flatten()
 
@@ -188,35 +469,47 @@ class BaseDataObject(object):
 
         # Initialized here for flattening purposes
         if not save_none:
-            self.orig_data = self._new_databin(self.data, self._ORIGDATA)
+            self.data = self._new_databin(self.data, self._ORIGDATA)
 
         # Compress the data if mask is present
         if compressed or self.is_masked:
             if compressed:
-                self.compressed_data = self.orig_data
+                if not save_none:
+                    self._data_bins[self._COMPRESSED] = self.orig_data
             elif self.is_masked:
                 if self._leading_time:
                     self.data = self.data[:, self.valid_data]
-                    if not save_none:
-                        self.compressed_data = self._new_databin(
-                            self.data,
-                            self._COMPRESSED)
                 else:
                     self.data = self.data[self.valid_data]
-                    if not save_none:
-                        self.compressed_data = self._new_databin(
-                            self.data,
-                            self._COMPRESSED)
+                if not save_none:
+                    self.data = self._new_databin(
+                        self.data,
+                        self._COMPRESSED,
+                        transform=partial(_compress_bin,
+                                          valid_data=self.valid_data,
+                                          leading_time=self._leading_time))
             self._curr_data_key = self._COMPRESSED
-        else:
-            self.compressed_data = None
+
+    # Databins, recomputed from their transforms if they are not stored
+    orig_data = property(lambda self: self._data_bins.get(self._ORIGDATA))
+    compressed_data = property(
+        lambda self: self._data_bins.get(self._COMPRESSED))
+    running_mean = property(lambda self: self._data_bins.get(self._RUNMEAN))
+    anomaly = property(lambda self: self._data_bins.get(self._ANOMALY))
+    detrended = property(lambda self: self._data_bins.get(self._DETRENDED))
+    area_weighted = property(lambda self: self._data_bins.get(self._AWGHT))
 
     # Create data backend container
-    def _new_databin(self, data, name):
-        new = np.empty_like(data)
-        new[:] = data
-        self._data_bins[name] = new
-        return new
+    def _new_databin(self, data, name, transform=None):
+        """
+        Store data in a databin.  The transform of the current databin that
+        produced the data is recorded so the databin can be recomputed.
+        Returns the data to continue working with, copied if the databin
+        holds it as a read-only view so that writes don't reach the databin.
+        """
+        return _writeable(self._data_bins.add(name, data,
+                                              parent=self._curr_data_key,
+                                              transform=transform))
 
     def inflate_full_grid(self, data=None, reshape_orig=False):
         """
@@ -259,7 +552,10 @@ class BaseDataObject(object):
         self.data, bedge, tedge = run_mean(self.data, window_size,
                                            **kwargs)
         if save and not self._save_none:
-            self.running_mean = self._new_databin(self.data, self._RUNMEAN)
+            self.data = self._new_databin(
+                self.data, self._RUNMEAN,
+                transform=partial(_run_mean_bin, window_size=window_size,
+                                  **kwargs))
         self._curr_data_key = self._RUNMEAN
         self.is_run_mean = True
         # Running mean smooths data, no longer an anomaly or detrended
@@ -275,7 +571,9 @@ class BaseDataObject(object):
         self.data, climo = calc_anomaly(self.data, yr_size, climo=climo)
 
         if save and not self._save_none:
-            self.anomaly = self._new_databin(self.data, self._ANOMALY)
+            self.data = self._new_databin(
+                self.data, self._ANOMALY,
+                transform=partial(_anomaly_bin, yr_size=yr_size, climo=climo))
         self.climo = climo
         self._curr_data_key = self._ANOMALY
         self.is_anomaly = True
@@ -286,7 +584,9 @@ class BaseDataObject(object):
             'a specified leading sampling dimension'
         self.data = detrend(self.data, axis=0, type='linear')
         if save and not self._save_none:
-            self.detrended = self._new_databin(self.data, self._DETRENDED)
+            self.data = self._new_databin(
+                self.data, self._DETRENDED,
+                transform=partial(detrend, axis=0, type='linear'))
         self._curr_data_key = self._DETRENDED
         self.is_detrended = True
         return self.detrended
@@ -301,11 +601,152 @@ class BaseDataObject(object):
         awgt = self.data
         self.data = ne.evaluate('awgt * scale')
         if save and not self._save_none:
-            self.area_weighted = self._new_databin(self.data,
-                                                   self._AWGHT)
+            self.data = self._new_databin(
+                self.data, self._AWGHT,
+                transform=partial(_scale_bin, scale=scale))
         self._curr_data_key = self._AWGHT
         self.is_area_weighted = True
 
+    # Pipeline step names and their databin keys
+    _PIPELINE_KEYS = {'run_mean': _RUNMEAN,
+                      'anomaly': _ANOMALY,
+                      'area_weight': _AWGHT,
+                      'detrend': _DETRENDED}
+
+    def preprocess(self, steps, max_mem=_BLOCK_BYTES):
+        """
+        Apply a sequence of preprocessing steps in a single pass over
+        spatial column blocks of the data.
+
+        Every step acts on each spatial point's time series independently,
+        so the steps are fused and evaluated one block at a time.  Only the
+        databins of steps marked to save and the final data are allocated
+        in full; the intermediate results are block sized.
+
+        Parameters
+        ----------
+        steps: list of tuple(str, dict)
+            Steps in order of application as (name, options) pairs.
+            Names and options (see the corresponding methods) are
+            'run_mean': window_size, shave_yr;
+            'anomaly': yr_size, climo;
+            'area_weight': no options;
+            'detrend': no options.
+            Each step also accepts save (default False) to store its
+            databin.
+        max_mem: int, optional
+            Memory budget in bytes for one float64 block of a step.  The
+            data are processed as a single block if None.
+
+        Returns
+        -------
+        data: ndarray
+            Preprocessed data.
+        bedge: int
+            Samples removed from the beginning by the running mean (0 if
+            no running mean step).
+        tedge: int
+            Samples removed from the end by the running mean (None if no
+            running mean step).
+        """
+        assert self._leading_time, 'Can only preprocess data with a ' \
+            'specified leading sampling dimension'
+        assert self.data.ndim == 2, 'Preprocessing expects a flattened ' \
+            'spatial dimension'
+
+        # Resolve step options over the full spatial dimension
+        resolved = []
+        for step, kwargs in steps:
+            if step not in self._PIPELINE_KEYS:
+                raise ValueError('Unknown preprocessing step: {}'.format(step))
+            kwargs = dict(kwargs)
+            if step == 'area_weight':
+                if self.LAT not in self._dim_idx.keys():
+                    warnings.warn('No latitude dimension specified. No area '
+                                  'weighting was performed.')
+                    continue
+                lats = self.get_coordinate_grids([self.LAT])[self.LAT]
+                kwargs['scale'] = np.sqrt(abs(np.cos(np.radians(lats))))
+            resolved.append((step, kwargs))
+
+        if not resolved:
+            return self.data, 0, None
+
+        source = self._data_source()
+        ntime, nspace = source.shape
+        parent = self._curr_data_key
+        save_none = self._save_none
+        bedge, tedge = 0, None
+        climo = None
+        outputs = [None] * len(resolved)
+        final = None
+
+        for c0, c1 in _column_blocks(nspace, ntime, max_mem):
+            cols = slice(c0, c1)
+            block = source[:, cols]
+            for i, (step, kwargs) in enumerate(resolved):
+                block, info = _pipeline_step(block, step, kwargs, cols=cols)
+                if step == 'run_mean':
+                    bedge, tedge = info
+                elif step == 'anomaly':
+                    if climo is None:
+                        climo = np.empty((info.shape[0], nspace),
+                                         dtype=info.dtype)
+                    climo[:, cols] = info
+
+                if kwargs.get('save', False) and not save_none:
+                    if outputs[i] is None:
+                        outputs[i] = self._empty_databin(
+                            self._PIPELINE_KEYS[step], (block.shape[0], nspace),
+                            block.dtype)
+                    outputs[i][:, cols] = block
+
+            # Saved in-memory output of the last step is the final data
+            if not isinstance(outputs[-1], np.ndarray):
+                if final is None:
+                    final = np.empty((block.shape[0], nspace),
+                                     dtype=block.dtype)
+                final[:, cols] = block
+
+        # Register the saved databins with their transforms from the source
+        for i, (step, kwargs) in enumerate(resolved):
+            if step == 'anomaly' and kwargs.get('climo') is None:
+                kwargs['climo'] = climo
+            if outputs[i] is not None:
+                outputs[i] = self._data_bins.add(
+                    self._PIPELINE_KEYS[step], outputs[i], parent=parent,
+                    transform=partial(_apply_pipeline,
+                                      steps=[(name, {key: val for key, val
+                                                     in opts.items()
+                                                     if key != 'save'})
+                                             for name, opts
+                                             in resolved[:(i+1)]]))
+
+            if step == 'run_mean':
+                self.is_run_mean = True
+                self.is_anomaly = False
+                self.is_detrended = False
+            elif step == 'anomaly':
+                self.climo = kwargs['climo']
+                self.is_anomaly = True
+            elif step == 'area_weight':
+                self.is_area_weighted = True
+            elif step == 'detrend':
+                self.is_detrended = True
+
+        self.data = _writeable(final if final is not None else outputs[-1])
+        self._curr_data_key = self._PIPELINE_KEYS[resolved[-1][0]]
+
+        return self.data, bedge, tedge
+
+    def _data_source(self):
+        """Current data to read preprocessing blocks from."""
+        return self.data
+
+    def _empty_databin(self, name, shape, dtype):
+        """Empty output array of a databin filled by the pipeline."""
+        return np.empty(shape, dtype=dtype)
+
     def get_dim_coords(self, keys):
         dim_coords = {}
 
@@ -347,9 +788,10 @@ class BaseDataObject(object):
     # TODO: figure out consisntent state booleans is_detrended, etc.
     def reset_data(self, key):
         try:
-            self.data = self._data_bins[key][:]
+            self.data = _writeable(self._data_bins[key][:])
         except KeyError:
             raise KeyError('Key {} not saved.  Could not reset self.data.')
+        self._curr_data_key = key
 
         return self.data
 
@@ -367,28 +809,42 @@ class BaseDataObject(object):
         self._dim_coords[self.TIME] = (tmp_dimcoord[0], tmp_time)
 
     @classmethod
-    def from_netcdf(cls, filename, var_name):
-
-        with ncf.Dataset(filename, 'r') as f:
-            data = f.variables[var_name]
-            coords = {BaseDataObject.LAT: f.variables['lat'][:],
-                      BaseDataObject.LON: f.variables['lon'][:]}
-            times = f.variables['time']
+    def from_netcdf(cls, filename, var_name, time_range=None, lat_bounds=None,
+                    lon_bounds=None, time_stride=1, space_stride=1,
+                    max_mem=_BLOCK_BYTES):
+        """
+        Create a data object from a netCDF variable, reading only the
+        requested subset in blocks aligned to the file's chunking.
 
-            try:
-                cal = times.calendar
-                coords[BaseDataObject.TIME] = ncf.num2date(times[:], times.units,
-                                                           calendar=cal)
-            except AttributeError:
-                coords[BaseDataObject.TIME] = ncf.num2date(times[:], times.units)
-                cal=None
+        Parameters
+        ----------
+        filename: str
+            netCDF file to read.
+        var_name: str
+            Variable with a leading time dimension.
+        time_range: tuple, optional
+            (start, end) datetimes (inclusive) to read.  Either may be None.
+        lat_bounds: tuple, optional
+            (min, max) latitudes to read.
+        lon_bounds: tuple, optional
+            (min, max) longitudes to read.  Wraps if min > max.
+        time_stride: int, optional
+            Read every n-th time step.
+        space_stride: int, optional
+            Read every n-th latitude and longitude.
+        max_mem: int, optional
+            Approximate bytes read from the file at once.
+        """
 
-            for i, key in enumerate(data.dimensions):
-                if key in coords.keys():
-                    coords[key] = (i, coords[key])
+        with ncf.Dataset(filename, 'r') as f:
+            data, coords = _read_netcdf_subset(
+                f, var_name, time_range=time_range, lat_bounds=lat_bounds,
+                lon_bounds=lon_bounds, time_stride=time_stride,
+                space_stride=space_stride, max_mem=max_mem)
+            units, cal = _netcdf_time_coords(f, coords)
 
-            return cls(data[:], dim_coords=coords, force_flat=True,
-                       time_units=times.units, time_cal=cal)
+            return cls(data, dim_coords=coords, force_flat=True,
+                       time_units=units, time_cal=cal)
 
     @classmethod
     def from_hdf5(cls, filename, var_name, data_dir='/'):
@@ -422,6 +878,9 @@ class BaseDataObject(object):
 
 class Hdf5DataObject(BaseDataObject):
 
+    # Databins are copied to the HDF5 file
+    _COPY_INPUT = False
+
     def __init__(self, data, h5file, dim_coords=None, valid_data=None,
                  force_flat=False, is_anomaly=False, is_run_mean=False,
                  is_detrended=False, default_grp='/data'):
@@ -485,14 +944,25 @@ class Hdf5DataObject(BaseDataObject):
                                              is_run_mean=is_run_mean,
                                              is_detrended=is_detrended)
 
+    def _data_source(self):
+        # Stream from the current databin instead of the in-memory copy
+        databin = self._data_bins.get(self._curr_data_key)
+        if databin is not None and databin.shape == self.data.shape:
+            return databin
+        return self.data
+
+    def _empty_databin(self, name, shape, dtype):
+        return empty_hdf5_carray(self.h5f, self._default_grp, name,
+                                 tb.Atom.from_dtype(np.dtype(dtype)), shape)
+
     # Create backend data container
-    def _new_databin(self, data, name):
+    def _new_databin(self, data, name, transform=None):
         new = var_to_hdf5_carray(self.h5f,
                                  self._default_grp,
                                  name,
                                  data)
         self._data_bins[name] = new
-        return new
+        return data
 
     def set_databin_grp(self, group):
         """
@@ -525,18 +995,15 @@ class Hdf5DataObject(BaseDataObject):
                                                       createparents=True)
 
     @classmethod
-    def from_netcdf(cls, filename, var_name, h5file):
+    def from_netcdf(cls, filename, var_name, h5file, **subset):
+        """
+        Create a Hdf5DataObject from a netCDF variable.  Keyword arguments
+        select the subset to read (see BaseDataObject.from_netcdf).
+        """
 
         with ncf.Dataset(filename, 'r') as f:
-            data = f.variables[var_name][:]
-            coords = {BaseDataObject.LAT: f.variables['lat'][:],
-                      BaseDataObject.LON: f.variables['lon'][:]}
-            times = f.variables['time']
-            coords[BaseDataObject.TIME] = ncf.num2date(times[:], times.units)
-
-            for i, key in enumerate(f.dimensions.iterkeys()):
-                if key in coords.keys():
-                    coords[key] = (i, coords[key])
+            data, coords = _read_netcdf_subset(f, var_name, **subset)
+            _netcdf_time_coords(f, coords)
 
             return cls(data, h5file, dim_coords=coords, force_flat=True)
 
@@ -656,42 +1123,261 @@ def empty_hdf5_carray(h5file, group, node, in_atom, shape, **kwargs):
     return out_arr
 
 
-def netcdf_to_data_obj(filename, var_name, h5file=None, force_flat=True):
+def read_span(idx):
+    """
+    Contiguous slice covering a set of indices and the positions of the
+    indices within it.  Reading the slice and then indexing the result with
+    the positions only reads the chunks spanned from an HDF5 array, rather
+    than point-by-point fancy indexing.
+
+    Parameters
+    ----------
+    idx: ndarray
+        Non-empty integer index array.
+
+    Returns
+    -------
+    slice
+        Slice from the smallest to the largest index.
+    ndarray
+        Indices relative to the start of the slice.
+    """
+    start = idx.min()
+    return slice(start, idx.max() + 1), idx - start
+
+
+def limit_blas_threads(num_threads):
+    """
+    Limit BLAS/OpenMP threads in the current process to avoid
+    oversubscription when running work in a process pool.  Environment
+    variables only affect libraries loaded afterwards, so threadpoolctl or
+    mkl-service are used to limit already loaded BLAS libraries if
+    available.
+
+    Parameters
+    ----------
+    num_threads: int
+        Number of threads to allow.
+    """
+    for var in ['OMP_NUM_THREADS', 'OPENBLAS_NUM_THREADS', 'MKL_NUM_THREADS']:
+        os.environ[var] = str(num_threads)
+
+    if threadpool_limits is not None:
+        threadpool_limits(limits=num_threads)
+    else:
+        try:
+            import mkl
+            mkl.set_num_threads(num_threads)
+        except ImportError:
+            pass
+
+
+def _bounds_slice(coord, bounds, stride, wrap=False):
+    """
+    Slices of a coordinate vector within (min, max) bounds, taking every
+    stride-th point.  Longitude bounds wrap if min > max.  Points within
+    the bounds that are not contiguous in the coordinate vector (e.g. a
+    wrapped range on a 0 to 360 grid, or a box across the dateline on a
+    -180 to 180 grid) give a slice for each contiguous run, in order of
+    longitude east from min.
+    """
+    if bounds is None:
+        return [slice(None, None, stride)]
+
+    lo, hi = bounds
+    if wrap:
+        coord = np.mod(coord, 360)
+        lo, hi = np.mod(lo, 360), np.mod(hi, 360)
+    if wrap and lo > hi:
+        inside = (coord >= lo) | (coord <= hi)
+    else:
+        inside = (coord >= lo) & (coord <= hi)
+
+    idx = np.flatnonzero(inside)
+    if not idx.size:
+        raise ValueError('No coordinates within bounds {}'.format(bounds))
+    runs = np.split(idx, np.flatnonzero(np.diff(idx) > 1) + 1)
+    if wrap:
+        runs.sort(key=lambda run: np.mod(coord[run[0]] - lo, 360))
+    return [slice(run[0], run[-1] + 1, stride) for run in runs]
+
+
+def _read_netcdf_subset(f, var_name, time_range=None, lat_bounds=None,
+                        lon_bounds=None, time_stride=1, space_stride=1,
+                        max_mem=_BLOCK_BYTES):
+    """
+    Read a subset of a netCDF variable in blocks of time aligned to its
+    chunking on disk.
+
+    Parameters
+    ----------
+    f: netCDF4.Dataset
+        Open netCDF file.
+    var_name: str
+        Variable to read.  A time dimension must be the leading dimension.
+    time_range: tuple, optional
+        (start, end) datetimes (inclusive) to read.  Either may be None.
+    lat_bounds, lon_bounds: tuple, optional
+        (min, max) latitude and longitude of the region to read for lat and
+        lon dimensions of the variable.  Longitude bounds wrap if
+        min > max.
+    time_stride, space_stride: int, optional
+        Read every n-th time step and every n-th lat/lon point.
+    max_mem: int, optional
+        Approximate bytes read from the file at once.
+
+    Returns
+    -------
+    data: ndarray
+        Subset with masked values filled with NaN for float data.
+    coords: dict
+        Dimension position and subset coordinates for the time (numeric),
+        lat, and lon dimensions of the variable.
+    """
+    var = f.variables[var_name]
+    dims = var.dimensions
+    if BaseDataObject.TIME in dims:
+        assert dims.index(BaseDataObject.TIME) == 0, \
+            'Time must be the leading dimension of {}'.format(var_name)
+
+    coords = {}
+    dim_slices = []
+    for i, dim in enumerate(dims):
+        if dim == BaseDataObject.TIME:
+            times = f.variables[dim]
+            tvals = times[:]
+            keep = np.ones(len(tvals), dtype=np.bool)
+            if time_range is not None:
+                cal = getattr(times, 'calendar', 'standard')
+                start, end = time_range
+                if start is not None:
+                    keep &= tvals >= ncf.date2num(start, times.units, cal)
+                if end is not None:
+                    keep &= tvals <= ncf.date2num(end, times.units, cal)
+            idx = np.flatnonzero(keep)
+            if not idx.size:
+                raise ValueError('No times within {}'.format(time_range))
+            slices = [slice(idx[0], idx[-1] + 1, time_stride)]
+        elif dim in (BaseDataObject.LAT, BaseDataObject.LON):
+            bounds = lat_bounds if dim == BaseDataObject.LAT else lon_bounds
+            slices = _bounds_slice(f.variables[dim][:], bounds, space_stride,
+                                   wrap=(dim == BaseDataObject.LON))
+        else:
+            slices = [slice(None)]
+
+        if dim in f.variables and dim in (BaseDataObject.TIME,
+                                          BaseDataObject.LAT,
+                                          BaseDataObject.LON):
+            vals = f.variables[dim][:]
+            coords[dim] = (i, np.concatenate([vals[sl] for sl in slices]))
+        dim_slices.append(slices)
+
+    def read(lead_sl):
+        # Read the subset, joining the pieces of a wrapped longitude range
+        key = [lead_sl] + [sl[0] for sl in dim_slices[1:]]
+        wrapped = [j for j, sl in enumerate(dim_slices) if len(sl) > 1]
+        if wrapped:
+            j = wrapped[0]
+            parts = []
+            for sl in dim_slices[j]:
+                key[j] = sl
+                parts.append(var[tuple(key)])
+            block = np.ma.concatenate(parts, axis=j)
+        else:
+            block = var[tuple(key)]
+
+        if np.ma.isMaskedArray(block):
+            if not np.ma.getmaskarray(block).any():
+                return np.ma.getdata(block)
+            if block.dtype.kind != 'f':
+                block = block.astype(np.float64)
+            block = block.filled(np.nan)
+        return block
+
+    if BaseDataObject.TIME not in dims:
+        return read(dim_slices[0][0]), coords
+
+    tsl = dim_slices[0][0]
+    tstart, tstop, tstep = tsl.indices(var.shape[0])
+    ntime = len(xrange(tstart, tstop, tstep))
+
+    # Time blocks are whole multiples of the on-disk time chunk
+    chunking = var.chunking()
+    chunk_t = 1 if chunking == 'contiguous' else chunking[0]
+    step_bytes = var.dtype.itemsize * int(np.prod(var.shape[1:]))
+    block_t = max(chunk_t,
+                  int(max_mem // max(step_bytes, 1)) // chunk_t * chunk_t)
+
+    out = None
+    nread = 0
+    for b0 in xrange((tstart // chunk_t) * chunk_t, tstop, block_t):
+        first = max(b0, tstart)
+        first += (tstart - first) % tstep
+        last = min(b0 + block_t, tstop)
+        if first >= last:
+            continue
+        block = read(slice(first, last, tstep))
+        if out is None:
+            out = np.empty((ntime,) + block.shape[1:], dtype=block.dtype)
+        out[nread:(nread + len(block))] = block
+        nread += len(block)
+
+    return out, coords
+
+
+def _netcdf_time_coords(f, coords):
+    """Replace numeric time coordinates with dates.  Returns units, cal."""
+    times = f.variables[BaseDataObject.TIME]
+    cal = getattr(times, 'calendar', None)
+    idx, tvals = coords[BaseDataObject.TIME]
+    if cal is not None:
+        dates = ncf.num2date(tvals, times.units, calendar=cal)
+    else:
+        dates = ncf.num2date(tvals, times.units)
+    coords[BaseDataObject.TIME] = (idx, dates)
+    return times.units, cal
+
+
+def netcdf_to_data_obj(filename, var_name, h5file=None, force_flat=True,
+                       **subset):
+    """
+    Create a data object from a netCDF variable.  Keyword arguments select
+    a subset to read (time_range, lat_bounds, lon_bounds, time_stride,
+    space_stride, max_mem; see _read_netcdf_subset).
+    """
 
     f = ncf.Dataset(filename, 'r')
 
     try:
-        data = f.variables[var_name]
-        coords = {BaseDataObject.LAT: f.variables['lat'][:],
-                  BaseDataObject.LON: f.variables['lon'][:]}
-        times = f.variables['time']
-        coords[BaseDataObject.TIME] = ncf.num2date(times[:], times.units)
-
-        for i, key in enumerate(data.dimensions):
-            if key in coords.keys():
-                coords[key] = (i, coords[key])
+        data, coords = _read_netcdf_subset(f, var_name, **subset)
+        units, _ = _netcdf_time_coords(f, coords)
 
         if h5file is not None:
-            return Hdf5DataObject(data[:], h5file, dim_coords=coords,
-                                  force_flat=force_flat, time_units=times.units)
+            return Hdf5DataObject(data, h5file, dim_coords=coords,
+                                  force_flat=force_flat)
 
         else:
-            return BaseDataObject(data[:], dim_coords=coords,
-                                  force_flat=force_flat, time_units=times.units)
+            return BaseDataObject(data, dim_coords=coords,
+                                  force_flat=force_flat, time_units=units)
 
     finally:
         f.close()
 
 
-def posterior_ncf_to_data_obj(filename, var_name, h5file=None):
+def posterior_ncf_to_data_obj(filename, var_name, h5file=None,
+                              time_range=None, time_stride=1,
+                              max_mem=_BLOCK_BYTES):
 
     f = ncf.Dataset(filename, 'r')
 
     try:
-        data = f.variables[var_name][:]
+        data, tcoords = _read_netcdf_subset(f, var_name,
+                                            time_range=time_range,
+                                            time_stride=time_stride,
+                                            max_mem=max_mem)
         coords = {BaseDataObject.LAT: f.variables['lat'][:],
                   BaseDataObject.LON: f.variables['lon'][:]}
-        times = (0, f.variables['time'][:])
+        times = (0, tcoords[BaseDataObject.TIME][1])
 
         coords['time'] = times
         coords['lat'] = (1, coords['lat'])
@@ -710,18 +1396,102 @@ def posterior_ncf_to_data_obj(filename, var_name, h5file=None):
         f.close()
 
 
-def netcdf_to_hdf5_container(infile, var_name, outfile, data_dir='/'):
+def _time_chunkshape(shape, itemsize, chunk_bytes=2**20):
+    """
+    Chunkshape of whole fields over as many time steps as fit in about
+    chunk_bytes, so both full fields and time series of a region are read
+    from a few chunks.
+    """
+    field_bytes = itemsize * int(np.prod(shape[1:]))
+    ntime = max(1, min(shape[0], chunk_bytes // max(field_bytes, 1)))
+    return (ntime,) + tuple(shape[1:])
+
+
+def netcdf_to_hdf5_container(infile, var_names, outfile, data_dir='/',
+                             chunkshape=None, complevel=5, blosc_threads=None,
+                             max_mem=_BLOCK_BYTES):
+    """
+    Convert netCDF variables with leading time dimensions to a
+    Blosc-compressed HDF5 container readable by hdf5_to_data_obj.
+
+    Parameters
+    ----------
+    infile: str
+        netCDF file to convert.
+    var_names: str or list of str
+        Variable(s) to convert.
+    outfile: str
+        HDF5 file to create.
+    data_dir: str, optional
+        Group of the output nodes.
+    chunkshape: tuple or dict, optional
+        Chunkshape of the output CArrays, or a dictionary of chunkshapes by
+        variable name.  Whole fields over about 1 MB of time steps if None.
+    complevel: int, optional
+        Blosc compression level.
+    blosc_threads: int, optional
+        Number of Blosc compression threads.  Defaults to the number of
+        CPUs.
+    max_mem: int, optional
+        Approximate bytes copied per block of time steps.
+
+    Returns
+    -------
+    dict
+        Bytes converted and seconds taken for each variable.
+    """
+    if isinstance(var_names, basestring):
+        var_names = [var_names]
+    if blosc_threads is None:
+        blosc_threads = mp.cpu_count()
+
+    prev_threads = tb.set_blosc_max_threads(blosc_threads)
     f = ncf.Dataset(infile, 'r')
     outf = tb.open_file(outfile, 'w', filters=tb.Filters(complib='blosc',
-                                                         complevel=5))
+                                                         complevel=complevel))
 
+    report = {}
     try:
-        data = f.variables[var_name]
-        atom = tb.Atom.from_dtype(data.datatype)
-        shape = data.shape
-        out = empty_hdf5_carray(outf, data_dir, var_name, atom, shape)
-        for i, chunk in enumerate(data):
-                out[i] = chunk
+        for var_name in var_names:
+            start = time.time()
+            data = f.variables[var_name]
+            atom = tb.Atom.from_dtype(data.dtype)
+            shape = data.shape
+
+            if isinstance(chunkshape, dict):
+                var_chunks = chunkshape.get(var_name)
+            else:
+                var_chunks = chunkshape
+            if var_chunks is None:
+                var_chunks = _time_chunkshape(shape, data.dtype.itemsize)
+
+            out = empty_hdf5_carray(outf, data_dir, var_name, atom, shape,
+                                    chunkshape=var_chunks,
+                                    createparents=True)
+
+            # Blocks of whole output chunks of time steps
+            chunk_t = out.chunkshape[0]
+            step_bytes = data.dtype.itemsize * int(np.prod(shape[1:]))
+            block_t = max(chunk_t, int(max_mem // max(step_bytes, 1)) //
+                          chunk_t * chunk_t)
+            for t0 in xrange(0, shape[0], block_t):
+                block = data[t0:(t0 + block_t)]
+                if np.ma.isMaskedArray(block):
+                    if block.dtype.kind == 'f':
+                        block = block.filled(np.nan)
+                    else:
+                        block = np.ma.getdata(block)
+                out[t0:(t0 + block_t)] = block
+
+            outf.flush()
+            elapsed = time.time() - start
+            nbytes = step_bytes * shape[0]
+            report[var_name] = {'bytes': nbytes, 'seconds': elapsed}
+            print ('Converted {}: {:.1f} MB in {:.1f} s '
+                   '({:.1f} MB/s)'.format(var_name, nbytes / 1024.**2,
+                                          elapsed,
+                                          nbytes / 1024.**2 /
+                                          max(elapsed, 1e-6)))
 
         lat = var_to_hdf5_carray(outf, data_dir, 'lat',
                                  f.variables['lat'][:])
@@ -735,12 +1505,15 @@ def netcdf_to_hdf5_container(infile, var_name, outfile, data_dir='/'):
         coord_dims = {'lat': lat.attrs, 'lon': lon.attrs,
                       'time': time_out.attrs}
 
-        for i, key in enumerate(f.dimensions.iterkeys()):
+        for i, key in enumerate(f.variables[var_names[0]].dimensions):
             if key in coord_dims.keys():
                 coord_dims[key].index = i
     finally:
         f.close()
         outf.close()
+        tb.set_blosc_max_threads(prev_threads)
+
+    return report
 
 def hdf5_to_data_obj(filename, var_name, h5file=None, data_dir='/'):
 
@@ -6,13 +6,23 @@ Author: Andre Perkins
 """
 
 import numpy as np
-from numpy.linalg import pinv, matrix_rank, cond
-from scipy.linalg import eig, inv
+from numpy.linalg import LinAlgError
+from scipy.linalg import (eig, eigh, inv, qr, solve_triangular, cho_factor,
+                          cho_solve, fractional_matrix_power)
 from math import ceil
 import tables as tb
 import cPickle as cpk
-
-from Stats import calc_eofs
+import copy
+from collections import namedtuple
+import multiprocessing as mp
+from os.path import join as path_join
+import shutil
+import tempfile
+
+from scipy.signal import detrend
+from Stats import (calc_eofs, run_mean, SkillAccumulator, skill_summary,
+                   _column_blocks, _gram_eigsh, _eof_var_stats,
+                   _BLOCK_BYTES)
 import DataTools as Dt
 
 
@@ -23,28 +33,186 @@ def _area_wgt(data, lats):
     return data * scale
 
 
-def _calc_m(x0, xt):
-    """Calculate either L or G for forecasting (using nomenclature
-    from Newman 2013"""
-    
+def _solve_m(x0, xts, method='qr', ridge=0., rcond=1e-7):
+    """
+    Solve G x0 = xt in the least-squares sense for a stack of lagged states,
+    i.e. G(tau) = C(tau) C(0)^-1 (using nomenclature from Newman 2013).
+
+    Parameters
+    ----------
+    x0: ndarray
+        Initial states with dimensions J x T.
+    xts: ndarray
+        Lagged states with dimensions K x J x T.
+    method: str, optional
+        'qr' uses a QR factorization of x0^T, which avoids forming C(0) and
+        squaring the condition number of x0.  'cholesky' solves with the
+        Cholesky factor of C(0).  'pinv' uses a rank-guarded
+        pseudo-inverse of C(0).  QR and Cholesky fall back to 'pinv' when
+        C(0) is rank deficient.
+    ridge: float, optional
+        Ridge term added to C(0), relative to its mean eigenvalue.
+    rcond: float, optional
+        Relative cutoff on the singular values of x0 (rcond**2 for the
+        eigenvalues of C(0)) used to determine its rank.
+
+    Returns
+    -------
+    g: ndarray
+        Propagator matrices with dimensions K x J x J.
+    info: dict
+        Solver used, rank of x0, and condition numbers of x0 and C(0).
+    """
+
     # These represent the C(tau) and C(0) covariance matrices
     #    Note: x is an anomaly vector, no division by N-1 because it's undone
     #    in the inversion anyways
-    
-    x0x0 = np.dot(x0, x0.T)
-    x0xt = np.dot(xt, x0.T)
-
-    # print 'Matrix Ranks...
-    # print 'C(0): ', matrix_rank(x0x0)
-    # print 'C(1): ', matrix_rank(x0xt)
-    # print 'inv(C(0)) ', matrix_rank(pinv(x0x0))
-    # print 'C(1)*C(0)^-1: ', matrix_rank(dot(x0xt, pinv(x0x0)))
+    nmodes, ntimes = x0.shape
+    nlags = xts.shape[0]
+    lam = 0.
+    if ridge:
+        lam = ridge * np.einsum('ij,ij->', x0, x0) / nmodes
+
+    def _from_transposed_solve(sol):
+        # sol is J x (K*J) holding [G_1^T ... G_K^T]
+        return sol.reshape(nmodes, nlags, nmodes).transpose(1, 2, 0)
+
+    if method == 'qr':
+        x0_t = x0.T
+        if lam:
+            x0_t = np.vstack((x0_t, np.sqrt(lam) * np.eye(nmodes)))
+        q, r = qr(x0_t, mode='economic')
+        r_diag = np.abs(np.diag(r))
+        rank = (r_diag > rcond * r_diag.max()).sum()
+
+        if rank == nmodes:
+            cond_x0 = np.linalg.cond(r)
+            # G_k^T = R^-1 Q^T xt_k^T, ridge rows of xt are zero
+            p = np.matmul(xts, q[:ntimes])
+            rhs = p.transpose(2, 0, 1).reshape(nmodes, nlags*nmodes)
+            g = _from_transposed_solve(solve_triangular(r, rhs))
+            info = {'method': 'qr', 'rank': rank, 'cond_x0': cond_x0,
+                    'cond_c0': cond_x0**2}
+            return g, info
+
+    c0 = np.dot(x0, x0.T) + lam * np.eye(nmodes)
+    c_taus = np.matmul(xts, x0.T)                            # K x J x J
+
+    if method == 'cholesky':
+        try:
+            cho = cho_factor(c0)
+            pivots = np.diag(cho[0])**2
+            if pivots.min() <= rcond**2 * pivots.max():
+                raise LinAlgError('C(0) is numerically rank deficient.')
+            rhs = c_taus.transpose(2, 0, 1).reshape(nmodes, nlags*nmodes)
+            g = _from_transposed_solve(cho_solve(cho, rhs))
+            cond_c0 = np.linalg.cond(c0)
+            info = {'method': 'cholesky', 'rank': nmodes,
+                    'cond_x0': np.sqrt(cond_c0), 'cond_c0': cond_c0}
+            return g, info
+        except LinAlgError:
+            pass
+    elif method not in ['qr', 'pinv']:
+        raise ValueError('Unrecognized G solver method: {}'.format(method))
+
+    # Rank-guarded pseudo-inverse of C(0)
+    evals, evecs = eigh(c0)
+    keep = evals > rcond**2 * evals.max()
+    evecs = evecs[:, keep]
+    c0_inv = np.dot(evecs / evals[keep], evecs.T)
+    cond_c0 = evals.max() / evals[keep].min()
+    info = {'method': 'pinv', 'rank': keep.sum(),
+            'cond_x0': np.sqrt(cond_c0), 'cond_c0': cond_c0}
+
+    return np.matmul(c_taus, c0_inv), info
+
+
+def _calc_m(x0, xt, method='qr', ridge=0., ret_info=False):
+    """Calculate either L or G for forecasting (using nomenclature
+    from Newman 2013.  See _solve_m for the solver options.  If ret_info
+    is True the rank and conditioning report is also returned."""
 
-    # print 'Condition number'
-    # print 'C(0): ', cond(x0x0)
-    
     # Calculate tau-lag G value
-    return np.dot(x0xt, pinv(x0x0))
+    g, info = _solve_m(x0, xt[None], method=method, ridge=ridge)
+
+    if ret_info:
+        return g[0], info
+    else:
+        return g[0]
+
+
+def _eig_decomp(g, tau0=1.0, max_cond=1e12):
+    """
+    Eigendecomposition of a lag-tau0 propagator G for computing G**tau.
+
+    Returns the eigenvalues, eigenvectors, and inverse eigenvector matrix
+    along with the implied dynamical operator L = log(G)/tau0.  If the
+    eigenvectors are too ill-conditioned to invert reliably (G is close to
+    defective) the inverse is returned as None.
+    """
+    evals, evecs = eig(g)
+
+    if np.linalg.cond(evecs) > max_cond:
+        return evals, evecs, None, None
+
+    evecs_inv = inv(evecs)
+    l_mat = np.dot(evecs * (np.log(evals) / tau0), evecs_inv).real
+
+    return evals, evecs, evecs_inv, l_mat
+
+
+def _lagged_states(data, lags, tdim):
+    """
+    Gather the lagged states x(t+tau) for all lags in a single pass over the
+    data.  Returns a lags x J x tdim array.
+    """
+    idx = lags[:, None] + np.arange(tdim)
+
+    return data[:, idx].transpose(1, 0, 2)
+
+
+def _calib_source(data_obj):
+    """
+    Calibration data to decompose.  For Hdf5DataObjects whose current data is
+    stored in a databin, the HDF5 CArray is returned so that the EOF solver
+    can stream it instead of using the in-memory copy.
+    """
+    if isinstance(data_obj, Dt.Hdf5DataObject):
+        databin = data_obj._data_bins.get(data_obj._curr_data_key)
+        if databin is not None and databin.shape == data_obj.data.shape:
+            return databin
+
+    return data_obj.data
+
+
+def _save_final_step(data_obj, steps):
+    """
+    Mark the last preprocessing step to be saved for Hdf5DataObjects, so its
+    databin is an HDF5 CArray that _calib_source can hand to the EOF solver.
+    """
+    if steps and isinstance(data_obj, Dt.Hdf5DataObject):
+        steps[-1][1]['save'] = True
+
+
+def _lead_samples(leads, wsize):
+    """
+    Lead times in wsize units as whole numbers of samples.  Fractional
+    leads must fall on a sample, e.g. monthly leads (1/12) of a yearly
+    window.
+    """
+    samples = np.asarray(leads, dtype=np.float64) * wsize
+    whole = np.round(samples).astype(np.int64)
+    if not np.allclose(samples, whole):
+        raise ValueError('Lead times must be whole numbers of samples: '
+                         '{}'.format(samples))
+    if whole.ndim == 0:
+        return int(whole)
+    return whole
+
+
+def _fcast_node_name(lead):
+    """HDF5 node name of a forecast lead, e.g. f2 or f0_25 for a quarter."""
+    return 'f{:g}'.format(lead).replace('.', '_')
 
 
 def _create_h5_fcast_grps(h5f, dest, atom, shape, fcast_times):
@@ -62,15 +230,217 @@ def _create_h5_fcast_grps(h5f, dest, atom, shape, fcast_times):
         out_fcast.append(
             Dt.empty_hdf5_carray(h5f,
                                  dest,
-                                 'f{:d}'.format(lead),
+                                 _fcast_node_name(lead),
                                  atom,
                                  shape,
                                  createparents=True,
-                                 title='{:d} Year Forecast'.format(lead)))
+                                 title='{:g} Year Forecast'.format(lead)))
 
     return out_fcast
 
 
+class CalibratedLIM(namedtuple('CalibratedLIM',
+                               ['eofs', 'train_data', 'G_1', 'G_1_info',
+                                'G_1_evals', 'G_1_evecs', 'G_1_evecs_inv', 'L',
+                                'direct_g', 'direct_g_info', 'climo',
+                                'var_stats', 'bedge', 'tedge'])):
+    """
+    Immutable result of a LIM calibration.
+
+    Holds the EOFs (N x J), the calibration data projected onto the EOFs
+    (J x M), the one window lag propagator G_1 with its eigendecomposition
+    and L, the direct G(tau) matrices for each forecast time, the
+    climatology, EOF variance statistics, and the running mean edges.
+    Produced by LIM.calibrate and consumed by the LIM forecast methods.
+    """
+    __slots__ = ()
+
+
+def _rm_rows(data, wsize, offset, nrows):
+    """
+    Running means along the leading axis of data for the nrows windows
+    starting at offset.
+    """
+    means, _, _ = run_mean(data, wsize)
+    return means[offset:offset+nrows]
+
+
+def _center_phases(data, period):
+    """Remove the mean of each phase (e.g. month) along the leading axis."""
+    shp = data.shape
+    by_yr = data.reshape((shp[0] // period, period) + shp[1:])
+    return (by_yr - by_yr.mean(axis=0)).reshape(shp)
+
+
+def _remove_trend(data):
+    """Remove the linear least-squares fit along the leading axis."""
+    nt = data.shape[0]
+    basis, _ = qr(np.vstack((np.ones(nt), np.arange(nt))).T, mode='economic')
+    return data - np.dot(basis, np.dot(basis.T, data))
+
+
+# Per-process state for resampling trial workers (set by _init_trial_worker)
+_trial_worker_state = {}
+
+
+def _to_memmap(data, filename):
+    """Write array-like data to a memmap file, returns (filename, shp, dtype)"""
+    mmap = np.memmap(filename, dtype=data.dtype, mode='w+', shape=data.shape)
+    mmap[:] = data[:]
+    mmap.flush()
+    del mmap
+
+    return filename, data.shape, data.dtype
+
+
+def _from_memmap(spec):
+    """Open a read-only memmap from a (filename, shp, dtype) spec"""
+    fname, shp, dtype = spec
+    return np.memmap(fname, dtype=dtype, mode='r', shape=shp)
+
+
+def _init_trial_worker(lim, obs_spec, rm_spec, anom_spec, gram_spec,
+                       time_coords, lat_grid, use_lag1, blas_threads):
+    """Initialize a resampling trial worker with read-only shared inputs."""
+    if blas_threads is not None:
+        Dt.limit_blas_threads(blas_threads)
+
+    _trial_worker_state['lim'] = lim
+    _trial_worker_state['obs'] = _from_memmap(obs_spec)
+    _trial_worker_state['rm'] = _from_memmap(rm_spec)
+    _trial_worker_state['anom'] = _from_memmap(anom_spec)
+    if gram_spec is not None:
+        _trial_worker_state['gram'] = {key: _from_memmap(spec)
+                                       for key, spec in gram_spec.items()}
+    else:
+        _trial_worker_state['gram'] = None
+    _trial_worker_state['time'] = time_coords
+    _trial_worker_state['lat'] = lat_grid
+    _trial_worker_state['use_lag1'] = use_lag1
+
+
+def _trial_worker(trial):
+    """Run a single resampling trial in a worker process."""
+    state = _trial_worker_state
+    return state['lim']._run_trial(trial, state['obs'], state['rm'],
+                                   state['anom'], state['time'],
+                                   state['lat'], state['use_lag1'],
+                                   gram=state['gram'])
+
+
+def extraction_weights(lat_grid, lon_grid, points=None, regions=None):
+    """
+    Weights (NxR) that extract point values and area weighted region means
+    from fields with a flattened spatial dimension of length N.
+
+    Parameters
+    ----------
+    lat_grid: ndarray
+        Latitude of each spatial point.
+    lon_grid: ndarray
+        Longitude of each spatial point.
+    points: list of tuple, optional
+        (lat, lon) of each point.  The nearest (great circle) grid point is
+        used.
+    regions: list of ndarray or tuple, optional
+        Boolean spatial mask of each region, or its bounds as (lat_min,
+        lat_max, lon_min, lon_max).  Longitude bounds wrap if lon_min >
+        lon_max, e.g. (-5, 5, 190, 240) for Nino 3.4.  Regions are averaged
+        with cos(lat) weights.
+
+    Returns
+    -------
+    ndarray
+        Extraction weights with a column for each point followed by one for
+        each region.
+    """
+    points = [] if points is None else list(points)
+    regions = [] if regions is None else list(regions)
+    lat_rad = np.radians(lat_grid)
+    lon_rad = np.radians(lon_grid)
+
+    weights = np.zeros((len(lat_grid), len(points) + len(regions)))
+    for i, (lat, lon) in enumerate(points):
+        lat, lon = np.radians(lat), np.radians(lon)
+        cos_dist = (np.sin(lat_rad) * np.sin(lat) +
+                    np.cos(lat_rad) * np.cos(lat) * np.cos(lon_rad - lon))
+        weights[np.argmax(cos_dist), i] = 1
+
+    lons = np.mod(lon_grid, 360)
+    for i, region in enumerate(regions, len(points)):
+        if isinstance(region, tuple):
+            lat_min, lat_max, lon_min, lon_max = region
+            lon_min, lon_max = np.mod(lon_min, 360), np.mod(lon_max, 360)
+            mask = (lat_grid >= lat_min) & (lat_grid <= lat_max)
+            if lon_min <= lon_max:
+                mask &= (lons >= lon_min) & (lons <= lon_max)
+            else:
+                mask &= (lons >= lon_min) | (lons <= lon_max)
+        else:
+            mask = np.asarray(region, dtype=np.bool)
+
+        if not mask.any():
+            raise ValueError('Region {:d} contains no grid points.'.format(
+                i - len(points)))
+        region_wgt = np.cos(lat_rad) * mask
+        weights[:, i] = region_wgt / region_wgt.sum()
+
+    return weights
+
+
+def extract(fcast, eofs, weights):
+    """
+    Point or region forecasts from EOF-space forecast output without
+    building the physical fields.
+
+    The extraction weights are projected onto the EOFs once, reading only
+    the EOF rows spanned by points with nonzero weight.
+
+    Parameters
+    ----------
+    fcast: ndarray-like
+        LIM forecast output from LIM.forecast (KxJxM^) or
+        ResampleLIM.forecast (KxTxJxM^), or a list of the forecast CArrays
+        for each lead.
+    eofs: ndarray-like
+        EOFs returned with the forecasts (NxJ, or TxNxJ for trials).
+    weights: ndarray
+        Extraction weights (NxR), e.g. from extraction_weights.
+
+    Returns
+    -------
+    ndarray
+        Forecasts at each point or region, KxM^xR (KxTxM^xR for trials).
+    """
+    weights = np.asarray(weights)
+    if weights.ndim != 2 or weights.shape[0] != eofs.shape[-2]:
+        raise ValueError('Extraction weights must have dimensions of '
+                         'spatial points ({:d}) x selections.'.format(
+                             eofs.shape[-2]))
+    if not weights.shape[1]:
+        raise ValueError('No points or regions selected for extraction.')
+    empty = np.flatnonzero(~weights.any(axis=0))
+    if len(empty):
+        raise ValueError('Empty point/region selection, all extraction '
+                         'weights are zero for columns {}.'.format(
+                             list(empty)))
+
+    rows = np.flatnonzero(weights.any(axis=1))
+    span, sub = Dt.read_span(rows)
+    weights = weights[rows]
+
+    if eofs.ndim == 2:
+        proj = np.dot(weights.T, eofs[span][sub])             # RxJ
+        return np.array([np.dot(proj, lead_fcast[:]).T
+                         for lead_fcast in fcast])
+
+    # Trials x R x J
+    proj = np.einsum('nr,tnj->trj', weights, eofs[:, span][:, sub])
+    return np.array([np.matmul(np.swapaxes(lead_fcast[:], 1, 2),
+                               np.swapaxes(proj, 1, 2))
+                     for lead_fcast in fcast])
+
+
 class LIM(object):
     """Linear inverse forecast model.
     
@@ -96,7 +466,9 @@ class LIM(object):
     """
 
     def __init__(self, calib_data_obj, wsize, fcast_times, fcast_num_pcs,
-                 detrend_data=False, h5file=None, L_eig_bump=None):
+                 detrend_data=False, h5file=None, L_eig_bump=None,
+                 eof_solver='full', eof_max_mem=None, m_solver='qr',
+                 m_ridge=0.):
         """
         Parameters
         ----------
@@ -112,12 +484,25 @@ class LIM(object):
         fcast_times: array_like
             1D array-like object containing all times to forecast at with the
             LIM. Times should be in wsize units. i.e. 1yr forecast should
-            be integer value "1" not 12 (if wsize=12).
+            be integer value "1" not 12 (if wsize=12).  Fractional times
+            that fall on a sample are allowed, e.g. 1/12. for one month.
         fcast_num_pcs: int
             Number of principal components to include in forecast calculations
         H5file: HDF5_Object, Optional
             File object to store LIM output.  It will create a series of
             directories under the given group
+        eof_solver: str, Optional
+            Solver used by Stats.calc_eofs ('full', 'randomized', 'gram' or
+            'auto').  Truncated solvers only compute the retained modes.
+        eof_max_mem: int, Optional
+            Memory budget in bytes for streaming the calibration data through
+            the EOF solver.  Hdf5DataObject calibration data stored in a
+            databin is then read block-by-block from the HDF5 file.
+        m_solver: str, Optional
+            Least-squares solver for the G matrices ('qr', 'cholesky' or
+            'pinv').  See _solve_m.
+        m_ridge: float, Optional
+            Ridge term added to C(0) relative to its mean eigenvalue.
         """
         assert isinstance(calib_data_obj, Dt.BaseDataObject), \
             'calib_data_obj must be an instance of BaseDataObject or subclass.'
@@ -125,8 +510,10 @@ class LIM(object):
         self._data_obj = calib_data_obj
         self._from_precalib = False
         self._calibration = None
+        self._calib = None
         self._wsize = wsize
-        self.fcast_times = np.array(fcast_times, dtype=np.int16)
+        self.fcast_times = np.array(fcast_times, dtype=np.float64)
+        self._fcast_samples = _lead_samples(self.fcast_times, wsize)
         self._neigs = fcast_num_pcs
         self._h5file = h5file
         self._bedge = 0 
@@ -135,11 +522,32 @@ class LIM(object):
         self._climo = None
         self._detrend_data = detrend_data
         self.G_1 = None
+        self.G_1_info = None
+        self.L = None
         self.eig_bump = L_eig_bump
+        self._eof_solver = eof_solver
+        self._eof_max_mem = eof_max_mem
+        self._m_solver = m_solver
+        self._m_ridge = m_ridge
 
         self.set_calibration()
 
-    def set_calibration(self, data_obj=None):
+    def calibrate(self, data_obj=None):
+        """
+        Calibrate the LIM on a dataset without modifying the LIM.
+
+        Parameters
+        ----------
+        data_obj: DataTools.BaseDataObject or subclass, optional
+            Calibration dataset.  Running mean, anomaly, area weighting and
+            detrending are applied to it as needed.  Defaults to the
+            calibration data object the LIM was created with.
+
+        Returns
+        -------
+        CalibratedLIM
+            Immutable calibration result to be passed to forecast methods.
+        """
         if data_obj is not None:
             assert isinstance(data_obj, Dt.BaseDataObject), \
                 'data_obj must be an instance of BaseDataObject or'\
@@ -152,36 +560,172 @@ class LIM(object):
         assert data_obj._leading_time, \
             'data_obj expects a leading sampling dimension'
 
+        # Preprocessing steps fused into a single pass over the data
+        steps = []
         if not data_obj.is_run_mean:
-            _, self._bedge, self._tedge = data_obj.calc_running_mean(
-                self._wsize, save=False,  shave_yr=True)
-        else:
-            self._bedge = 0
-            # TODO: set _tedge to something reasonable
-
+            steps.append(('run_mean', {'window_size': self._wsize,
+                                       'shave_yr': True}))
         if not data_obj.is_anomaly:
-            data_obj.calc_anomaly(self._wsize)
-            self._climo = data_obj.climo[:]
-
+            steps.append(('anomaly', {'yr_size': self._wsize, 'save': True}))
         if not data_obj.is_area_weighted:
-            data_obj.area_weight_data(save=False)
-
+            steps.append(('area_weight', {}))
         if self._detrend_data and not data_obj.is_detrended:
-            data_obj.detrend_data(save=False)
+            steps.append(('detrend', {}))
+        _save_final_step(data_obj, steps)
 
-        self._calibration = data_obj.data
-        self._eof_var_stats = {}
-        self._eofs, _ = calc_eofs(self._calibration, self._neigs,
-                                  var_stats_dict=self._eof_var_stats)
+        # TODO: set tedge to something reasonable for run mean input
+        _, bedge, tedge = data_obj.preprocess(steps)
+
+        climo = None
+        if 'anomaly' in dict(steps):
+            climo = data_obj.climo[:]
+
+        return self._calibrate_data(_calib_source(data_obj), climo=climo,
+                                    bedge=bedge, tedge=tedge)
 
-        train_data = np.dot(self._eofs.T, self._calibration[:].T)
+    def _calibrate_data(self, data, climo=None, bedge=0, tedge=None):
+        """
+        Build a CalibratedLIM from preprocessed (running mean, anomaly, area
+        weighted and detrended) calibration data with dimensions MxN.
+        """
+        var_stats = {}
+        eofs, svals, pcs = calc_eofs(data,
+                                     self._neigs,
+                                     ret_pcs=True,
+                                     var_stats_dict=var_stats,
+                                     solver=self._eof_solver,
+                                     max_mem=self._eof_max_mem)
+
+        # Projection of calibration data onto the EOFs (S * V^T), avoids
+        # another pass over the calibration data
+        train_data = svals[:, None] * pcs
+
+        return self._calibrate_from_pcs(eofs, train_data, climo=climo,
+                                        var_stats=var_stats, bedge=bedge,
+                                        tedge=tedge)
+
+    def _calibrate_from_pcs(self, eofs, train_data, climo=None,
+                            var_stats=None, bedge=0, tedge=None):
+        """
+        Build a CalibratedLIM from EOFs and the calibration data projected
+        onto them (J x M).
+        """
         tdim = train_data.shape[1] - self._wsize
         x0 = train_data[:, 0:tdim]
         x1 = train_data[:, self._wsize:]
-        self.G_1 = _calc_m(x0, x1)
+        g_1, g_1_info = _calc_m(x0, x1, method=self._m_solver,
+                                ridge=self._m_ridge, ret_info=True)
 
         if self.eig_bump is not None:
-            self.G_1 = self.eig_adjust(self.G_1)
+            g_1 = self.eig_adjust(g_1)
+
+        # Cache the eigendecomposition for computing lead-tau propagators
+        evals, evecs, evecs_inv, l_mat = _eig_decomp(g_1)
+
+        # Direct G(tau) needs a calibration record longer than the max lag
+        if train_data.shape[1] > self._fcast_samples.max():
+            direct_g, direct_g_info = self._calc_direct_g(train_data)
+        else:
+            direct_g = direct_g_info = None
+
+        return CalibratedLIM(eofs=eofs, train_data=train_data, G_1=g_1,
+                             G_1_info=g_1_info, G_1_evals=evals,
+                             G_1_evecs=evecs, G_1_evecs_inv=evecs_inv, L=l_mat,
+                             direct_g=direct_g, direct_g_info=direct_g_info,
+                             climo=climo, var_stats=var_stats, bedge=bedge,
+                             tedge=tedge)
+
+    def set_calibration(self, data_obj=None):
+        """
+        Calibrate the LIM and store the result as the default calibration
+        used by the forecast methods.
+        """
+        if data_obj is None:
+            data_obj = self._data_obj
+
+        calib = self.calibrate(data_obj)
+        self._calibration = data_obj.data
+        self._set_calib(calib)
+
+    def _set_calib(self, calib):
+        """Set the default calibration and its convenience attributes."""
+        self._calib = calib
+        self._eofs = calib.eofs
+        self._eof_var_stats = calib.var_stats
+        self.G_1 = calib.G_1
+        self.G_1_info = calib.G_1_info
+        self.L = calib.L
+        self._bedge = calib.bedge
+        if calib.tedge is not None:
+            self._tedge = calib.tedge
+        if calib.climo is not None:
+            self._climo = calib.climo
+        else:
+            # Keep the previously used climatology for the initial data
+            self._calib = calib._replace(climo=self._climo)
+
+    def get_propagators(self, leads, in_samples=False, calib=None):
+        """
+        Calculate the forecast propagators G(tau) = G_1**tau for each lead.
+
+        Propagators are computed from the cached eigendecomposition of G_1 as
+        a single batched operation.  Since G_1 is the one window (wsize) lag
+        propagator, leads can be fractional (e.g. monthly leads of a yearly
+        window).
+
+        Parameters
+        ----------
+        leads: array_like
+            Lead times to calculate propagators for.  In wsize units unless
+            in_samples is True.
+        in_samples: bool, optional
+            Leads are given in number of samples (e.g. months) rather than
+            wsize units.
+        calib: CalibratedLIM, optional
+            Calibration to use instead of the LIM's current calibration.
+
+        Returns
+        -------
+        ndarray
+            Propagator matrices with dimensions of leads x J x J
+        """
+        if calib is None:
+            calib = self._calib
+
+        leads = np.atleast_1d(np.asarray(leads, dtype=np.float64))
+        if in_samples:
+            leads = leads / self._wsize
+
+        if calib.G_1_evecs_inv is None:
+            # G_1 nearly defective, fall back to direct matrix powers
+            return np.array([fractional_matrix_power(calib.G_1, tau).real
+                             for tau in leads])
+
+        evals_tau = calib.G_1_evals[None, :] ** leads[:, None]
+        g_tau = np.einsum('ij,kj,jl->kil', calib.G_1_evecs, evals_tau,
+                          calib.G_1_evecs_inv)
+
+        return g_tau.real
+
+    def _calc_direct_g(self, train_data):
+        """
+        Calculate G(tau) = C(tau) C(0)^-1 for each forecast time directly
+        from the training data.  x0 is factored once and all lagged
+        states are solved for together.
+        """
+        # Training data has to allow for lag of max forecast time
+        lags = self._fcast_samples
+        train_tdim = train_data.shape[1] - lags.max()
+        x0 = train_data[:, 0:train_tdim]
+
+        xts = _lagged_states(train_data, lags, train_tdim)
+        g_taus, info = _solve_m(x0, xts, method=self._m_solver,
+                                ridge=self._m_ridge)
+
+        if self.eig_bump is not None:
+            g_taus = np.array([self.eig_adjust(g) for g in g_taus])
+
+        return g_taus, info
 
     def eig_adjust(self, G):
 
@@ -196,19 +740,22 @@ class LIM(object):
 
     def save_precalib(self, filename):
 
-        tmp_calib = self._calibration
+        tmp_calibration = self._calibration
         tmp_dobj = self._data_obj
+        tmp_calib = self._calib
 
         self._calibration = None
         self._data_obj = None
+        self._calib = self._calib._replace(train_data=None, direct_g=None)
 
         with open(filename, 'w') as f:
             cpk.dump(self, f)
 
         print 'Saved pre-calibrated LIM to {}'.format(filename)
 
-        self._calibration = tmp_calib
+        self._calibration = tmp_calibration
         self._data_obj = tmp_dobj
+        self._calib = tmp_calib
 
     @staticmethod
     def from_precalib(filename):
@@ -219,7 +766,7 @@ class LIM(object):
         return obj
 
 
-    def forecast(self, t0_data, use_lag1=True, use_h5=True):
+    def forecast(self, t0_data, use_lag1=True, use_h5=True, calib=None):
         """Run LIM forecast from given data.
         
         Performs LIM forecast over the times specified by the
@@ -239,6 +786,10 @@ class LIM(object):
             Apply linear detrending to anomaly timeseries data
         use_h5: bool
             Use H5file to store forecast data instead of an ndarray.
+        calib: CalibratedLIM, optional
+            Calibration to forecast with instead of the LIM's current
+            calibration.  The LIM itself is not modified by forecasting, so
+            with use_h5=False forecasts may run concurrently.
 
             
         Returns
@@ -264,7 +815,10 @@ class LIM(object):
         assert t0_data._leading_time, \
             't0_data expects a leading sampling dimension'
 
-        if self._from_precalib and not use_lag1:
+        if calib is None:
+            calib = self._calib
+
+        if calib.direct_g is None and not use_lag1:
             print ('LIM class created from pre calibrated file. '
                    'Switching use_lag1 to True due to no _calibration data.')
             use_lag1 = True
@@ -273,7 +827,7 @@ class LIM(object):
         if not t0_data.is_run_mean:
             t0_data.calc_running_mean(self._wsize, shave_yr=True, save=False)
         if not t0_data.is_anomaly:
-            t0_data.calc_anomaly(self._wsize, save=False, climo=self._climo)
+            t0_data.calc_anomaly(self._wsize, save=False, climo=calib.climo)
 
         if self._detrend_data and not t0_data.is_detrended:
             t0_data.detrend_data(save=False)
@@ -297,52 +851,143 @@ class LIM(object):
             fcast_out = np.zeros(fcast_out_shp)
 
         # Calibrate the LIM with (J=neigs) EOFs from training data
-        eofs = self._eofs     # eofs is NxJ
+        eofs = calib.eofs     # eofs is NxJ
 
         # Project our testing data into eof space
         proj_t0_data = np.dot(eofs.T, forecast_data[:].T)              # JxM^
 
         # Forecasts using L to determine G-values
         if use_lag1:
-            # Calculate L from time-lag of one window size (1-year for our LIM)
-
-            g_1 = self.G_1
-            for i, tau in enumerate(self.fcast_times):
-                g = g_1**tau
-                xf = np.dot(g, proj_t0_data)
-                if use_h5:
-                    fcast_out[i][:] = xf
-                else:
-                    fcast_out[i] = xf
+            # Propagators for all leads from the cached eigendecomposition of
+            # the one window size lag G_1 (1-year for our LIM)
+            g_taus = self.get_propagators(self.fcast_times, calib=calib)
 
         # Forecasts using G only    
         else:
-            # Training data has to allow for lag of max forecast time
-            train_data = np.dot(eofs.T, self._calibration[:].T)    # JxM^
-            train_tdim = train_data.shape[1] - self.fcast_times[-1]*self._wsize
-            x0 = train_data[:, 0:train_tdim]
+            g_taus = calib.direct_g
 
-            for i, tau in enumerate(self.fcast_times*self._wsize):
-                xt = train_data[:, tau:(train_tdim+tau)]
-                g = _calc_m(x0, xt)
+        xf = np.einsum('kij,jm->kim', g_taus, proj_t0_data)
+        for i, fcast_bin in enumerate(fcast_out):
+            fcast_bin[:] = xf[i]
 
-                if self.eig_bump is not None:
-                    g = self.eig_adjust(g)
+        # Save EOFs to HDF5 file if needed
+        if self._h5file is not None and use_h5:
+            eof_out = Dt.var_to_hdf5_carray(h5f, '/data', 'eofs', eofs)
+        else:
+            eof_out = eofs
 
-                xf = np.dot(g, proj_t0_data)
-                if use_h5:
-                    fcast_out[i][:] = xf
-                else:
-                    fcast_out[i] = xf
+        return fcast_out, eof_out
+
+    def forecast_batch(self, t0_sources, use_lag1=True, use_h5=True,
+                       calib=None):
+        """Run LIM forecasts from many initial condition datasets at once.
+
+        The sources are preprocessed (running mean, anomaly, and detrending
+        as in forecast) in a single vectorized pass over the stacked data,
+        projected onto the EOFs together, and propagated for every lead with
+        one set of propagators.
+
+        Parameters
+        ----------
+        t0_sources: sequence of DataTools.BaseDataObject or ndarray
+            Initial condition datasets with the same number of samples on
+            the calibration grid.  Data objects must be at the same
+            preprocessing stage.  An ndarray is stacked raw data with
+            dimensions of sources x samples x spatial (SxMxN).
+        use_lag1: bool
+            Flag for using only the G_1-matrix for forecasting
+        use_h5: bool
+            Store the forecasts in a single /data/fcast_batch node of the
+            LIM's HDF5 file instead of an ndarray.
+        calib: CalibratedLIM, optional
+            Calibration to forecast with instead of the LIM's current
+            calibration.
+
+        Returns
+        -------
+        fcast_out: ndarray-like
+            LIM forecasts in a KxSxJxM^ matrix where K corresponds to each
+            forecast time and S to each source.
+        eofs: ndarray-like
+            EOFs for converting forecast output between EOF and physical
+            space.  Returned in an NxJ matrix.
+        """
+        if calib is None:
+            calib = self._calib
+
+        if calib.direct_g is None and not use_lag1:
+            print ('LIM class created from pre calibrated file. '
+                   'Switching use_lag1 to True due to no _calibration data.')
+            use_lag1 = True
+
+        if isinstance(t0_sources, np.ndarray):
+            is_run_mean = is_anomaly = is_detrended = False
+            data = t0_sources
+        else:
+            states = set((src.is_run_mean, src.is_anomaly, src.is_detrended)
+                         for src in t0_sources)
+            if len(states) != 1:
+                raise ValueError('Initial condition data objects must be at '
+                                 'the same preprocessing stage.')
+            is_run_mean, is_anomaly, is_detrended = states.pop()
+            if len(set(src.data.shape for src in t0_sources)) != 1:
+                raise ValueError('Initial condition data objects must have '
+                                 'the same shape.')
+            data = np.array([src.data[:] for src in t0_sources])
+
+        # Samples x sources x spatial for the preprocessing along time
+        data = np.swapaxes(data, 0, 1)
+        if not is_run_mean:
+            data, _, _ = run_mean(data, self._wsize, shave_yr=True)
+            is_anomaly = is_detrended = False
+        if not is_anomaly:
+            nsamp = data.shape[0]
+            data = data.reshape((nsamp // self._wsize, self._wsize) +
+                                data.shape[1:])
+            climo = calib.climo
+            if climo is None:
+                climo = data.mean(axis=0)
+            else:
+                climo = climo[:, None, :]
+            data = (data - climo).reshape((nsamp,) + data.shape[2:])
+        if self._detrend_data and not is_detrended:
+            data = detrend(data, axis=0, type='linear')
+
+        eofs = calib.eofs
+        proj_t0_data = np.einsum('nj,msn->jsm', eofs, data)        # JxSxM^
+
+        if use_lag1:
+            g_taus = self.get_propagators(self.fcast_times, calib=calib)
+        else:
+            g_taus = calib.direct_g
+
+        xf = np.einsum('kij,jsm->ksim', g_taus, proj_t0_data)
 
-        # Save EOFs to HDF5 file if needed
         if self._h5file is not None and use_h5:
+            h5f = self._h5file
+            fcast_out = Dt.var_to_hdf5_carray(h5f, '/data', 'fcast_batch', xf,
+                                              createparents=True)
             eof_out = Dt.var_to_hdf5_carray(h5f, '/data', 'eofs', eofs)
         else:
+            fcast_out = xf
             eof_out = eofs
 
         return fcast_out, eof_out
 
+    def extraction_weights(self, points=None, regions=None):
+        """
+        Point and region extraction weights (NxR) on the grid of the
+        calibration data.  See extraction_weights for the arguments.
+        """
+        assert self._data_obj is not None, \
+            'No calibration data grid. Use LIM.extraction_weights with ' \
+            'explicit coordinates instead.'
+        lat_key = self._data_obj.LAT
+        lon_key = self._data_obj.LON
+        grids = self._data_obj.get_coordinate_grids([lat_key, lon_key])
+        return extraction_weights(grids[lat_key], grids[lon_key],
+                                  points=points, regions=regions)
+
 
 class ResampleLIM(LIM):
     """
@@ -355,7 +1000,9 @@ class ResampleLIM(LIM):
     """
 
     def __init__(self, calib_data_object, wsize, fcast_times, fcast_num_pcs,
-                 hold_chk_pct, num_trials, detrend_data=False, h5file=None):
+                 hold_chk_pct, num_trials, detrend_data=False, h5file=None,
+                 eof_solver='full', eof_max_mem=None, m_solver='qr',
+                 m_ridge=0., gram_downdate=False):
         """
         Parameters
         ----------
@@ -377,7 +1024,8 @@ class ResampleLIM(LIM):
         fcast_times: array_like
             1D array-like object containing all times to forecast at with the
             LIM. Times should be in wsize units. i.e. 1yr forecast should
-            be integer value "1" not 12 (if wsize=12).
+            be integer value "1" not 12 (if wsize=12).  Fractional times
+            that fall on a sample are allowed, e.g. 1/12. for one month.
         fcast_num_pcs: int
             Number of principal components to include in forecast calculations
         hold_chk_pc: float
@@ -392,20 +1040,43 @@ class ResampleLIM(LIM):
         H5file: HDF5_Object, Optional
             File object to store LIM output.  It will create a series of
             directories under the given group
+        eof_solver: str, Optional
+            Solver used by Stats.calc_eofs for each trial calibration.
+        eof_max_mem: int, Optional
+            Memory budget in bytes for streaming data through the EOF solver.
+        m_solver: str, Optional
+            Least-squares solver for the G matrices.  See _solve_m.
+        m_ridge: float, Optional
+            Ridge term added to C(0) relative to its mean eigenvalue.
+        gram_downdate: bool, Optional
+            Calculate the Gram matrix of the observations once and derive
+            each trial's EOFs from the rows outside of the held-out chunk
+            instead of decomposing each training set.  Requires memory for
+            two float64 time x time matrices of the full record, but trials
+            no longer decompose a time x space matrix.  Each trial finds
+            the leading modes of its time x time training Gram matrix with
+            Lanczos iterations, about O(T^2 * k) for T samples and k modes,
+            instead of the O(T^2 * N + T^3) of eof_solver='gram'.  EOF
+            signs may differ from the direct calculation.
         """
 
+        self._gram_downdate = gram_downdate
         self._orig_is_run_mean = calib_data_object.is_run_mean
         self._orig_is_anomaly = calib_data_object.is_anomaly
 
         LIM.__init__(self, calib_data_object, wsize, fcast_times, fcast_num_pcs,
-                     detrend_data=detrend_data, h5file=h5file)
+                     detrend_data=detrend_data, h5file=h5file,
+                     eof_solver=eof_solver, eof_max_mem=eof_max_mem,
+                     m_solver=m_solver, m_ridge=m_ridge)
 
         # Need original input dataset for resampling
         self._original_obs = calib_data_object.reset_data('orig')
         self._num_trials = num_trials
+        self.skill = None
+        self.skill_summary = None
 
         # Initialize important indice limits for resampling procedure
-        _fcast_tdim = self.fcast_times[-1]*wsize
+        _fcast_tdim = self._fcast_samples.max()
         self._fcast_tdim = _fcast_tdim
 
         # 2*self._wsize is to account for edge removal from running mean
@@ -423,7 +1094,8 @@ class ResampleLIM(LIM):
         # Calculate edge concatenation lengths for anomaly procedure
         self._anom_edges = [self._bedge, self._tedge]
 
-    def forecast(self, use_lag1=True):
+    def forecast(self, use_lag1=True, n_workers=None, blas_threads=1,
+                 scratch_dir=None, verify=False, store_fcasts=True):
         """Run LIM forecast using resampling
 
         Performs LIM forecast over the times specified by the
@@ -437,10 +1109,25 @@ class ResampleLIM(LIM):
         ----------
         use_lag1: bool
             Flag for using only the G_1-matrix for forecasting
-        detrend_data: bool
-            Apply linear detrending to anomaly timeseries data
-        use_h5: bool
-            Use H5file to store forecast data instead of an ndarray.
+        n_workers: int, optional
+            Number of worker processes to distribute trials over.  Trials
+            are run sequentially if None or 1.
+        blas_threads: int, optional
+            Number of BLAS threads to allow in each worker process.  Set to
+            None to leave the worker thread settings alone.
+        scratch_dir: str, optional
+            Directory for the memory-mapped copies of the observations that
+            are shared read-only with the workers (e.g. /dev/shm).  Defaults
+            to the system temporary directory.
+        verify: bool, optional
+            Verify each trial against the observations as it finishes.
+            Local anomaly correlation, its significance, and the coefficient
+            of efficiency for each lead are accumulated from running sums and
+            set in the skill attribute (and /stats in the HDF5 file).
+        store_fcasts: bool, optional
+            Keep the forecasts and EOFs of every trial.  Set to False with
+            verify to only keep the skill statistics, in which case None is
+            returned for the forecasts and EOFs.
 
 
         Returns
@@ -457,6 +1144,9 @@ class ResampleLIM(LIM):
         -----
         This method will set the fcast_out attribute for the LIM. If an HDF5
         obj is provided it will output the forecast to this file if desired.
+        Only the parent process writes to the HDF5 file.  Verification
+        statistics match those from LIMTools.fcast_corr and fcast_ce on the
+        stored forecasts.
         """
 
         print 'Beginning resampling forecast experiment.'
@@ -465,7 +1155,9 @@ class ResampleLIM(LIM):
                    self._data_obj.data.shape[1],
                    self._neigs]
 
-        if self._h5file is not None:
+        if not store_fcasts:
+            _fcast_out = _eofs_out = None
+        elif self._h5file is not None:
             h5f = self._h5file
 
             fcast_atom = tb.Atom.from_dtype(self._data_obj.data_dtype)
@@ -487,76 +1179,394 @@ class ResampleLIM(LIM):
             _fcast_out = np.zeros(self._trials_out_shp)
             _eofs_out = np.zeros(eof_shp)
 
-        for j, trial in enumerate(self._test_start_idx):
+        # create testing and training inputs shared by all trials
+        obs_dat = self._original_obs
+        # Running mean of the full record, training sets are assembled from
+        # views of it
+        if self._orig_is_run_mean:
+            rm_dat = obs_dat
+        else:
+            rm_dat, _, _ = run_mean(obs_dat, self._wsize, shave_yr=True)
+        if self._detrend_data:
+            anom_dat = self._data_obj.detrended
+        else:
+            anom_dat = self._data_obj.anomaly
+        time_key = self._data_obj.TIME
+        lat_key = self._data_obj.LAT
+        dim_coords = self._data_obj.get_dim_coords([time_key])
+        time_coords = dim_coords[time_key][1]
+        lat_grid = self._data_obj.get_coordinate_grids([lat_key])[lat_key]
+
+        if self._gram_downdate:
+            gram = self._full_record_gram(obs_dat, rm_dat.shape[0], lat_grid)
+        else:
+            gram = None
+
+        if verify:
+            skill_accs = [SkillAccumulator(anom_dat.shape[1],
+                                           weights=np.cos(np.radians(lat_grid)))
+                          for _ in self.fcast_times]
+
+        pool = None
+        tmp_dir = None
+        try:
+            if n_workers is None or n_workers <= 1:
+                results = (self._run_trial(trial, obs_dat, rm_dat, anom_dat,
+                                           time_coords, lat_grid, use_lag1,
+                                           gram=gram)
+                           for trial in self._test_start_idx)
+            else:
+                tmp_dir = tempfile.mkdtemp(prefix='pylim_', dir=scratch_dir)
+                obs_spec = _to_memmap(obs_dat, path_join(tmp_dir, 'obs.dat'))
+                if rm_dat is obs_dat:
+                    rm_spec = obs_spec
+                else:
+                    rm_spec = _to_memmap(rm_dat, path_join(tmp_dir, 'rm.dat'))
+                anom_spec = _to_memmap(anom_dat,
+                                       path_join(tmp_dir, 'anom.dat'))
+                if gram is not None:
+                    gram_spec = {key: _to_memmap(val, path_join(
+                                     tmp_dir, 'gram_{}.dat'.format(key)))
+                                 for key, val in gram.items()}
+                else:
+                    gram_spec = None
+
+                pool = mp.Pool(n_workers,
+                               initializer=_init_trial_worker,
+                               initargs=(self._worker_copy(), obs_spec,
+                                         rm_spec, anom_spec, gram_spec,
+                                         time_coords, lat_grid, use_lag1,
+                                         blas_threads))
+                results = pool.imap(_trial_worker, self._test_start_idx)
+
+            for j, (_fcast, _eofs) in enumerate(results):
+                if verify:
+                    self._verify_trial(skill_accs, self._test_start_idx[j],
+                                       _fcast, _eofs, anom_dat)
+
+                if store_fcasts:
+                    # Place forecasts in the right trial, for the
+                    #   corresponding forecast bin.
+                    for i, fcast_bin in enumerate(_fcast_out):
+                        fcast_bin[j] = _fcast[i]
+                    _eofs_out[j] = _eofs
+
+                print 'Trial {} finished.'.format(j+1)
+
+            if pool is not None:
+                pool.close()
+                pool.join()
+        finally:
+            if pool is not None:
+                pool.terminate()
+            if tmp_dir is not None:
+                shutil.rmtree(tmp_dir, ignore_errors=True)
+
+        if verify:
+            self._set_skill(skill_accs, anom_dat, lat_grid)
 
-            # beginning and end indices for test chunk
-            bot_idx, top_idx = (self._anom_edges[0] + trial,
-                                self._anom_edges[0] + trial + self._test_tdim)
+        return _fcast_out, _eofs_out
 
-            # create testing and training sets
-            obs_dat = self._original_obs
-            if self._detrend_data:
-                anom_dat = self._data_obj.detrended
-            else:
-                anom_dat = self._data_obj.anomaly
-            time_key = self._data_obj.TIME
-            lat_key = self._data_obj.LAT
-            dim_coords = self._data_obj.get_dim_coords([time_key])
-            time_coords = dim_coords[time_key][1]
-            lat_dim_coords = \
-                (1, self._data_obj.get_coordinate_grids([lat_key])[lat_key])
-
-            train_set = np.concatenate((obs_dat[0:bot_idx],
-                                       obs_dat[top_idx:]),
-                                       axis=0)
-            train_times = np.concatenate((time_coords[0:bot_idx],
-                                         time_coords[top_idx:]),
-                                         axis=0)
-            # test_set = obs_dat[(bot_idx - self._anom_edges[0]):
-            #                    (top_idx + self._anom_edges[1])]
-            test_set = anom_dat[trial:(trial+self._test_tdim)]
-
-            # test_times = time_coords[(bot_idx - self._anom_edges[0]):
-            #                          (top_idx + self._anom_edges[1])]
-            test_times = time_coords[bot_idx:top_idx]
-
-            train_dim_coords = {time_key: (0, train_times),
-                                lat_key: lat_dim_coords}
-            resample_dat_obj = Dt.BaseDataObject(
-                train_set, dim_coords=train_dim_coords,
-                force_flat=True, save_none=True,
-                is_anomaly=self._orig_is_anomaly,
-                is_run_mean=self._orig_is_run_mean)
+    def _verify_trial(self, skill_accs, trial, fcast, eofs, anom_dat):
+        """
+        Add the forecasts of a trial and the verifying observations for each
+        lead to the skill accumulators.
+        """
+        for acc, tau, lead_fcast in zip(skill_accs, self._fcast_samples,
+                                        fcast):
+            obs_start = trial + tau
+            acc.update_eof(lead_fcast, eofs,
+                           anom_dat[obs_start:(obs_start + self._test_tdim)])
+
+    def _set_skill(self, skill_accs, anom_dat, lat_grid):
+        """
+        Calculate the skill statistics from the accumulators and save them
+        to the skill and skill_summary attributes and HDF5 file.
+        """
+        clim_var = anom_dat[:].var(axis=0, ddof=1)
+        corr, signif = zip(*[acc.corr_signif() for acc in skill_accs])
+        self.skill = {'corr': np.array(corr),
+                      'corr_signif': np.array(signif),
+                      'corr_pval': np.array([acc.corr_pval()
+                                             for acc in skill_accs]),
+                      'ce': np.array([acc.ce(clim_var) for acc in skill_accs]),
+                      'pattern_corr': np.array([acc.pattern_corr()
+                                                for acc in skill_accs])}
+        self.skill_summary = skill_summary(self.skill, lat_grid)
+
+        if self._h5file is not None:
+            for path, stats in [('/stats', self.skill),
+                                ('/stats/summary', self.skill_summary)]:
+                for key, stat in stats.items():
+                    Dt.var_to_hdf5_carray(self._h5file, path, key, stat,
+                                          createparents=True)
+
+    def _run_trial(self, trial, obs_dat, rm_dat, anom_dat, time_coords,
+                   lat_grid, use_lag1=True, gram=None):
+        """
+        Calibrate on the data outside of the held-out chunk starting at
+        trial and forecast from the held-out chunk.
+
+        Returns the EOF-space forecasts (KxJxM^) and EOFs (NxJ) of the trial.
+        """
+        # beginning and end indices for test chunk
+        bot_idx, top_idx = (self._anom_edges[0] + trial,
+                            self._anom_edges[0] + trial + self._test_tdim)
+
+        time_key = Dt.BaseDataObject.TIME
+        lat_key = Dt.BaseDataObject.LAT
+        lat_dim_coords = (1, lat_grid)
+
+        if gram is not None:
+            calib = self._downdate_calibration(bot_idx, top_idx, obs_dat,
+                                               rm_dat, lat_grid, gram)
+        else:
+            train_set, climo = self._training_set(bot_idx, top_idx, obs_dat,
+                                                  rm_dat, lat_grid)
             # use LIM calibration to calculate EOFs
-            LIM.set_calibration(self, data_obj=resample_dat_obj)
-
-            test_dim_coords = {time_key: (0, test_times),
-                               lat_key: lat_dim_coords}
-            forecast_obj = Dt.BaseDataObject(
-                test_set,
-                dim_coords=test_dim_coords,
-                force_flat=True,
-                save_none=True,
-                is_run_mean=True,
-                is_anomaly=True,
-                is_detrended=self._detrend_data)
-
-            _fcast, _eofs = LIM.forecast(self,
-                                         forecast_obj,
-                                         use_h5=False)
-
-            del resample_dat_obj
-            del forecast_obj
-
-            # Place forecasts in the right trial, for the corresponding
-            #   forecast bin.
-            for i, fcast_bin in enumerate(_fcast_out):
-                fcast_bin[j] = _fcast[i]
-            _eofs_out[j] = _eofs
-
-            print 'Trial {} finished.'.format(j+1)
+            calib = LIM._calibrate_data(self, train_set, climo=climo,
+                                        bedge=self._bedge, tedge=self._tedge)
+
+        test_set = anom_dat[trial:(trial+self._test_tdim)]
+        test_times = time_coords[bot_idx:top_idx]
+
+        test_dim_coords = {time_key: (0, test_times),
+                           lat_key: lat_dim_coords}
+        forecast_obj = Dt.BaseDataObject(
+            np.array(test_set),
+            dim_coords=test_dim_coords,
+            force_flat=True,
+            save_none=True,
+            is_run_mean=True,
+            is_anomaly=True,
+            is_detrended=self._detrend_data)
+
+        return LIM.forecast(self, forecast_obj, use_lag1=use_lag1,
+                            use_h5=False, calib=calib)
+
+    def _rm_layout(self):
+        """
+        Running mean window size and the observation index of the first
+        window in the (shaved) running mean.
+        """
+        if self._orig_is_run_mean:
+            return 1, 0
 
-        return _fcast_out, _eofs_out
+        wsize = self._wsize
+        return wsize, self._bedge - ((wsize // 2) + (wsize % 2) - 1)
+
+    def _seam_range(self, bot_idx, wsize, offset):
+        """
+        Training rows from running mean windows that span the held-out chunk
+        starting at bot_idx.  Rows below are windows entirely below the
+        chunk, rows above are entirely above it.
+        """
+        return max(bot_idx - wsize + 1 - offset, 0), bot_idx - offset
+
+    def _training_set(self, bot_idx, top_idx, obs_dat, rm_dat, lat_grid):
+        """
+        Preprocessed calibration data for the observations outside of
+        obs_dat[bot_idx:top_idx].
+
+        Gives the same result as taking the running mean, anomaly, area
+        weighting and detrending of the observations with the held-out chunk
+        removed, without concatenating the remaining observations.  Running
+        mean windows on either side of the held-out chunk are views of the
+        full record running mean (rm_dat), only the windows spanning the seam
+        are recomputed from the observations.
+
+        Returns the training data (M^xN) and its climatology (None if the
+        observations were already anomalies).
+        """
+        test_tdim = top_idx - bot_idx
+        ntrain = rm_dat.shape[0] - test_tdim
+        wsize, offset = self._rm_layout()
+        seam_start, seam_end = self._seam_range(bot_idx, wsize, offset)
+
+        train_set = np.empty((ntrain,) + rm_dat.shape[1:], dtype=rm_dat.dtype)
+        train_set[:seam_start] = rm_dat[:seam_start]
+        if seam_end > seam_start:
+            seam_obs = np.concatenate((obs_dat[seam_start+offset:bot_idx],
+                                       obs_dat[top_idx:top_idx+wsize-1]),
+                                      axis=0)
+            train_set[seam_start:seam_end], _, _ = run_mean(seam_obs, wsize)
+        train_set[seam_end:] = rm_dat[seam_end+test_tdim:]
+
+        climo = None
+        if not (self._orig_is_run_mean and self._orig_is_anomaly):
+            yr_shp = (ntrain // self._wsize, self._wsize) + train_set.shape[1:]
+            by_yr = train_set.reshape(yr_shp)
+            climo = by_yr.mean(axis=0)
+            by_yr -= climo
+
+        train_set *= np.sqrt(abs(np.cos(np.radians(lat_grid))))
+
+        if self._detrend_data:
+            train_set = detrend(train_set, axis=0, type='linear')
+
+        return train_set, climo
+
+    def _full_record_gram(self, obs_dat, nrows, lat_grid):
+        """
+        Gram matrices of the area weighted observations ('obs') and of their
+        full record running mean ('rm', nrows windows) for deriving the
+        training set Gram matrix of each trial.  This is the only pass over
+        the spatial data for the Gram products; the leading modes are
+        still found per trial (see _downdate_calibration).
+        """
+        nobs, nspace = obs_dat.shape
+        scale = np.sqrt(abs(np.cos(np.radians(lat_grid))))
+        center = not (self._orig_is_run_mean and self._orig_is_anomaly)
+
+        obs_gram = np.zeros((nobs, nobs))
+        max_mem = self._eof_max_mem or _BLOCK_BYTES
+        for j0, j1 in _column_blocks(nspace, nobs, max_mem):
+            blk = np.array(obs_dat[:, j0:j1], dtype=np.float64)
+            if center:
+                # Removing the mean of each month shifts every training row
+                # by a constant for its month, which the anomaly removes.
+                # Avoids cancellation in the Gram matrix for offset data.
+                for i in xrange(self._wsize):
+                    blk[i::self._wsize] -= blk[i::self._wsize].mean(axis=0)
+            blk *= scale[j0:j1]
+            obs_gram += np.dot(blk, blk.T)
+
+        wsize, offset = self._rm_layout()
+        if wsize == 1:
+            rm_gram = obs_gram
+        else:
+            rm_gram = _rm_rows(obs_gram, wsize, offset, nrows)
+            rm_gram = _rm_rows(rm_gram.T, wsize, offset, nrows)
+
+        return {'obs': obs_gram, 'rm': rm_gram}
+
+    def _downdate_calibration(self, bot_idx, top_idx, obs_dat, rm_dat,
+                              lat_grid, gram):
+        """
+        Calibration for the observations outside of obs_dat[bot_idx:top_idx]
+        from the full record Gram matrices.
+
+        The training set Gram matrix is the full record running mean Gram
+        matrix with the held-out rows removed, plus the rows for the windows
+        spanning the seam.  The leading modes of its anomaly and detrending
+        projections are found with Lanczos iterations, which only apply the
+        projections to vectors, and the EOFs are recovered from the training
+        rows in a single pass.  Matches the EOFs of _training_set up to sign.
+
+        For T training samples, N spatial points and k retained modes, a
+        trial costs O(T^2) to assemble the training Gram matrix, O(T^2) per
+        Lanczos iteration (about O(T^2 * k) in all) and O(T * N * k) for the
+        EOFs.  eof_solver='gram' forms the training Gram matrix, O(T^2 * N),
+        and eigendecomposes it densely, O(T^3), in every trial.
+        """
+        test_tdim = top_idx - bot_idx
+        nrows, nspace = rm_dat.shape
+        ntrain = nrows - test_tdim
+        wsize, offset = self._rm_layout()
+        seam_start, seam_end = self._seam_range(bot_idx, wsize, offset)
+        center = not (self._orig_is_run_mean and self._orig_is_anomaly)
+
+        # Training rows taken from the full record running mean
+        full_rows = np.r_[0:seam_start, (seam_end + test_tdim):nrows]
+        train_rows = np.r_[0:seam_start, seam_end:ntrain]
+
+        gram_t = np.empty((ntrain, ntrain))
+        gram_t[np.ix_(train_rows, train_rows)] = \
+            gram['rm'][np.ix_(full_rows, full_rows)]
+
+        if seam_end > seam_start:
+            # Observations averaged by each seam window
+            nseam = seam_end - seam_start
+            win = (np.arange(seam_start, seam_end)[:, None] + offset +
+                   np.arange(wsize))
+            win[win >= bot_idx] += test_tdim
+            win = win.ravel()
+
+            seam_obs = gram['obs'][win].reshape(nseam, wsize, -1).mean(axis=1)
+            seam_rm = _rm_rows(seam_obs.T, wsize, offset, nrows).T
+            seam_seam = seam_obs[:, win].reshape(nseam, nseam, wsize)
+
+            gram_t[seam_start:seam_end, train_rows] = seam_rm[:, full_rows]
+            gram_t[train_rows, seam_start:seam_end] = seam_rm[:, full_rows].T
+            gram_t[seam_start:seam_end, seam_start:seam_end] = \
+                seam_seam.mean(axis=2)
+
+        # Training data is Q * A for the anomaly then detrending projections
+        # Q = D * C, so its Gram matrix is Q * A * A^T * Q^T.  Only applied
+        # to the Lanczos vectors, Q * A * A^T * Q^T is never formed.
+        def project(vec):
+            if center:
+                vec = _center_phases(vec, self._wsize)
+            if self._detrend_data:
+                vec = _remove_trend(vec)
+            return vec
+
+        def project_t(vec):
+            if self._detrend_data:
+                vec = _remove_trend(vec)
+            if center:
+                vec = _center_phases(vec, self._wsize)
+            return vec
+
+        def train_gram(vec):
+            return project(np.dot(gram_t, project_t(vec)))
+
+        svals, evecs = _gram_eigsh(train_gram, ntrain, self._neigs)
+
+        # trace(Q * G * Q^T) = trace(G) - trace(V^T * G * V) where V spans
+        # what Q^T * Q removes: the phase means P (C = I - P * P^T) and the
+        # centered trend basis C * B (D = I - B * B^T)
+        total_ss = np.trace(gram_t)
+        removed = []
+        if center:
+            nyrs = ntrain // self._wsize
+            removed.append(np.tile(np.eye(self._wsize), (nyrs, 1)) /
+                           np.sqrt(nyrs))
+        if self._detrend_data:
+            trend = np.vstack((np.ones(ntrain), np.arange(ntrain))).T
+            trend, _ = qr(trend, mode='economic')
+            removed.append(_center_phases(trend, self._wsize) if center
+                           else trend)
+        if removed:
+            removed = np.hstack(removed)
+            total_ss -= (removed * np.dot(gram_t, removed)).sum()
+
+        # EOFs = A^T * Q^T * U / S
+        coefs = project_t(evecs)
+
+        eofs = np.dot(rm_dat[:seam_start].T, coefs[:seam_start])
+        eofs += np.dot(rm_dat[(seam_end + test_tdim):].T, coefs[seam_end:])
+        if seam_end > seam_start:
+            seam_obs = np.concatenate((obs_dat[seam_start+offset:bot_idx],
+                                       obs_dat[top_idx:top_idx+wsize-1]),
+                                      axis=0)
+            seam_dat, _, _ = run_mean(seam_obs, wsize)
+            eofs += np.dot(seam_dat.T, coefs[seam_start:seam_end])
+        eofs *= np.sqrt(abs(np.cos(np.radians(lat_grid))))[:, None] / svals
+        eofs = eofs.astype(rm_dat.dtype)
+
+        var_stats = {}
+        _eof_var_stats(var_stats, svals, total_ss, ntrain, nspace,
+                       self._neigs)
+
+        train_data = svals[:, None] * evecs.T
+
+        return self._calibrate_from_pcs(eofs, train_data, var_stats=var_stats,
+                                        bedge=self._bedge, tedge=self._tedge)
+
+    def _worker_copy(self):
+        """
+        Lightweight copy of the LIM configuration for trial worker processes
+        without the data object, HDF5 file, or calibration data.
+        """
+        lim = copy.copy(self)
+        lim._h5file = None
+        lim._data_obj = None
+        lim._original_obs = None
+        lim._calibration = None
+        lim._calib = None
+
+        return lim
 
     def set_calibration(self, data_obj=None):
         if data_obj is not None:
@@ -571,16 +1581,22 @@ class ResampleLIM(LIM):
         assert data_obj._leading_time, \
             'data_obj expects a leading sampling dimension'
 
-        if not data_obj.is_run_mean:
-            _, self._bedge, self._tedge = data_obj.calc_running_mean(
-                self._wsize, save=False,  shave_yr=True)
-
+        steps = []
+        run_mean_step = not data_obj.is_run_mean
+        if run_mean_step:
+            steps.append(('run_mean', {'window_size': self._wsize,
+                                       'shave_yr': True}))
         if not data_obj.is_anomaly:
             # Saved if we aren't detrending
-            data_obj.calc_anomaly(self._wsize, save=(not self._detrend_data))
-
+            steps.append(('anomaly', {'yr_size': self._wsize,
+                                      'save': not self._detrend_data}))
         if not data_obj.is_detrended and self._detrend_data:
-            data_obj.detrend_data()
+            steps.append(('detrend', {'save': True}))
+        _save_final_step(data_obj, steps)
+
+        _, bedge, tedge = data_obj.preprocess(steps)
+        if run_mean_step:
+            self._bedge, self._tedge = bedge, tedge
 
         self._calibration = data_obj.data
 
@@ -599,3 +1615,9 @@ class ResampleLIM(LIM):
                               coords[self._data_obj.LAT][1])
         Dt.var_to_hdf5_carray(h5f, data_node, 'lon',
                               coords[self._data_obj.LON][1])
+
+        # Latitude of each spatial point for area weighted skill summaries
+        lat_key = self._data_obj.LAT
+        Dt.var_to_hdf5_carray(h5f, data_node, 'lat_grid',
+                              self._data_obj.get_coordinate_grids(
+                                  [lat_key])[lat_key])
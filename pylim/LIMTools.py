@@ -7,15 +7,14 @@ Author: Andre Perkins
 import tables as tb
 import numpy as np
 from scipy.stats import ttest_1samp
-import matplotlib.pyplot as plt
-import matplotlib.cm as cm
-from mpl_toolkits.basemap import Basemap
-from matplotlib.colors import LinearSegmentedColormap
 from itertools import izip
+import multiprocessing as mp
+from numpy.lib.stride_tricks import as_strided
 
 
 import Stats as St
 import DataTools as Dt
+from LIM import _lead_samples, _fcast_node_name
 
 
 """ Methods to help with common LIM tasks."""
@@ -45,7 +44,15 @@ cdict = {'red':     ((0.0, lb[0], lb[0]),
                      (0.7, rd[2], rd[2]),
                      (1.0, dk[2], dk[2]))}
 
-newm = LinearSegmentedColormap('newman', cdict)
+
+
+def _newman_cmap():
+    """
+    Newman colormap built from cdict.  matplotlib is only needed by the
+    plotting helpers, so it is imported when they are called.
+    """
+    from matplotlib.colors import LinearSegmentedColormap
+    return LinearSegmentedColormap('newman', cdict)
 
 
 def area_wgt(data, lats):
@@ -71,7 +78,7 @@ def area_wgt(data, lats):
     return data * scale
 
 
-def build_trial_fcast(fcast_trials, eofs):
+def build_trial_fcast(fcast_trials, eofs, out=None):
     """
     Build forecast dataset from trials and EOFs.  This stacks the forecast
     trials sequentially along the temporal dimension.  I.e. a forecast_trials
@@ -87,6 +94,10 @@ def build_trial_fcast(fcast_trials, eofs):
     eofs: ndarray
         Empirical orthogonal functions corresponding to each trial.
         Dimensions of trials x spatial x num_eigs
+    out: ndarray or tables.CArray, optional
+        Output array with dimensions of (trials * time samples) x spatial,
+        e.g. from DataTools.empty_hdf5_carray for output too large to hold
+        in memory.  HDF5 output is written one trial at a time.
 
     Returns
     -------
@@ -97,28 +108,34 @@ def build_trial_fcast(fcast_trials, eofs):
 
     t_shp = fcast_trials.shape
     dat_shp = [t_shp[0]*t_shp[-1], eofs.shape[1]]
-    phys_fcast = np.zeros(dat_shp, dtype=fcast_trials.dtype)
 
-    for i, (trial, eof) in enumerate(izip(fcast_trials, eofs)):
-        i0 = i*t_shp[-1]  # i * (test time dimension)
-        ie = i*t_shp[-1] + t_shp[-1]
+    if out is not None and not isinstance(out, np.ndarray):
+        for i, (trial, eof) in enumerate(izip(fcast_trials, eofs)):
+            out[i*t_shp[-1]:(i+1)*t_shp[-1]] = np.dot(trial.T, eof.T)
+        return out
 
-        phys_fcast[i0:ie] = np.dot(trial.T, eof.T)
+    if out is None:
+        out = np.empty(dat_shp, dtype=fcast_trials.dtype)
 
-    return phys_fcast
+    # trials x time samples x spatial
+    np.matmul(np.swapaxes(fcast_trials, 1, 2), np.swapaxes(eofs, 1, 2),
+              out=out.reshape(t_shp[0], t_shp[-1], dat_shp[1]))
+
+    return out
 
 
 def build_trial_fcast_from_h5(h5file, tau):
     """
     Build forecast dataset from trials and EOFs that are read
-    from the input HDF5 LIM forecast file.
+    from the input HDF5 LIM forecast file.  See ForecastArchive to read
+    part of the forecasts.
 
     Parameters
     ----------
     h5file: tables.File
         Pytables HDF5 file holding LIM forecast output.
     tau: int
-        Forecast lead time to build forecast dataset from
+        Index of the forecast lead time to build forecast dataset from
 
     Returns
     ndarray
@@ -126,16 +143,170 @@ def build_trial_fcast_from_h5(h5file, tau):
         physical space.
     """
     assert(h5file is not None and type(h5file) == tb.File)
-    try:
-        fcast_trials = h5file.list_nodes(h5file.root.data.fcast_bin)[tau].read()
-        eofs = h5file.root.data.eofs.read()
-    except tb.NodeError as e:
-        raise type(e)(e.message + ' Returning without finishing operation...')
+    archive = ForecastArchive(h5file)
+    fcast = archive[tau]
+
+    return fcast.reshape(-1, archive.shape[-1])
+
+
+def _fcast_nodes(fcast_bin, fcast_times):
+    """
+    Forecast nodes of each lead in fcast_times order.  Nodes are fetched by
+    name since listing the group sorts them as strings (f1, f10, f2, ...).
+    """
+    return [fcast_bin._f_get_child(_fcast_node_name(lead))
+            for lead in fcast_times]
+
+
+class ForecastArchive(object):
+    """
+    Lazily indexed view of the forecasts in a LIM resampling forecast file
+    (see ResampleLIM.forecast) with dimensions of
+    leads x trials x time samples x spatial.
+
+    Indexing reads only the requested leads and trials, the span of the
+    requested times from /data/fcast_bin, and the span of the requested
+    EOF rows from /data/eofs.  Physical-space values are reconstructed for
+    the selection alone, e.g. archive[0, :, :, [10, 11]] gives the first
+    lead forecast of two grid points for every trial without reading the
+    full fields.  Integers, slices, and index sequences are applied to each
+    dimension independently (as in PyTables), and integer indexed
+    dimensions are dropped.
 
-    return build_trial_fcast(fcast_trials, eofs)
+    Parameters
+    ----------
+    h5file: tables.File or str
+        PyTables HDF5 file (or filename, opened read-only) holding LIM
+        forecast output.
+    """
 
+    def __init__(self, h5file):
+        if isinstance(h5file, tb.File):
+            self._own_file = False
+        else:
+            h5file = tb.open_file(h5file, 'r')
+            self._own_file = True
+        self.h5file = h5file
 
-def build_trial_obs(obs, start_idxs, tau, test_tdim):
+        try:
+            data = h5file.root.data
+            self.fcast_times = np.asarray(data._v_attrs.fcast_times)
+            self.test_start_idxs = np.asarray(data._v_attrs.test_start_idxs)
+            self.yrsize = data._v_attrs.yrsize
+            self.test_tdim = data._v_attrs.test_tdim
+            self._eofs = data.eofs
+            self._fcasts = _fcast_nodes(data.fcast_bin, self.fcast_times)
+        except tb.NodeError as e:
+            self.close()
+            raise type(e)(e.message + ' File does not hold LIM resampling '
+                          'forecast output.')
+
+        ntrials, nspace, self.num_eigs = self._eofs.shape
+        self.shape = (len(self.fcast_times), ntrials,
+                      self._fcasts[0].shape[-1], nspace)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def close(self):
+        """Close the file if it was opened by the archive."""
+        if self._own_file and self.h5file.isopen:
+            self.h5file.close()
+
+    def _parse_key(self, key):
+        """Index arrays for each dimension and which ones are dropped."""
+        if not isinstance(key, tuple):
+            key = (key,)
+        if len(key) > len(self.shape):
+            raise IndexError('Too many indices for ForecastArchive.')
+        key += (slice(None),) * (len(self.shape) - len(key))
+
+        idxs = []
+        squeeze = []
+        for dim, (k, size) in enumerate(zip(key, self.shape)):
+            idx = np.arange(size)[k]
+            if idx.ndim == 0:
+                squeeze.append(dim)
+                idx = idx[None]
+            elif idx.size == 0:
+                raise IndexError('Empty selection along dimension '
+                                 '{:d}.'.format(dim))
+            idxs.append(idx)
+
+        return idxs, tuple(squeeze)
+
+    def __getitem__(self, key):
+        idxs, squeeze = self._parse_key(key)
+        lead_idx, trial_idx, time_idx, loc_idx = idxs
+        time_span, time_sub = Dt.read_span(time_idx)
+        loc_span, loc_sub = Dt.read_span(loc_idx)
+
+        out = np.empty((len(lead_idx), len(trial_idx), len(time_idx),
+                        len(loc_idx)), dtype=self._eofs.dtype)
+
+        # EOF rows are shared by every lead of a trial
+        for j, trial in enumerate(trial_idx):
+            eofs = self._eofs[trial, loc_span][loc_sub]
+            for i, lead in enumerate(lead_idx):
+                fcast = self._fcasts[lead][trial, :, time_span][:, time_sub]
+                out[i, j] = np.dot(fcast.T, eofs.T)
+
+        if squeeze:
+            out = out.squeeze(axis=squeeze)
+        return out
+
+    def eof_fcast(self, lead_idx, trial_idx):
+        """EOF space forecast (num_eigs x time samples) of a trial."""
+        return self._fcasts[lead_idx][trial_idx]
+
+    def eofs(self, trial_idx, loc=slice(None)):
+        """EOF rows (spatial x num_eigs) of a trial at the given locations."""
+        loc_span, loc_sub = Dt.read_span(np.arange(self.shape[-1])[loc])
+        return self._eofs[trial_idx, loc_span][loc_sub]
+
+
+def _trial_windows(obs, start_idxs, taus, test_tdim):
+    """
+    Observation windows of test_tdim samples starting at each trial start
+    index plus each lead.  Returns a trials x leads x time x space read-only
+    strided view of obs when the trials and leads are evenly spaced in
+    ascending order, otherwise the windows are gathered with a single index
+    array.
+    """
+    start_idxs = np.asarray(start_idxs, dtype=np.int64)
+    taus = np.asarray(taus, dtype=np.int64)
+    assert (start_idxs.min() + taus.min() >= 0 and
+            start_idxs.max() + taus.max() + test_tdim <= len(obs)), \
+        'Trial windows extend past the observations'
+
+    # Strided view for evenly spaced, non-decreasing trials and leads
+    trial_step = np.diff(start_idxs)
+    tau_step = np.diff(taus)
+    regular = all(not len(step) or ((step == step[0]).all() and step[0] >= 0)
+                  for step in (trial_step, tau_step))
+
+    if regular and isinstance(obs, np.ndarray):
+        row, col = obs.strides
+        trial_step = trial_step[0] if len(trial_step) else 0
+        tau_step = tau_step[0] if len(tau_step) else 0
+        first = start_idxs[0] + taus[0]
+        windows = as_strided(obs[first:],
+                             shape=(len(start_idxs), len(taus), test_tdim,
+                                    obs.shape[1]),
+                             strides=(trial_step*row, tau_step*row, row, col))
+        # Windows overlap, so writing through the view would corrupt obs
+        windows.flags.writeable = False
+        return windows
+
+    time_idx = (start_idxs[:, None, None] + taus[None, :, None] +
+                np.arange(test_tdim))
+    return obs[:][time_idx]
+
+
+def build_trial_obs(obs, start_idxs, tau, test_tdim, out=None):
     """
     Build observation dataset to compare to a forecast dataset built by
     the build_trial_fcast...  methods.
@@ -147,28 +318,48 @@ def build_trial_obs(obs, start_idxs, tau, test_tdim):
         Dimensions of time x space
     start_idxs: list
         List of indices corresponding to trial start times in observations.
-    tau: int
+    tau: int or array_like
         Lead time of the forecast to which the observations are being
-        compared.
+        compared.  If a sequence of leads is given, observations for all
+        leads are built at once.
     test_tdim: int
         Length of time sample for each trial.
+    out: ndarray or tables.CArray, optional
+        Output array for the observations (same dimensions as the return
+        value), e.g. from DataTools.empty_hdf5_carray for output too large
+        to hold in memory.
 
     Returns
     -------
     ndarray
         Observations corresponding to each forecast trial stacked along the
-        temporal dimension.
+        temporal dimension.  For a sequence of leads, observations with
+        dimensions of trials x leads x time x space, which is a read-only
+        view of obs when the trials and leads are evenly spaced.
     """
-    dat_shp = [len(start_idxs)*test_tdim, obs.shape[-1]]
-    obs_data = np.zeros(dat_shp, dtype=obs.dtype)
-
-    for i, idx in enumerate(start_idxs):
-        i0 = i*test_tdim
-        ie = i*test_tdim + test_tdim
-
-        obs_data[i0:ie] = obs[(idx+tau):(idx+tau+test_tdim)]
+    single_lead = np.ndim(tau) == 0
+    windows = _trial_windows(obs, start_idxs, np.atleast_1d(tau), test_tdim)
+
+    if single_lead:
+        windows = windows[:, 0]
+        if out is None:
+            # Stack trials along the temporal dimension
+            dat_shp = [len(start_idxs)*test_tdim, obs.shape[-1]]
+            out = np.empty(dat_shp, dtype=obs.dtype)
+    elif out is None:
+        return windows
+
+    if isinstance(out, np.ndarray):
+        out.reshape(windows.shape)[:] = windows
+    else:
+        # Write HDF5 output one trial at a time
+        for i, trial_obs in enumerate(windows):
+            if single_lead:
+                out[i*test_tdim:(i+1)*test_tdim] = trial_obs
+            else:
+                out[i] = trial_obs
 
-    return obs_data
+    return out
 
 
 def build_trial_obs_from_h5(h5file, tau):
@@ -180,9 +371,9 @@ def build_trial_obs_from_h5(h5file, tau):
     ----------
     h5file: tables.File
         Pytables HDF5 file holding LIM observation data.
-    tau: int
+    tau: float
         Lead time of the forecast to which the observations are being
-        compared.
+        compared, in yrsize units.
 
     Returns
     -------
@@ -200,7 +391,7 @@ def build_trial_obs_from_h5(h5file, tau):
     except tb.NodeError as e:
         raise type(e)(e.message + ' Returning without finishing operation...')
 
-    tau_months = tau*yrsize
+    tau_months = _lead_samples(tau, yrsize)
 
     return build_trial_obs(obs, start_idxs, tau_months, test_tdim)
 
@@ -216,37 +407,26 @@ def calc_corr_signif(fcast, obs, corr=None):
     if corr is None:
         corr = St.calc_lac(fcast, obs)
 
-    signif = np.empty_like(corr, dtype=np.bool)
-
-    if True in (abs(corr) < 0.5):
-        g_idx = np.where(abs(corr) < 0.5)
-        gen_2std = 2./np.sqrt(corr_neff[g_idx])
-        signif[g_idx] = (abs(corr[g_idx]) - gen_2std) > 0
-
-    if True in (abs(corr) >= 0.5):
-        z_idx = np.where(abs(corr) >= 0.5)
-        z = 1./2 * np.log((1 + corr[z_idx]) / (1 - corr[z_idx]))
-        z_2std = 2. / np.sqrt(corr_neff[z_idx] - 3)
-        signif[z_idx] = (abs(z) - z_2std) > 0
-
-    # if True in ((corr_neff <= 3) & (abs(corr) >= 0.5)):
-    #     assert(False) # I have to figure out how to implement T_Test
-    #     trow = np.where((corr_neff <= 20) & (corr >= 0.5))
-    signif[corr_neff <= 3] = False
+    signif = St.calc_corr_signif(corr, corr_neff)
 
     return signif, corr
 
 
 # TODO: Fix CE calculation for comparisons and add reference
-def fcast_ce(h5file):
+def fcast_ce(h5file, max_mem=St._BLOCK_BYTES):
     """
     Calculate the coefficient of efficiency for a LIM forecast at every point.
 
+    All leads and trials are evaluated together by Stats.calc_ce_trials.
+
     Parameters
     ----------
     h5file: tables.File
         PyTables HDF5 file containing LIM forecast data.  All necessary
         variables are loaded from this file.
+    max_mem: int, optional
+        Memory budget in bytes for evaluating blocks of spatial points.  All
+        points are evaluated at once if None.
 
     Returns
     -------
@@ -263,16 +443,9 @@ def fcast_ce(h5file):
     assert(h5file is not None and type(h5file) == tb.File)
 
     # Load necessary data
-    try:
-        obs = h5file.root.data.anomaly_srs[:]
-        test_start_idxs = h5file.root.data.test_start_idxs[:]
-        fcast_times = h5file.root.data.fcast_times[:]
-        fcasts = h5file.list_nodes(h5file.root.data.fcast_bin)
-        eofs = h5file.root.data.eofs[:]
-        yrsize = h5file.root.data._v_attrs.yrsize
-        test_tdim = h5file.root.data._v_attrs.test_tdim
-    except tb.NodeError as e:
-        raise type(e)(e.message + ' Returning without finishing operation...')
+    inputs = _load_skill_inputs(h5file)
+    obs = inputs['obs']
+    fcast_times = inputs['fcast_times']
 
     # Create output location in h5file
     atom = tb.Atom.from_dtype(obs.dtype)
@@ -285,15 +458,13 @@ def fcast_ce(h5file):
         ce_out = np.zeros(ce_shp)
 
     # Calculate CE
-    for i, lead in enumerate(fcast_times):
-        print 'Calculating CE: %i yr fcast' % lead
-        compiled_obs = build_trial_obs(obs, test_start_idxs, lead*yrsize, test_tdim)
-        data = fcasts[i].read()
-        for j, trial in enumerate(data):
-            phys_fcast = np.dot(trial.T, eofs[j].T)
-            ce_out[i] += St.calc_ce(phys_fcast, compiled_obs[j], obs)
-
-        ce_out[i] /= float(len(data))
+    print 'Calculating CE: {} yr fcasts'.format(list(fcast_times))
+    fcasts = np.array([fcast.read() for fcast in inputs['fcasts']])
+    ce_out[:] = St.calc_ce_trials(fcasts, inputs['eofs'], obs,
+                                  inputs['test_start_idxs'],
+                                  _lead_samples(fcast_times,
+                                                inputs['yrsize']),
+                                  inputs['test_tdim'], max_mem=max_mem)
 
     return ce_out
 
@@ -324,7 +495,7 @@ def fcast_corr_old(h5file):
         obs = h5file.root.data.anomaly_srs[:]
         test_start_idxs = h5file.root.data.test_start_idxs[:]
         fcast_times = h5file.root.data.fcast_times[:]
-        fcasts = h5file.list_nodes(h5file.root.data.fcast_bin)
+        fcasts = _fcast_nodes(h5file.root.data.fcast_bin, fcast_times)
         eofs = h5file.root.data.eofs[:]
         yrsize = h5file.root.data._v_attrs.yrsize
         test_tdim = h5file.root.data._v_attrs.test_tdim
@@ -345,8 +516,9 @@ def fcast_corr_old(h5file):
 
     # Calculate LAC
     for i, lead in enumerate(fcast_times):
-        print 'Calculating Correlation: %i yr fcast' % lead
-        compiled_obs = build_trial_obs(obs, test_start_idxs, lead*yrsize, test_tdim)
+        print 'Calculating Correlation: %g yr fcast' % lead
+        compiled_obs = build_trial_obs(obs, test_start_idxs,
+                                       _lead_samples(lead, yrsize), test_tdim)
         data = fcasts[i].read()
         phys_fcast = build_trial_fcast(data, eofs)
 
@@ -362,6 +534,10 @@ def fcast_corr(h5file, avg_trial=False):
     """
     Calculate the local anomaly correlation for a LIM forecast at every point.
 
+    The correlation is calculated in EOF space from each trial's forecast,
+    EOFs, and observations (see Stats.SkillAccumulator.update_eof), so
+    physical space forecasts are never built.
+
     Parameters
     ----------
     h5file: tables.File
@@ -385,19 +561,11 @@ def fcast_corr(h5file, avg_trial=False):
     assert(h5file is not None and type(h5file) == tb.File)
 
     # Load necessary data
-    try:
-        try:
-            obs = h5file.root.data.anomaly[:]
-        except tb.NoSuchNodeError:
-            obs = h5file.root.data.detrended[:]
-        test_start_idxs = h5file.root.data._v_attrs.test_start_idxs
-        fcast_times = h5file.root.data._v_attrs.fcast_times
-        fcasts = h5file.list_nodes(h5file.root.data.fcast_bin)
-        eofs = h5file.root.data.eofs[:]
-        yrsize = h5file.root.data._v_attrs.yrsize
-        test_tdim = h5file.root.data._v_attrs.test_tdim
-    except tb.NodeError as e:
-        raise type(e)(e.message + ' Returning without finishing operation...')
+    inputs = _load_skill_inputs(h5file)
+    obs = inputs['obs']
+    fcast_times = inputs['fcast_times']
+    fcasts = inputs['fcasts']
+    eofs = inputs['eofs']
 
     # Create output location in h5file
     atom = tb.Atom.from_dtype(obs.dtype)
@@ -417,39 +585,289 @@ def fcast_corr(h5file, avg_trial=False):
 
     # Calculate LAC
     for i, lead in enumerate(fcast_times):
-        print 'Calculating Correlation: %i yr fcast' % lead
+        print 'Calculating Correlation: %g yr fcast' % lead
         if avg_trial:
             # TODO: Significance is currently ignored for avg_trial
             corr_trials = np.zeros((len(fcasts[i]), eofs.shape[1]))
-            for j, trial in enumerate(fcasts[i]):
-                phys_fcast = np.dot(trial.T, eofs[j].T)
-                compiled_obs = build_trial_obs(obs, [test_start_idxs[j]],
-                                               lead*yrsize, test_tdim)
-
-                corr_trials[j] = St.calc_lac(phys_fcast, compiled_obs)
-                
-                # if j == 0:
-                #     corr = St.calc_lac(phys_fcast, compiled_obs)
-                # else:
-                #     corr += St.calc_lac(phys_fcast, compiled_obs)
+            for j in xrange(len(fcasts[i])):
+                skill = St.SkillAccumulator(obs.shape[1])
+                _add_trial_skill(inputs, skill, i, j)
+                corr_trials[j] = skill.corr()
 
             corr = corr_trials.mean(axis=0)
             ttest, pval = ttest_1samp(corr_trials, 0, axis=0)
             sig = pval <= 0.05
-            #raise AssertionError
         else:
-            compiled_obs = build_trial_obs(obs, test_start_idxs, lead*yrsize, test_tdim)
-            data = fcasts[i].read()
-            phys_fcast = build_trial_fcast(data, eofs)
-            corr = St.calc_lac(phys_fcast, compiled_obs)
-            sig, _ = calc_corr_signif(phys_fcast, compiled_obs, corr=corr)
+            skill = St.SkillAccumulator(obs.shape[1])
+            for j in xrange(len(fcasts[i])):
+                _add_trial_skill(inputs, skill, i, j)
+            corr, sig = skill.corr_signif()
 
         corr_out[i] = corr
         # if not avg_trial:
         signif_out[i] = sig
 
     return corr_out, signif_out
-    
+
+
+def _load_skill_inputs(h5file):
+    """
+    Nodes and attributes of a LIM resampling forecast file needed to verify
+    the forecasts.
+    """
+    try:
+        data = h5file.root.data
+        try:
+            obs = data.anomaly
+        except tb.NoSuchNodeError:
+            obs = data.detrended
+        inputs = {'obs': obs,
+                  'test_start_idxs': data._v_attrs.test_start_idxs,
+                  'fcast_times': data._v_attrs.fcast_times,
+                  'fcasts': _fcast_nodes(data.fcast_bin,
+                                         data._v_attrs.fcast_times),
+                  'eofs': data.eofs,
+                  'yrsize': data._v_attrs.yrsize,
+                  'test_tdim': data._v_attrs.test_tdim}
+    except tb.NodeError as e:
+        raise type(e)(e.message + ' Returning without finishing operation...')
+
+    # Latitude of each spatial point, reconstructed for a full lat/lon grid
+    # in files written before it was saved
+    inputs['lat_grid'] = None
+    if 'lat_grid' in data:
+        inputs['lat_grid'] = data.lat_grid[:]
+    elif 'lat' in data and 'lon' in data:
+        lats = data.lat[:]
+        nlon = data.lon.shape[0]
+        if len(lats) * nlon == obs.shape[1]:
+            inputs['lat_grid'] = np.repeat(lats, nlon)
+
+    return inputs
+
+
+def _add_trial_skill(inputs, skill, lead_idx, trial_idx):
+    """
+    Add a trial's forecast at a lead and its verifying observations to a
+    Stats.SkillAccumulator.
+    """
+    tau = _lead_samples(inputs['fcast_times'][lead_idx], inputs['yrsize'])
+    obs_start = inputs['test_start_idxs'][trial_idx] + tau
+    obs_end = obs_start + inputs['test_tdim']
+    skill.update_eof(inputs['fcasts'][lead_idx][trial_idx],
+                     inputs['eofs'][trial_idx],
+                     inputs['obs'][obs_start:obs_end])
+
+
+# Per-process state for skill workers (set by _init_skill_worker)
+_skill_worker_state = {}
+
+
+def _init_skill_worker(filename, clim_var, bootstrap=None, blas_threads=None):
+    """Open the forecast file read-only for a skill worker."""
+    if blas_threads is not None:
+        Dt.limit_blas_threads(blas_threads)
+
+    h5file = tb.open_file(filename, 'r')
+    _skill_worker_state['h5file'] = h5file
+    _skill_worker_state['inputs'] = _load_skill_inputs(h5file)
+    _skill_worker_state['clim_var'] = clim_var
+    _skill_worker_state['bootstrap'] = bootstrap
+
+
+def _bootstrap_lead_skill(inputs, lead_idx, clim_var, bootstrap):
+    """Bootstrap skill of all trials of a lead in EOF space."""
+    tau = _lead_samples(inputs['fcast_times'][lead_idx], inputs['yrsize'])
+    test_tdim = inputs['test_tdim']
+    trials = xrange(len(inputs['test_start_idxs']))
+
+    fcasts = (inputs['fcasts'][lead_idx][j] for j in trials)
+    eofs = (inputs['eofs'][j] for j in trials)
+    obs = (inputs['obs'][(idx+tau):(idx+tau+test_tdim)]
+           for idx in inputs['test_start_idxs'])
+
+    skill = St.bootstrap_skill(fcasts, obs, inputs['yrsize'], eofs=eofs,
+                               clim_var=clim_var, **bootstrap)
+    return {key: skill[key] for key in ['corr', 'corr_signif', 'corr_pval',
+                                        'ce', 'ce_signif', 'ce_pval']}
+
+
+def _skill_worker(task):
+    """
+    Verify all trials of a lead (trial index of None) or a single trial.
+    Returns the task with a dictionary of the correlation, its significance
+    and p-value (not for a single trial), the CE, and the pattern
+    correlation of each forecast time (if latitudes are available).
+    """
+    lead_idx, trial_idx = task
+    inputs = _skill_worker_state['inputs']
+    clim_var = _skill_worker_state['clim_var']
+    bootstrap = _skill_worker_state['bootstrap']
+
+    lat_grid = inputs['lat_grid']
+    if lat_grid is not None:
+        weights = np.cos(np.radians(lat_grid))
+    else:
+        weights = None
+
+    skill = St.SkillAccumulator(inputs['obs'].shape[1], weights=weights)
+    if trial_idx is None:
+        trials = xrange(len(inputs['test_start_idxs']))
+    else:
+        trials = [trial_idx]
+
+    for j in trials:
+        _add_trial_skill(inputs, skill, lead_idx, j)
+
+    if trial_idx is None and bootstrap is not None:
+        stats = _bootstrap_lead_skill(inputs, lead_idx, clim_var, bootstrap)
+    else:
+        stats = {'ce': skill.ce(clim_var)}
+        if trial_idx is None:
+            stats['corr'], stats['corr_signif'] = skill.corr_signif()
+            stats['corr_pval'] = skill.corr_pval()
+        else:
+            # Significance of trial averaged correlations is tested
+            # separately
+            stats['corr'] = skill.corr()
+
+    if weights is not None:
+        stats['pattern_corr'] = skill.pattern_corr()
+
+    return lead_idx, trial_idx, stats
+
+
+def fcast_skill(filename, avg_trial=False, n_workers=None, blas_threads=1,
+                n_resamples=None, random_state=None):
+    """
+    Calculate the local anomaly correlation, its significance, and the
+    coefficient of efficiency for every lead of a LIM resampling forecast.
+    Area weighted means, FDR field significance, and pattern correlations
+    (see Stats.skill_summary) are stored under /stats/summary when the
+    latitude of each point is known.
+
+    Leads (and trials when avg_trial is set) are verified independently by
+    worker processes that open the file read-only.  The parent process
+    collects the results and is the only writer to /stats.
+
+    Parameters
+    ----------
+    filename: str
+        PyTables HDF5 file containing LIM forecast data (see fcast_corr).
+        The file must not be open for writing elsewhere in this process.
+    avg_trial: bool, optional
+        Average the correlation of each trial instead of correlating all
+        trials together.  Significance is then from a t-test on the trial
+        correlations, and results are stored as corr_trial_avg and
+        corr_tavg_signif.
+    n_workers: int, optional
+        Number of worker processes.  Leads are verified sequentially if None
+        or 1.
+    blas_threads: int, optional
+        Number of BLAS threads to allow in each worker process.  Set to None
+        to leave the worker thread settings alone.
+    n_resamples: int, optional
+        Test the significance of the correlation and CE with this many
+        block bootstrap resamples (see Stats.bootstrap_skill) using blocks
+        of one year (wsize).  The analytic n_eff test of the correlation is
+        used if None.  Not available with avg_trial.
+    random_state: int, optional
+        Seed for the bootstrap resamples.  The same resamples are used for
+        every lead.
+
+    Returns
+    -------
+    dict
+        Leads x spatial arrays of correlation, significance, p-values, and
+        CE, and leads x time pattern correlations keyed by their node names
+        under /stats.  The field summaries are under the 'summary' key.
+    """
+    if avg_trial and n_resamples is not None:
+        raise ValueError('Bootstrap significance is not available for trial '
+                         'averaged correlations.')
+
+    with tb.open_file(filename, 'r') as h5file:
+        inputs = _load_skill_inputs(h5file)
+        clim_var = inputs['obs'][:].var(axis=0, ddof=1)
+        nleads = len(inputs['fcast_times'])
+        ntrials = len(inputs['test_start_idxs'])
+
+    if n_resamples is not None:
+        if random_state is None:
+            random_state = np.random.randint(np.iinfo(np.int32).max)
+        bootstrap = {'n_resamples': n_resamples,
+                     'random_state': random_state}
+    else:
+        bootstrap = None
+
+    if avg_trial:
+        tasks = [(i, j) for i in xrange(nleads) for j in xrange(ntrials)]
+        stat_shp = (nleads, ntrials)
+    else:
+        tasks = [(i, None) for i in xrange(nleads)]
+        stat_shp = (nleads,)
+
+    if n_workers is None or n_workers <= 1:
+        pool = None
+        _init_skill_worker(filename, clim_var, bootstrap=bootstrap)
+        results = (_skill_worker(task) for task in tasks)
+    else:
+        pool = mp.Pool(n_workers, initializer=_init_skill_worker,
+                       initargs=(filename, clim_var, bootstrap, blas_threads))
+        results = pool.imap_unordered(_skill_worker, tasks)
+
+    stats = {}
+    try:
+        for lead_idx, trial_idx, task_stats in results:
+            idx = lead_idx if trial_idx is None else (lead_idx, trial_idx)
+            for key, stat in task_stats.items():
+                if key not in stats:
+                    stats[key] = np.zeros(stat_shp + stat.shape,
+                                          dtype=stat.dtype)
+                stats[key][idx] = stat
+
+            lead = inputs['fcast_times'][lead_idx]
+            if trial_idx is None:
+                print 'Verified {} yr fcast'.format(lead)
+            else:
+                print 'Verified {} yr fcast, trial {}'.format(lead,
+                                                              trial_idx + 1)
+
+        if pool is not None:
+            pool.close()
+            pool.join()
+    finally:
+        if pool is not None:
+            pool.terminate()
+        else:
+            _skill_worker_state.pop('h5file').close()
+
+    if avg_trial:
+        ttest, pval = ttest_1samp(stats['corr'], 0, axis=1)
+        skill = {'corr_trial_avg': stats['corr'].mean(axis=1),
+                 'corr_tavg_signif': pval <= 0.05,
+                 'ce': stats['ce'].mean(axis=1)}
+        if 'pattern_corr' in stats:
+            skill['pattern_corr'] = stats['pattern_corr'].reshape(nleads, -1)
+    else:
+        skill = stats
+
+    if inputs['lat_grid'] is not None:
+        summary = St.skill_summary(skill, inputs['lat_grid'])
+    else:
+        summary = {}
+
+    with tb.open_file(filename, 'a') as h5file:
+        for path, path_stats in [('/stats', skill),
+                                 ('/stats/summary', summary)]:
+            for key, stat in path_stats.items():
+                Dt.var_to_hdf5_carray(h5file, path, key, stat,
+                                      createparents=True)
+
+    skill['summary'] = summary
+    return skill
+
+
 ####  PLOTTING FUNCTIONS  ####
 
 
@@ -473,6 +891,9 @@ def plot_corrdata(lats, lons, data, title, outfile=None, signif=None):
     signif: ndarray, optional
         Boolean ndarray denoting locations that do not pass 95% significance.
     """
+    import matplotlib.pyplot as plt
+    from mpl_toolkits.basemap import Basemap
+
     plt.clf()
 
     # Colorbar ticks
@@ -482,7 +903,7 @@ def plot_corrdata(lats, lons, data, title, outfile=None, signif=None):
     m = Basemap(projection='gall', llcrnrlat=-90, urcrnrlat=90,
                 llcrnrlon=0, urcrnrlon=360, resolution='c')
     m.drawcoastlines()
-    color = newm
+    color = _newman_cmap()
     color.set_under('#9acce5')
 
     m.contourf(lons, lats, data, latlon=True, cmap=color,
@@ -518,6 +939,10 @@ def plot_cedata(lats, lons, data, title):
     title: str
         Plot title
     """
+    import matplotlib.pyplot as plt
+    import matplotlib.cm as cm
+    from mpl_toolkits.basemap import Basemap
+
     plt.close('all')
     m = Basemap(projection='gall', llcrnrlat=-90, urcrnrlat=90,
                 llcrnrlon=0, urcrnrlon=360, resolution='c')
@@ -553,6 +978,10 @@ def plot_spatial(lats, lons, data, title, outfile=None):
     outfile: str
         Filename to save the png image as
     """
+    import matplotlib.pyplot as plt
+    import matplotlib.cm as cm
+    from mpl_toolkits.basemap import Basemap
+
     plt.clf()
     plt_range = np.max(np.abs(data))
     m = Basemap(projection='gall', llcrnrlat=-90, urcrnrlat=90,
@@ -8,7 +8,13 @@ Author: Andre Perkins
 import numpy as np
 import numexpr as ne
 from math import ceil
-from scipy.linalg import svd
+from itertools import izip
+from scipy.linalg import svd, qr, eigh
+from scipy.sparse.linalg import eigsh, LinearOperator
+from scipy.stats import norm
+
+# Target size (bytes) of temporaries for blocked (out-of-core) operations
+_BLOCK_BYTES = 64 * 1024**2
 
 
 def calc_anomaly(data, yrsize, climo=None):
@@ -53,7 +59,7 @@ def calc_anomaly(data, yrsize, climo=None):
     return anomaly.reshape(old_shp), climo
 
 
-def calc_ce(fcast, trial_obs, obs):
+def calc_ce(fcast, trial_obs, obs, clim_var=None):
     """
     Method to calculate the Coefficient of Efficiency as defined by Nash and
     Sutcliffe 1970.
@@ -64,6 +70,8 @@ def calc_ce(fcast, trial_obs, obs):
         Time series of forecast data. M x N where M is the temporal dimension.
     obs: ndarray
         Time series of observations. M x N
+    clim_var: ndarray, optional
+        Precomputed climatological variance of obs.
 
     Returns
     -------
@@ -74,7 +82,10 @@ def calc_ce(fcast, trial_obs, obs):
     assert(fcast.shape == trial_obs.shape)
 
     # Climatological variance
-    cvar = obs.var(axis=0, ddof=1)
+    if clim_var is None:
+        cvar = obs.var(axis=0, ddof=1)
+    else:
+        cvar = clim_var
 
     # Error variance
     error = ne.evaluate('(trial_obs - fcast)**2')
@@ -83,7 +94,249 @@ def calc_ce(fcast, trial_obs, obs):
     return 1 - evar/cvar
 
 
-def calc_eofs(data, num_eigs, ret_pcs=False, var_stats_dict=None):
+def calc_ce_trials(fcasts, eofs, obs, start_idxs, leads, test_tdim,
+                   clim_var=None, max_mem=None):
+    """
+    Coefficient of efficiency of resampling trial forecasts, averaged over
+    the trials (see calc_ce), for all leads at once.  Forecasts for every
+    lead and trial are converted from EOF space with a single batched matrix
+    multiply per block of spatial points.
+
+    Parameters
+    ----------
+    fcasts: ndarray
+        EOF space forecasts with dimensions of leads x trials x J x M, or
+        trials x J x M for a single lead.
+    eofs: ndarray or tables.CArray
+        EOFs for each trial.  Dimensions of trials x N x J
+    obs: ndarray or tables.CArray
+        Observations the trial forecasts verify against. Time x N
+    start_idxs: array_like
+        Index of each trial's first forecast initialization in obs.
+    leads: int or array_like
+        Lead time (in samples) of each forecast lead.
+    test_tdim: int
+        Number of samples (M) in each trial.
+    clim_var: ndarray, optional
+        Climatological variance at each point.  Calculated from obs if not
+        provided.
+    max_mem: int, optional
+        Memory budget in bytes for the forecast and observation blocks.
+        All spatial points are evaluated at once if None.
+
+    Returns
+    -------
+    CE: ndarray
+        Trial averaged coefficient of efficiency. Leads x N, or N for a
+        single lead.
+    """
+    single_lead = np.ndim(leads) == 0
+    leads = np.atleast_1d(leads)
+    fcasts = np.asarray(fcasts)
+    if single_lead:
+        fcasts = fcasts[None]
+
+    nlead, ntrial, _, nsamp = fcasts.shape
+    assert nsamp == test_tdim
+    nspace = obs.shape[1]
+
+    # Observation indices verifying each lead, trial and sample (K x T x M)
+    time_idx = (np.asarray(start_idxs)[None, :, None] +
+                leads[:, None, None] + np.arange(nsamp))
+
+    ce = np.empty((nlead, nspace))
+    blocks = _column_blocks(nspace, obs.shape[0] + 2*nlead*ntrial*nsamp,
+                            max_mem)
+    for j0, j1 in blocks:
+        obs_blk = np.asarray(obs[:, j0:j1], dtype=np.float64)
+        if clim_var is None:
+            cvar = obs_blk.var(axis=0, ddof=1)
+        else:
+            cvar = clim_var[j0:j1]
+
+        # K x T x M x N forecast errors
+        err = np.matmul(fcasts.transpose(0, 1, 3, 2),
+                        np.asarray(eofs[:, j0:j1]).transpose(0, 2, 1))
+        err -= obs_blk[time_idx]
+
+        evar = np.einsum('ktmn,ktmn->kn', err, err) / (ntrial * nsamp)
+        ce[:, j0:j1] = 1 - evar/cvar
+
+    if single_lead:
+        return ce[0]
+
+    return ce
+
+
+def _column_blocks(nspace, ntime, max_mem=None):
+    """
+    Spatial column ranges such that a float64 time x block slab fits within
+    max_mem bytes.  A single block covers everything if max_mem is None.
+    """
+    if max_mem is None:
+        return [(0, nspace)]
+
+    ncols = max(1, int(max_mem // (ntime * np.dtype(np.float64).itemsize)))
+    return [(j0, min(j0 + ncols, nspace)) for j0 in xrange(0, nspace, ncols)]
+
+
+def _randomized_svd(data, k, n_oversamples=10, n_iter=4, random_state=None,
+                    max_mem=None):
+    """
+    Leading k singular triplets of data.T using a randomized range finder
+    with power iterations (Halko et al. 2011).  Data is only accessed in
+    spatial column blocks, so it may be an out-of-core array.  Also returns
+    the total sum of squares of the data.
+    """
+    if not isinstance(random_state, np.random.RandomState):
+        random_state = np.random.RandomState(random_state)
+
+    nt, ns = data.shape
+    blocks = _column_blocks(ns, nt, max_mem)
+    nsamp = min(k + n_oversamples, nt, ns)
+
+    def space_dot(mat):
+        # data.T * mat
+        out = np.empty((ns, mat.shape[1]), dtype=mat.dtype)
+        for j0, j1 in blocks:
+            out[j0:j1] = np.dot(data[:, j0:j1].T, mat)
+        return out
+
+    def time_dot(mat):
+        # data * mat
+        out = np.zeros((nt, mat.shape[1]), dtype=mat.dtype)
+        for j0, j1 in blocks:
+            out += np.dot(data[:, j0:j1], mat[j0:j1])
+        return out
+
+    omega = random_state.standard_normal((nt, nsamp))
+    omega = omega.astype(data.dtype, copy=False)
+
+    # First pass also accumulates the total sum of squares
+    y = np.empty((ns, nsamp), dtype=omega.dtype)
+    total_ss = 0.
+    for j0, j1 in blocks:
+        blk = data[:, j0:j1]
+        y[j0:j1] = np.dot(blk.T, omega)
+        total_ss += np.einsum('ij,ij->', blk, blk, dtype=np.float64)
+    q, _ = qr(y, mode='economic')
+
+    for _ in xrange(n_iter):
+        z, _ = qr(time_dot(q), mode='economic')
+        q, _ = qr(space_dot(z), mode='economic')
+
+    u_b, svals, v = svd(time_dot(q).T, full_matrices=False)
+    u = np.dot(q, u_b)
+
+    return u[:, :k], svals[:k], v[:k], total_ss
+
+
+def _gram_svd(data, k, max_mem=None):
+    """
+    Leading k singular triplets of data.T from the eigendecomposition of the
+    time x time Gram matrix (snapshot method).  The Gram matrix is
+    accumulated over spatial column blocks and the EOFs are recovered with a
+    second pass, so data may be an out-of-core array.  Also returns the trace
+    of the Gram matrix (total sum of squares).
+    """
+    nt, ns = data.shape
+    blocks = _column_blocks(ns, nt, max_mem)
+
+    gram = _gram(data, max_mem=max_mem)
+    svals, evecs = _gram_eig(gram, k)
+    evecs = evecs.astype(data.dtype)
+
+    eofs = np.empty((ns, k), dtype=data.dtype)
+    for j0, j1 in blocks:
+        eofs[j0:j1] = np.dot(data[:, j0:j1].T, evecs) / svals
+
+    return eofs, svals, evecs.T, np.trace(gram)
+
+
+def _gram(data, max_mem=None):
+    """
+    Time x time Gram matrix (data * data.T) in float64, accumulated over
+    spatial column blocks of data.
+    """
+    nt, ns = data.shape
+    gram = np.zeros((nt, nt), dtype=np.float64)
+    for j0, j1 in _column_blocks(ns, nt, max_mem):
+        blk = data[:, j0:j1]
+        gram += np.dot(blk, blk.T)
+
+    return gram
+
+
+def _gram_eig(gram, k):
+    """
+    Leading k singular values and right singular vectors (as columns) of
+    the data from its Gram matrix, in descending order.
+    """
+    nt = gram.shape[0]
+    evals, evecs = eigh(gram, eigvals=(nt - k, nt - 1))
+
+    # eigh returns ascending order
+    svals = np.sqrt(np.maximum(evals[::-1], 0))
+    return svals, evecs[:, ::-1]
+
+
+def _gram_eigsh(matvec, n, k):
+    """
+    Leading k singular values and right singular vectors (as columns) of
+    the data from a function applying its n x n Gram matrix to a vector,
+    in descending order.  Lanczos iterations (ARPACK) only need products
+    with the Gram matrix, so it never has to be formed.  Uses a dense
+    solve when k is too large for ARPACK (k >= n - 1).
+    """
+    if k >= n - 1:
+        return _gram_eig(matvec(np.eye(n)), k)
+
+    gram_op = LinearOperator((n, n), matvec=matvec, dtype=np.float64)
+    evals, evecs = eigsh(gram_op, k=k, which='LA')
+
+    order = np.argsort(evals)[::-1]
+    svals = np.sqrt(np.maximum(evals[order], 0))
+    return svals, evecs[:, order]
+
+
+def _eof_var_stats(var_stats_dict, svals, total_ss, nt, ns, num_eigs):
+    """Fill var_stats_dict with the variance statistics of an EOF solve."""
+    try:
+        eig_vals = (svals**2) / (nt*ns)
+        total_var = total_ss / (nt*ns)
+        var_expl_by_mode = eig_vals / total_var
+        var_expl_by_retained = var_expl_by_mode[0:num_eigs].sum()
+
+        var_stats_dict['nt'] = nt
+        var_stats_dict['ns'] = ns
+        var_stats_dict['eigvals'] = eig_vals
+        var_stats_dict['num_ret_modes'] = num_eigs
+        var_stats_dict['total_var'] = total_var
+        var_stats_dict['var_expl_by_mode'] = var_expl_by_mode
+        var_stats_dict['var_expl_by_ret'] = var_expl_by_retained
+    except TypeError as e:
+        print 'Must past dictionary type to var_stats_dict in order to ' \
+              'output variance statistics.'
+        print e
+
+
+def _select_eof_solver(shape, num_eigs, out_of_core=False):
+    """Choose an EOF solver from the data dimensions and number of modes."""
+    nt, ns = shape
+    min_dim = min(nt, ns)
+
+    if out_of_core:
+        return 'gram' if nt <= 4000 else 'randomized'
+    elif min_dim <= 100 or num_eigs > min_dim // 4:
+        return 'full'
+    elif ns >= 10*nt and nt <= 4000:
+        return 'gram'
+    else:
+        return 'randomized'
+
+
+def calc_eofs(data, num_eigs, ret_pcs=False, var_stats_dict=None,
+              solver='full', random_state=None, max_mem=None):
     """
     Method to calculate the EOFs of given  dataset.  This assumes data comes in as
     an m x n matrix where m is the temporal dimension and n is the spatial
@@ -91,12 +344,27 @@ def calc_eofs(data, num_eigs, ret_pcs=False, var_stats_dict=None):
 
     Parameters
     ----------
-    data: ndarray
+    data: ndarray or tables.CArray
         Dataset to calculate EOFs from
     num_eigs: int
         Number of eigenvalues/vectors to return.  Must be less than min(m, n).
     retPCs: bool, optional
         Return principal component matrix along with EOFs
+    var_stats_dict: dict, optional
+        Dictionary to fill with variance statistics of the decomposition.
+    solver: str, optional
+        Decomposition method.  'full' performs a full SVD and truncates it.
+        'randomized' computes only the leading modes with a randomized range
+        finder.  'gram' uses the eigendecomposition of the time x time Gram
+        matrix, which is efficient when n >> m.  'auto' picks one of these
+        from the data dimensions.
+    random_state: int or np.random.RandomState, optional
+        Seed for the 'randomized' solver.
+    max_mem: int, optional
+        Memory budget in bytes for data read at once.  When given (or when
+        data is not an ndarray and the solver is not 'full') the 'gram' and
+        'randomized' solvers stream spatial blocks of data instead of loading
+        it whole.  The m x m Gram matrix is not counted against the budget.
 
     Returns
     -------
@@ -106,34 +374,52 @@ def calc_eofs(data, num_eigs, ret_pcs=False, var_stats_dict=None):
     svals: ndarray
         Singular values from the svd decomposition.  Returned as a row vector
         in order from largest to smallest.
+
+    Notes
+    -----
+    For the truncated solvers only the retained eigenvalues are available, so
+    var_stats_dict['eigvals'] and ['var_expl_by_mode'] have length num_eigs.
+    The total variance is always taken from the trace of the data covariance.
     """
 
-    eofs, svals, pcs = svd(data[:].T, full_matrices=False)
-    eofs = eofs[:, :num_eigs]
+    out_of_core = (max_mem is not None or
+                   (not isinstance(data, np.ndarray) and solver != 'full'))
+
+    if out_of_core and max_mem is None:
+        max_mem = _BLOCK_BYTES
+
+    if solver == 'auto':
+        solver = _select_eof_solver(data.shape, num_eigs,
+                                    out_of_core=out_of_core)
+
+    if solver == 'full':
+        if out_of_core:
+            raise ValueError('The full EOF solver cannot operate out-of-core. '
+                             'Use the gram or randomized solver with max_mem.')
+        eofs, svals, pcs = svd(data[:].T, full_matrices=False)
+        eofs = eofs[:, :num_eigs]
+        pcs = pcs[:num_eigs]
+        total_ss = (svals**2).sum()
+    elif solver == 'randomized':
+        if not out_of_core:
+            data = data[:]
+        eofs, svals, pcs, total_ss = _randomized_svd(data, num_eigs,
+                                                     random_state=random_state,
+                                                     max_mem=max_mem)
+    elif solver == 'gram':
+        if not out_of_core:
+            data = data[:]
+        eofs, svals, pcs, total_ss = _gram_svd(data, num_eigs,
+                                               max_mem=max_mem)
+    else:
+        raise ValueError('Unrecognized EOF solver: {}'.format(solver))
+
     trunc_svals = svals[:num_eigs]
-    pcs = pcs[:num_eigs]
 
     # variance stats
     if var_stats_dict is not None:
-        try:
-            nt = pcs.shape[1]
-            ns = eofs.shape[0]
-            eig_vals = (svals**2) / (nt*ns)
-            total_var = eig_vals.sum()
-            var_expl_by_mode = eig_vals / total_var
-            var_expl_by_retained = var_expl_by_mode[0:num_eigs].sum()
-
-            var_stats_dict['nt'] = nt
-            var_stats_dict['ns'] = ns
-            var_stats_dict['eigvals'] = eig_vals
-            var_stats_dict['num_ret_modes'] = num_eigs
-            var_stats_dict['total_var'] = total_var
-            var_stats_dict['var_expl_by_mode'] = var_expl_by_mode
-            var_stats_dict['var_expl_by_ret'] = var_expl_by_retained
-        except TypeError as e:
-            print 'Must past dictionary type to var_stats_dict in order to ' \
-                  'output variance statistics.'
-            print e
+        _eof_var_stats(var_stats_dict, svals, total_ss, pcs.shape[1],
+                       eofs.shape[0], num_eigs)
 
     if ret_pcs:
         return eofs, trunc_svals, pcs
@@ -217,13 +503,529 @@ def calc_n_eff(data1, data2=None):
     return n_eff
 
 
-def run_mean(data, window_size, shave_yr=False, year_len=12):
+def calc_corr_signif(corr, n_eff):
     """
-    A function for calculating the running mean on data.
+    95% significance of correlations given the effective degrees of freedom.
+    A 2 standard deviation test is used for small correlations and a
+    Fisher z-transform test for correlations of 0.5 or larger.
+
+    Parameters
+    ----------
+    corr: ndarray
+        Correlation values.
+    n_eff: ndarray
+        Effective degrees of freedom corresponding to corr.
+
+    Returns
+    -------
+    signif: ndarray
+        Boolean array, True where the correlation is significant.
+    """
+    signif = np.empty_like(corr, dtype=np.bool)
+
+    if True in (abs(corr) < 0.5):
+        g_idx = np.where(abs(corr) < 0.5)
+        gen_2std = 2./np.sqrt(n_eff[g_idx])
+        signif[g_idx] = (abs(corr[g_idx]) - gen_2std) > 0
+
+    if True in (abs(corr) >= 0.5):
+        z_idx = np.where(abs(corr) >= 0.5)
+        z = 1./2 * np.log((1 + corr[z_idx]) / (1 - corr[z_idx]))
+        z_2std = 2. / np.sqrt(n_eff[z_idx] - 3)
+        signif[z_idx] = (abs(z) - z_2std) > 0
+
+    signif[n_eff <= 3] = False
+
+    return signif
+
+
+def calc_corr_pval(corr, n_eff):
+    """
+    One-sided p-value of correlations being greater than zero from the
+    Fisher z-transform with n_eff effective degrees of freedom.
+    """
+    n_eff = np.maximum(n_eff, 3)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        z = np.arctanh(np.clip(corr, -1, 1)) * np.sqrt(n_eff - 3)
+    return norm.sf(z)
+
+
+def fdr_signif(pvals, alpha=0.05):
+    """
+    Field significance mask controlling the false discovery rate
+    (Benjamini and Hochberg 1995, Wilks 2016) along the last axis.
+
+    Parameters
+    ----------
+    pvals: ndarray
+        Local p-values with the spatial dimension last (e.g. N or
+        leads x N).
+    alpha: float, optional
+        False discovery rate.
+
+    Returns
+    -------
+    ndarray
+        Boolean mask, True where local tests are significant after FDR
+        control.
+    """
+    pvals = np.asarray(pvals, dtype=np.float64)
+    nspace = pvals.shape[-1]
+    sorted_p = np.sort(pvals, axis=-1)
+    below = sorted_p <= alpha * np.arange(1, nspace + 1) / float(nspace)
+
+    # Largest sorted p-value under the BH line
+    num_signif = np.where(below.any(axis=-1),
+                          nspace - np.argmax(below[..., ::-1], axis=-1), 0)
+    p_crit = np.where(num_signif > 0,
+                      np.take_along_axis(sorted_p,
+                                         np.maximum(num_signif - 1, 0)[..., None],
+                                         axis=-1)[..., 0],
+                      -np.inf)
+
+    return pvals <= p_crit[..., None]
+
+
+def area_means(data, lats):
+    """
+    cos(lat) weighted global, Northern and Southern Hemisphere means along
+    the last axis of data.  NaN values are ignored.
 
     Parameters
     ----------
     data: ndarray
+        Data with the (flattened) spatial dimension last.
+    lats: ndarray
+        Latitude of each spatial point.
+
+    Returns
+    -------
+    dict
+        'global', 'nh' and 'sh' means.
+    """
+    data = np.asarray(data, dtype=np.float64)
+    lats = np.asarray(lats)
+    valid = np.isfinite(data)
+    data = np.where(valid, data, 0)
+    wgt = np.cos(np.radians(lats))
+
+    means = {}
+    for region, mask in [('global', np.ones(lats.shape, dtype=np.bool)),
+                         ('nh', lats > 0), ('sh', lats < 0)]:
+        region_wgt = wgt * mask
+        means[region] = ((data * region_wgt).sum(axis=-1) /
+                         (valid * region_wgt).sum(axis=-1))
+
+    return means
+
+
+def skill_summary(skill, lats, alpha=0.05):
+    """
+    Field level summaries of local skill statistics for each lead.
+
+    Parameters
+    ----------
+    skill: dict
+        Leads x N skill maps ('corr', 'ce', 'corr_trial_avg'), their
+        p-values ('corr_pval', 'ce_pval') and pattern correlations for each
+        forecast time ('pattern_corr', leads x time) as produced by
+        ResampleLIM.forecast(verify=True) or LIMTools.fcast_skill.
+    lats: ndarray
+        Latitude of each spatial point.
+    alpha: float, optional
+        False discovery rate for the field significance masks.
+
+    Returns
+    -------
+    dict
+        Area weighted global, NH and SH means of each skill map
+        (e.g. 'corr_global'), FDR significance masks ('corr_fdr_signif') and
+        the area fraction they cover ('corr_fdr_area'), and the mean pattern
+        correlation ('pattern_corr_mean') for each lead.
+    """
+    summary = {}
+    for key in ['corr', 'ce', 'corr_trial_avg']:
+        if key not in skill:
+            continue
+        for region, mean in area_means(skill[key], lats).items():
+            summary['{}_{}'.format(key, region)] = mean
+
+    for key in ['corr', 'ce']:
+        if key + '_pval' not in skill:
+            continue
+        fdr = fdr_signif(skill[key + '_pval'], alpha=alpha)
+        summary[key + '_fdr_signif'] = fdr
+        summary[key + '_fdr_area'] = area_means(fdr, lats)['global']
+
+    if 'pattern_corr' in skill:
+        summary['pattern_corr_mean'] = np.nanmean(skill['pattern_corr'],
+                                                  axis=-1)
+
+    return summary
+
+
+class SkillAccumulator(object):
+    """
+    Running sums for verifying a forecast against observations one chunk of
+    samples at a time.  Chunks are treated as consecutive pieces of a single
+    time series, so the statistics match calc_lac, calc_n_eff and the
+    averaged calc_ce of the chunks stacked along the temporal dimension.
+    """
+
+    def __init__(self, nspace, weights=None):
+        """
+        Parameters
+        ----------
+        nspace: int
+            Number of spatial points (columns) of the forecast chunks.
+        weights: ndarray, optional
+            Spatial weights (e.g. cos(lat)) for the pattern correlation of
+            each forecast time.  Pattern statistics are only kept if given.
+        """
+        self.n = 0
+        self._sums = {key: np.zeros(nspace, dtype=np.float64)
+                      for key in ['f', 'o', 'ff', 'oo', 'fo', 'ff_lag',
+                                  'oo_lag', 'sq_err']}
+        self._first = None
+        self._last = None
+
+        if weights is not None:
+            weights = np.asarray(weights, dtype=np.float64)
+            weights = weights / weights.sum()
+        self._weights = weights
+        # Weighted spatial means of f, o, ff, oo, fo for each forecast time
+        self._pattern = []
+
+    def update(self, fcast, obs):
+        """
+        Add a chunk of forecasts and verifying observations, both M x N where
+        M is the temporal dimension.
+        """
+        assert fcast.shape == obs.shape
+        if not len(fcast):
+            return
+
+        fcast = np.asarray(fcast, dtype=np.float64)
+        obs = np.asarray(obs, dtype=np.float64)
+
+        if self._weights is not None:
+            wgt = self._weights
+            self._pattern.append(np.array([
+                np.dot(fcast, wgt), np.dot(obs, wgt),
+                np.dot(fcast**2, wgt), np.dot(obs**2, wgt),
+                np.dot(fcast * obs, wgt)]))
+
+        err = ne.evaluate('obs - fcast')
+        fcast_sums = {'f': fcast.sum(axis=0),
+                      'ff': np.einsum('ij,ij->j', fcast, fcast),
+                      'fo': np.einsum('ij,ij->j', fcast, obs),
+                      'ff_lag': np.einsum('ij,ij->j', fcast[:-1], fcast[1:]),
+                      'sq_err': np.einsum('ij,ij->j', err, err)}
+
+        self._accumulate(fcast_sums, fcast[0], fcast[-1], obs)
+
+    def update_eof(self, fcast, eofs, obs):
+        """
+        Add a chunk of EOF-space forecasts and verifying observations.
+        Forecast statistics at each point are calculated as rowwise
+        quadratic forms of the EOFs with the forecast (lag) covariance, and
+        the forecast-observation cross products from the observations
+        projected onto the forecast time series.  The physical space forecast
+        is never formed.
+
+        Parameters
+        ----------
+        fcast: ndarray
+            Forecast in EOF space. J x M where M is the temporal dimension.
+        eofs: ndarray
+            EOFs of the forecast. N x J
+        obs: ndarray
+            Verifying observations. M x N
+        """
+        assert fcast.shape[1] == obs.shape[0]
+        if not fcast.shape[1]:
+            return
+
+        fcast = np.asarray(fcast, dtype=np.float64)
+        eofs = np.asarray(eofs, dtype=np.float64)
+        obs = np.asarray(obs, dtype=np.float64)
+
+        def _quad_form(cov):
+            return np.einsum('ij,ij->i', np.dot(eofs, cov), eofs)
+
+        ff = _quad_form(np.dot(fcast, fcast.T))
+        fo = np.einsum('ij,ij->i', eofs, np.dot(obs.T, fcast.T))
+        oo = np.einsum('ij,ij->j', obs, obs)
+
+        if self._weights is not None:
+            wgt = self._weights
+            wgt_eofs = eofs * wgt[:, None]
+            self._pattern.append(np.array([
+                np.dot(np.dot(wgt, eofs), fcast), np.dot(obs, wgt),
+                np.einsum('jm,jk,km->m', fcast, np.dot(eofs.T, wgt_eofs),
+                          fcast),
+                np.dot(obs**2, wgt),
+                np.einsum('mj,jm->m', np.dot(obs, wgt_eofs), fcast)]))
+
+        fcast_sums = {'f': np.dot(eofs, fcast.sum(axis=1)),
+                      'ff': ff,
+                      'fo': fo,
+                      'ff_lag': _quad_form(np.dot(fcast[:, :-1],
+                                                  fcast[:, 1:].T)),
+                      'sq_err': oo - 2*fo + ff}
+
+        self._accumulate(fcast_sums, np.dot(eofs, fcast[:, 0]),
+                         np.dot(eofs, fcast[:, -1]), obs, obs_sq=oo)
+
+    def _accumulate(self, fcast_sums, fcast_first, fcast_last, obs,
+                    obs_sq=None):
+        """Add the sums for a chunk and link its lag-1 products to the last."""
+        sums = self._sums
+        for key, val in fcast_sums.items():
+            sums[key] += val
+
+        if obs_sq is None:
+            obs_sq = np.einsum('ij,ij->j', obs, obs)
+        sums['o'] += obs.sum(axis=0)
+        sums['oo'] += obs_sq
+
+        # Lag-1 products within the chunk and across the previous chunk
+        sums['oo_lag'] += np.einsum('ij,ij->j', obs[:-1], obs[1:])
+        if self._last is None:
+            self._first = (fcast_first.copy(), obs[0].copy())
+        else:
+            sums['ff_lag'] += self._last[0] * fcast_first
+            sums['oo_lag'] += self._last[1] * obs[0]
+        self._last = (fcast_last.copy(), obs[-1].copy())
+
+        self.n += len(obs)
+
+    @staticmethod
+    def _corr(n, sum_x, sum_y, sum_xx, sum_yy, sum_xy):
+        cov = sum_xy - sum_x * sum_y / n
+        var_x = sum_xx - sum_x**2 / n
+        var_y = sum_yy - sum_y**2 / n
+        return cov / np.sqrt(var_x * var_y)
+
+    def corr(self):
+        """Local anomaly correlation of all chunks added."""
+        sums = self._sums
+        return self._corr(self.n, sums['f'], sums['o'], sums['ff'],
+                          sums['oo'], sums['fo'])
+
+    def _lag1_corr(self, key, idx):
+        sums = self._sums
+        first = self._first[idx]
+        last = self._last[idx]
+        sq = sums[key + key]
+        return self._corr(self.n - 1, sums[key] - last, sums[key] - first,
+                          sq - last**2, sq - first**2, sums[key + key + '_lag'])
+
+    def n_eff(self):
+        """Effective degrees of freedom of the correlation (see calc_n_eff)."""
+        r1 = self._lag1_corr('f', 0)
+        r2 = self._lag1_corr('o', 1)
+        return self.n * ((1 - r1*r2) / (1 + r1*r2))
+
+    def corr_signif(self):
+        """Local anomaly correlation and its 95% significance."""
+        corr = self.corr()
+        return corr, calc_corr_signif(corr, self.n_eff())
+
+    def corr_pval(self):
+        """One-sided p-value of the local anomaly correlation being > 0."""
+        return calc_corr_pval(self.corr(), self.n_eff())
+
+    def pattern_corr(self):
+        """
+        Weighted, centered pattern correlation between the forecast and
+        observed fields at each forecast time added.  Requires weights.
+        """
+        assert self._weights is not None, \
+            'SkillAccumulator requires weights for pattern correlations'
+        if not self._pattern:
+            return np.zeros(0)
+
+        f, o, ff, oo, fo = np.concatenate(self._pattern, axis=1)
+        return (fo - f*o) / np.sqrt((ff - f**2) * (oo - o**2))
+
+    def ce(self, clim_var):
+        """
+        Coefficient of efficiency given the climatological variance of the
+        observations at each point (see calc_ce).
+        """
+        return 1 - (self._sums['sq_err'] / self.n) / clim_var
+
+
+def _block_sums(fcast, obs, block_len):
+    """
+    Sums of the forecast and observation moments (f, o, ff, oo, fo, squared
+    error) over consecutive blocks of block_len samples.  fcast and obs are
+    M x N, trailing samples that do not fill a block are dropped.  Returns
+    an array of 6 x blocks x N.
+    """
+    nblocks = len(fcast) // block_len
+    shp = (nblocks, block_len, fcast.shape[1])
+    fcast = np.asarray(fcast[:nblocks*block_len], dtype=np.float64).reshape(shp)
+    obs = np.asarray(obs[:nblocks*block_len], dtype=np.float64).reshape(shp)
+    err = ne.evaluate('obs - fcast')
+
+    return np.array([fcast.sum(axis=1),
+                     obs.sum(axis=1),
+                     np.einsum('bln,bln->bn', fcast, fcast),
+                     np.einsum('bln,bln->bn', obs, obs),
+                     np.einsum('bln,bln->bn', fcast, obs),
+                     np.einsum('bln,bln->bn', err, err)])
+
+
+def _block_sums_eof(fcast, eofs, obs, block_len):
+    """
+    Block sums of _block_sums from an EOF-space forecast (J x M) and its
+    EOFs (N x J), using the rowwise quadratic forms of
+    SkillAccumulator.update_eof for each block.
+    """
+    nblocks = fcast.shape[1] // block_len
+    fcast = np.asarray(fcast, dtype=np.float64)
+    eofs = np.asarray(eofs, dtype=np.float64)
+
+    sums = np.empty((6, nblocks, eofs.shape[0]))
+    for i in xrange(nblocks):
+        blk = slice(i*block_len, (i+1)*block_len)
+        fcast_blk = fcast[:, blk]
+        obs_blk = np.asarray(obs[blk], dtype=np.float64)
+
+        ff = np.einsum('ij,ij->i', np.dot(eofs, np.dot(fcast_blk, fcast_blk.T)),
+                       eofs)
+        fo = np.einsum('ij,ij->i', eofs, np.dot(obs_blk.T, fcast_blk.T))
+        oo = np.einsum('ij,ij->j', obs_blk, obs_blk)
+        sums[:, i] = [np.dot(eofs, fcast_blk.sum(axis=1)), obs_blk.sum(axis=0),
+                      ff, oo, fo, oo - 2*fo + ff]
+
+    return sums
+
+
+def bootstrap_skill(fcast, obs, block_len, eofs=None, n_resamples=1000,
+                    alpha=0.05, clim_var=None, random_state=None,
+                    max_mem=None):
+    """
+    Local anomaly correlation and coefficient of efficiency with block
+    bootstrap significance.
+
+    The samples are split into non-overlapping blocks of block_len (e.g. the
+    LIM wsize) to preserve autocorrelation, and the moment sums of each
+    block are calculated once.  All resamples are drawn up front as a
+    resamples x blocks matrix of block counts, so the resampled sums for
+    every resample are a single matrix product with the block sums.
+
+    Parameters
+    ----------
+    fcast: ndarray or sequence of ndarray
+        Forecast time series, M x N where M is the temporal dimension.  If
+        eofs is given, a sequence of EOF-space trial forecasts (J x M).
+    obs: ndarray or sequence of ndarray
+        Verifying observations, M x N.  If eofs is given, a sequence of the
+        trial observations (M x N).
+    block_len: int
+        Number of samples in each bootstrap block.  Blocks do not span
+        trials, so trial lengths should be multiples of block_len.
+    eofs: sequence of ndarray, optional
+        EOFs (N x J) for each trial of an EOF-space forecast.  The physical
+        space forecast is never formed.
+    n_resamples: int, optional
+        Number of bootstrap resamples.
+    alpha: float, optional
+        Significance level of the one-sided test for skill greater than 0.
+    clim_var: ndarray, optional
+        Climatological variance for the CE.  Taken from the verifying
+        observations if not provided.
+    random_state: int or np.random.RandomState, optional
+        Seed for drawing the resamples.
+    max_mem: int, optional
+        Memory budget in bytes for the resampled statistics of a block of
+        spatial points.  Defaults to 64 MB.
+
+    Returns
+    -------
+    dict
+        'corr' and 'ce' at each point, their bootstrap p-values
+        ('corr_pval', 'ce_pval'; fraction of resamples with skill <= 0), and
+        significance ('corr_signif', 'ce_signif').
+    """
+    if eofs is None:
+        sums = _block_sums(fcast, obs, block_len)
+    else:
+        sums = np.concatenate([_block_sums_eof(trial_fcast, trial_eofs,
+                                               trial_obs, block_len)
+                               for trial_fcast, trial_eofs, trial_obs
+                               in izip(fcast, eofs, obs)], axis=1)
+
+    f_sum, o_sum, ff_sum, oo_sum, fo_sum, sq_err = sums
+    nblocks, nspace = f_sum.shape
+    n = nblocks * block_len
+
+    if clim_var is None:
+        clim_var = (oo_sum.sum(axis=0) - o_sum.sum(axis=0)**2 / n) / (n - 1)
+
+    if not isinstance(random_state, np.random.RandomState):
+        random_state = np.random.RandomState(random_state)
+
+    # Number of times each block is drawn in each resample
+    draws = random_state.randint(0, nblocks, size=(n_resamples, nblocks))
+    counts = np.zeros((n_resamples, nblocks))
+    np.add.at(counts, (np.repeat(np.arange(n_resamples), nblocks),
+                       draws.ravel()), 1)
+
+    skill = {'corr': SkillAccumulator._corr(n, *sums[:5].sum(axis=1)),
+             'ce': 1 - (sq_err.sum(axis=0) / n) / clim_var,
+             'corr_pval': np.empty(nspace),
+             'ce_pval': np.empty(nspace)}
+
+    if max_mem is None:
+        max_mem = _BLOCK_BYTES
+
+    for j0, j1 in _column_blocks(nspace, 6*n_resamples, max_mem):
+        resampled = [np.dot(counts, stat[:, j0:j1]) for stat in sums]
+        corr = SkillAccumulator._corr(n, *resampled[:5])
+        ce = 1 - (resampled[5] / n) / clim_var[j0:j1]
+        skill['corr_pval'][j0:j1] = (corr <= 0).mean(axis=0)
+        skill['ce_pval'][j0:j1] = (ce <= 0).mean(axis=0)
+
+    skill['corr_signif'] = skill['corr_pval'] <= alpha
+    skill['ce_signif'] = skill['ce_pval'] <= alpha
+
+    return skill
+
+
+def _run_mean_block(data, window_size, start, nout):
+    """
+    Running mean of an in-memory block using compensated prefix sums.
+
+    The block is shifted by its first sample and accumulated in float64 so
+    that long float32 series do not lose precision in the cumulative sum.
+    """
+    nsamp = nout + window_size - 1
+    shift = np.array(data[start], dtype=np.float64)
+
+    csum = np.subtract(data[start:start+nsamp], shift, dtype=np.float64)
+    np.cumsum(csum, axis=0, out=csum)
+
+    sums = np.empty((nout,) + csum.shape[1:], dtype=np.float64)
+    sums[0] = csum[window_size-1]
+    np.subtract(csum[window_size:], csum[:-window_size], out=sums[1:])
+    sums /= window_size
+    sums += shift
+
+    return sums
+
+
+def run_mean(data, window_size, shave_yr=False, year_len=12, block_size=None,
+             out=None):
+    """
+    A function for calculating the running mean on data.
+
+    Parameters
+    ----------
+    data: ndarray or tables.CArray
         Data matrix to perform running mean over. Expected to be in time(row) x
         space(column) format. And that samples span full years.
     window_size: int
@@ -234,6 +1036,15 @@ def run_mean(data, window_size, shave_yr=False, year_len=12):
         partial chunk.
     year_len: int, optional
         Number of elements in a timeseries that represents a full year.
+    block_size: int, optional
+        Number of spatial columns to process at a time.  Bounds the float64
+        temporaries to time x block_size.  Defaults to the full spatial
+        dimension for ndarrays and to roughly 64 MB blocks for other
+        array-likes (e.g. PyTables CArrays), which are only read one block
+        at a time.
+    out: ndarray-like, optional
+        Preallocated output with the shape of the trimmed result (e.g. a
+        CArray from empty_hdf5_carray).  Written one block at a time.
 
     Returns
     -------
@@ -266,11 +1077,41 @@ def run_mean(data, window_size, shave_yr=False, year_len=12):
     assert(new_shape[0] > 0), ("Not enough data to trim partial years from "
                                "edges.  Please try with shaveYr=False")
 
-    # Allocate memory and perform running mean
-    result = np.zeros(new_shape, dtype=data.dtype)
-        
-    for i in xrange(new_shape[0]):
-        cntr = cut_from_bot - bedge + i
-        result[i] = (data[cntr:(cntr+window_size)].mean(axis=0))
-    
-    return result, cut_from_bot, cut_from_top
\ No newline at end of file
+    if out is None:
+        result = np.zeros(new_shape, dtype=data.dtype)
+    else:
+        assert list(out.shape) == new_shape, \
+            'Output shape {} does not match expected running mean shape ' \
+            '{}'.format(out.shape, new_shape)
+        result = out
+
+    start = cut_from_bot - bedge
+    in_memory = isinstance(data, np.ndarray)
+
+    if block_size is None and in_memory:
+        block_size = int(np.prod(dshape[1:]))
+    elif block_size is None:
+        col_bytes = dshape[0] * np.dtype(np.float64).itemsize
+        block_size = max(1, _BLOCK_BYTES // col_bytes)
+
+    if len(dshape) == 1 or block_size >= np.prod(dshape[1:]):
+        result[:] = _run_mean_block(data[:], window_size, start, new_shape[0])
+        return result, cut_from_bot, cut_from_top
+
+    assert len(dshape) == 2 or in_memory, \
+        'Blocked running mean expects a 2D time x space array.'
+
+    # Flatten trailing dimensions of in-memory data so blocks are columns
+    if len(dshape) > 2:
+        data = data.reshape(dshape[0], -1)
+        result_2d = result.reshape(new_shape[0], -1)
+    else:
+        result_2d = result
+
+    nspace = data.shape[1]
+    for j0 in xrange(0, nspace, block_size):
+        j1 = min(j0 + block_size, nspace)
+        result_2d[:, j0:j1] = _run_mean_block(data[:, j0:j1], window_size,
+                                              start, new_shape[0])
+
+    return result, cut_from_bot, cut_from_top
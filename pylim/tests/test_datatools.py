@@ -4,6 +4,7 @@ import tables as tb
 import numpy as np
 import pytest
 import os
+from functools import partial
 from pylim import DataTools as Dt
 from pylim.DataTools import BaseDataObject as BDO
 from pylim.DataTools import Hdf5DataObject as HDO
@@ -235,6 +236,37 @@ def test_basedataobj_nanentry_leadtime():
                                   obj.inflate_full_grid(reshape_orig=True))
 
 
+def test_finite_mask_blocked():
+    data = np.random.RandomState(1).randn(50, 3, 4)
+    data[7, 0, 1] = np.nan
+    data[49, 2, 3] = np.inf
+    ref = np.isfinite(data).all(axis=0)
+    # Blocks of 2 samples
+    np.testing.assert_array_equal(Dt._finite_mask(data, max_mem=24), ref)
+    np.testing.assert_array_equal(Dt._finite_mask(data), ref)
+
+
+def test_read_span():
+    data = np.arange(20)
+    idx = np.array([12, 5, 9])
+    span, sub = Dt.read_span(idx)
+    assert span == slice(5, 13)
+    np.testing.assert_array_equal(data[span][sub], data[idx])
+
+
+def test_limit_blas_threads(monkeypatch):
+    calls = []
+    monkeypatch.setattr(Dt, 'threadpool_limits',
+                        lambda limits: calls.append(limits))
+    for var in ['OMP_NUM_THREADS', 'OPENBLAS_NUM_THREADS', 'MKL_NUM_THREADS']:
+        monkeypatch.setenv(var, '8')
+
+    Dt.limit_blas_threads(2)
+    assert calls == [2]
+    for var in ['OMP_NUM_THREADS', 'OPENBLAS_NUM_THREADS', 'MKL_NUM_THREADS']:
+        assert os.environ[var] == '2'
+
+
 def test_basedataobj_compressed_noleadtime():
     data = np.arange(24).reshape(3, 4, 2).astype(np.float32)
     data[2, 3, 1] = np.nan
@@ -438,6 +470,255 @@ def test_hdf5dataobj_nanentry_noleadtime(tb_file):
                                   err_msg='Inflation to full grid failed.')
 
 
+
+def _monthly_obj(**kwargs):
+    rng = np.random.RandomState(0)
+    data = rng.randn(120, 3, 4) + 10*np.sin(np.arange(120)/12.)[:, None, None]
+    coords = {BDO.TIME: (0, np.arange(120)),
+              BDO.LAT: (1, [-30., 0., 30.]),
+              BDO.LON: (2, [0., 90., 180., 270.])}
+    return data, BDO(data, dim_coords=coords, force_flat=True, **kwargs)
+
+
+def _preprocess(obj):
+    obj.calc_running_mean(12, shave_yr=True)
+    obj.calc_anomaly(12)
+    obj.detrend_data()
+    obj.area_weight_data()
+
+
+def test_basedataobj_databins_private_readonly():
+    data, obj = _monthly_obj()
+    orig = data.copy()
+    assert not np.shares_memory(obj.orig_data, data)
+    assert not obj.orig_data.flags.writeable
+    assert data.flags.writeable
+
+    # Writes to the input or the current data don't reach the databins
+    data[:] = 0
+    obj.data[0] = 0
+    np.testing.assert_array_equal(obj.orig_data, orig.reshape(120, -1))
+    obj.calc_running_mean(12, shave_yr=True)
+    obj.data[:] = 0
+    assert obj.running_mean.any()
+
+
+def test_basedataobj_from_masked_orig_data():
+    data = _monthly_obj()[0].reshape(120, -1)
+    data[:, 5] = np.nan
+    coords = {BDO.TIME: (0, np.arange(120))}
+    obj = BDO(data, dim_coords=coords)
+    assert obj.is_masked and not obj.orig_data.flags.writeable
+
+    obj2 = BDO(obj.orig_data, dim_coords=coords)
+    assert obj2.is_masked
+    np.testing.assert_array_equal(obj2.valid_data, obj.valid_data)
+    np.testing.assert_array_equal(obj2.data, obj.data)
+
+
+def test_basedataobj_databins_recompute():
+    _, ref = _monthly_obj()
+    _preprocess(ref)
+    _, obj = _monthly_obj(keep_bins=[BDO._DETRENDED])
+    _preprocess(obj)
+    assert set(obj._data_bins._bins) == {BDO._ORIGDATA, BDO._DETRENDED}
+    for key in [BDO._RUNMEAN, BDO._ANOMALY, BDO._DETRENDED, BDO._AWGHT]:
+        np.testing.assert_array_equal(obj._data_bins[key],
+                                      ref._data_bins[key])
+    np.testing.assert_array_equal(obj.data, ref.data)
+
+
+def test_basedataobj_databins_budget(tmpdir):
+    _, ref = _monthly_obj()
+    _preprocess(ref)
+    max_mem = 2 * ref.orig_data.nbytes
+    _, obj = _monthly_obj(max_mem=max_mem, spill_dir=str(tmpdir))
+    _preprocess(obj)
+    bins = obj._data_bins
+    assert bins.nbytes <= max_mem
+    # Original data can't be recomputed and is spilled instead of dropped
+    assert isinstance(bins._bins[BDO._ORIGDATA], np.memmap)
+    for key in [BDO._ORIGDATA, BDO._RUNMEAN, BDO._ANOMALY, BDO._DETRENDED,
+                BDO._AWGHT]:
+        np.testing.assert_array_equal(bins[key], ref._data_bins[key])
+    bins.close()
+    assert not tmpdir.listdir()
+
+
+def test_databins_nbytes_shared_views():
+    data = np.arange(100.)
+    bins = Dt.DataBins()
+    bins.add('a', data)
+    bins.add('b', data.reshape(10, 10))
+    assert bins.nbytes == data.nbytes
+
+
+def test_databins_overwrite_parent(tmpdir):
+    x = np.arange(100.)
+    bins = Dt.DataBins(max_mem=x.nbytes, spill_dir=str(tmpdir))
+    bins.add('a', x)
+    bins.add('b', x * 2, parent='a', transform=partial(np.multiply, 2))
+    bins.add('a', x + 1)
+    # The stored child keeps its data and is spilled instead of dropped
+    assert 'b' not in bins._chain
+    assert isinstance(bins._bins['b'], np.memmap)
+    np.testing.assert_array_equal(bins['b'], x * 2)
+    bins.close()
+
+
+def test_basedataobj_databins_overwrite_parent():
+    _, obj = _monthly_obj(keep_bins=[BDO._RUNMEAN])
+    obj.calc_running_mean(12, shave_yr=True)
+    obj.calc_anomaly(12)
+    assert BDO._ANOMALY in obj._data_bins
+
+    # A new running mean invalidates the dropped anomaly instead of
+    # silently recomputing it from the new running mean
+    obj.reset_data(BDO._ORIGDATA)
+    obj.calc_running_mean(24, shave_yr=True)
+    assert obj.anomaly is None
+    assert BDO._ANOMALY not in obj._data_bins
+
+
+
+@pytest.mark.parametrize("max_mem", [None, 120*8*5])
+def test_basedataobj_preprocess_pipeline(max_mem):
+    _, ref = _monthly_obj()
+    _preprocess(ref)
+    _, obj = _monthly_obj(keep_bins=[BDO._ANOMALY])
+    steps = [('run_mean', {'window_size': 12, 'shave_yr': True}),
+             ('anomaly', {'yr_size': 12, 'save': True}),
+             ('detrend', {}),
+             ('area_weight', {'save': True})]
+    data, bedge, tedge = obj.preprocess(steps, max_mem=max_mem)
+    assert (bedge, tedge) == (12, 12)
+    assert obj.is_run_mean and obj.is_anomaly and obj.is_detrended
+    np.testing.assert_allclose(data, ref.data, atol=1e-12)
+    np.testing.assert_allclose(obj.climo, ref.climo)
+    np.testing.assert_allclose(obj.anomaly, ref.anomaly)
+    # Not kept, recomputed from the recorded pipeline
+    assert obj.running_mean is None
+    np.testing.assert_allclose(obj.area_weighted, ref.area_weighted,
+                               atol=1e-12)
+
+
+def test_hdf5dataobj_preprocess_pipeline(tb_file):
+    data, ref = _monthly_obj()
+    _preprocess(ref)
+    coords = {BDO.TIME: (0, np.arange(120)),
+              BDO.LAT: (1, [-30., 0., 30.]),
+              BDO.LON: (2, [0., 90., 180., 270.])}
+    obj = HDO(data.copy(), tb_file, dim_coords=coords, force_flat=True)
+    steps = [('run_mean', {'window_size': 12, 'shave_yr': True}),
+             ('anomaly', {'yr_size': 12, 'save': True}),
+             ('detrend', {'save': True}),
+             ('area_weight', {})]
+    obj.preprocess(steps, max_mem=120*8*5)
+    assert isinstance(obj.anomaly, tb.CArray)
+    np.testing.assert_allclose(obj.anomaly[:], ref.anomaly)
+    np.testing.assert_allclose(obj.detrended[:], ref.detrended, atol=1e-12)
+    np.testing.assert_allclose(obj.data, ref.data, atol=1e-12)
+
+
+
+def _write_netcdf(filename, data, lats, lons, fill=None):
+    import netCDF4 as ncf
+    with ncf.Dataset(filename, 'w') as f:
+        f.createDimension('time', data.shape[0])
+        f.createDimension('lat', len(lats))
+        f.createDimension('lon', len(lons))
+        times = f.createVariable('time', 'f8', ('time',))
+        times.units = 'days since 1900-01-01'
+        times.calendar = 'noleap'
+        times[:] = np.arange(data.shape[0]) * 365 / 12.
+        f.createVariable('lat', 'f8', ('lat',))[:] = lats
+        f.createVariable('lon', 'f8', ('lon',))[:] = lons
+        var = f.createVariable('tas', 'f4', ('time', 'lat', 'lon'),
+                               chunksizes=(7, len(lats), len(lons)),
+                               fill_value=fill)
+        var[:] = data
+
+
+@pytest.mark.parametrize("max_mem", [None, 1])
+def test_basedataobj_from_netcdf_subset(tmpdir, max_mem):
+    import netCDF4 as ncf
+    filename = str(tmpdir.join('subset.nc'))
+    lats = np.linspace(80, -80, 9)
+    lons = np.arange(0, 360, 30.)
+    data = np.random.RandomState(2).randn(60, 9, 12).astype(np.float32)
+    data[:, 3, 0] = -999.
+    _write_netcdf(filename, data, lats, lons, fill=-999.)
+
+    kwargs = {} if max_mem is None else {'max_mem': max_mem}
+    obj = BDO.from_netcdf(filename, 'tas', **kwargs)
+    assert obj.is_masked
+    np.testing.assert_array_equal(obj.data,
+                                  data.reshape(60, -1)[:, obj.valid_data])
+
+    start, end = ncf.num2date([31, 1400], 'days since 1900-01-01',
+                              calendar='noleap')
+    obj = BDO.from_netcdf(filename, 'tas', time_range=(start, end),
+                          lat_bounds=(-30, 45), lon_bounds=(300, 60),
+                          time_stride=3, space_stride=2, **kwargs)
+    ref = data[2:47:3][:, [2, 4]][:, :, [10, 0, 2]]
+    assert not obj.is_masked
+    np.testing.assert_array_equal(obj.data, ref.reshape(len(ref), -1))
+    assert obj.time_cal == 'noleap'
+    assert obj.get_dim_coords([BDO.TIME])[BDO.TIME][1][0] == ncf.num2date(
+        2 * 365 / 12., 'days since 1900-01-01', calendar='noleap')
+    np.testing.assert_array_equal(obj.get_dim_coords([BDO.LON])[BDO.LON][1],
+                                  [300, 0, 60])
+
+
+def test_bounds_slice_dateline():
+    lons = np.arange(-180, 180, 30.)
+    slices = Dt._bounds_slice(lons, (150, 210), 1, wrap=True)
+    assert slices == [slice(11, 12, 1), slice(0, 2, 1)]
+    np.testing.assert_array_equal(
+        np.concatenate([lons[sl] for sl in slices]), [150, -180, -150])
+
+    slices = Dt._bounds_slice(lons, (170, -130), 1, wrap=True)
+    np.testing.assert_array_equal(
+        np.concatenate([lons[sl] for sl in slices]), [-180, -150])
+    assert Dt._bounds_slice(lons, (-60, 60), 1, wrap=True) == \
+        [slice(4, 9, 1)]
+
+
+def test_basedataobj_from_netcdf_dateline(tmpdir):
+    filename = str(tmpdir.join('dateline.nc'))
+    lats = np.linspace(80, -80, 9)
+    lons = np.arange(-180, 180, 30.)
+    data = np.random.RandomState(4).randn(24, 9, 12).astype(np.float32)
+    _write_netcdf(filename, data, lats, lons)
+
+    obj = BDO.from_netcdf(filename, 'tas', lon_bounds=(150, 210))
+    ref = data[:, :, [11, 0, 1]]
+    np.testing.assert_array_equal(obj.data, ref.reshape(24, -1))
+    np.testing.assert_array_equal(obj.get_dim_coords([BDO.LON])[BDO.LON][1],
+                                  [150, -180, -150])
+
+
+
+def test_netcdf_to_hdf5_container(tmpdir):
+    ncfile = str(tmpdir.join('in.nc'))
+    h5file = str(tmpdir.join('out.h5'))
+    data = np.random.RandomState(3).randn(40, 3, 4).astype(np.float32)
+    _write_netcdf(ncfile, data, [-10., 0., 10.], [0., 90., 180., 270.])
+
+    report = Dt.netcdf_to_hdf5_container(ncfile, ['tas', 'lat'], h5file,
+                                         chunkshape={'tas': (8, 3, 4)},
+                                         blosc_threads=2, max_mem=1)
+    assert report['tas']['bytes'] == data.nbytes
+    with tb.open_file(h5file, 'r') as f:
+        assert f.root.tas.chunkshape == (8, 3, 4)
+        assert f.root.tas.filters.complib == 'blosc'
+        np.testing.assert_array_equal(f.root.tas[:], data)
+        assert f.root.time.attrs.index == 0
+
+    obj = Dt.hdf5_to_data_obj(h5file, 'tas')
+    np.testing.assert_array_equal(obj.data, data.reshape(40, -1))
+
+
 if __name__ == '__main__':
     try:
         f = tb.open_file('test.h5', 'w')
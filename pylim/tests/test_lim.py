@@ -0,0 +1,361 @@
+__author__ = 'wperkins'
+
+import numpy as np
+import pytest
+from pylim import LIM
+from pylim import Stats as St
+from pylim.DataTools import BaseDataObject as BDO
+
+
+def _red_noise_data(nyr=40, nlat=4, nlon=5, seed=0):
+    rng = np.random.RandomState(seed)
+    nt = nyr*12
+    data = np.zeros((nt, nlat, nlon))
+    for i in xrange(1, nt):
+        data[i] = 0.9*data[i-1] + rng.randn(nlat, nlon)
+    data += 5*np.sin(2*np.pi*np.arange(nt)/12.)[:, None, None]
+    coords = {BDO.TIME: (0, np.arange(nt)),
+              BDO.LAT: (1, np.linspace(-60, 60, nlat)),
+              BDO.LON: (2, np.linspace(0, 288, nlon))}
+    return data, coords
+
+
+def _red_noise_obj(nyr=40, nlat=4, nlon=5, seed=0):
+    data, coords = _red_noise_data(nyr=nyr, nlat=nlat, nlon=nlon, seed=seed)
+    return BDO(data, dim_coords=coords, force_flat=True)
+
+
+@pytest.fixture(scope='module')
+def lim_obj():
+    return LIM.LIM(_red_noise_obj(), 12, [1, 2, 3], 4)
+
+
+def test_lim_propagators_integer_leads(lim_obj):
+    g_taus = lim_obj.get_propagators([1, 2, 3])
+    for tau, g in zip([1, 2, 3], g_taus):
+        np.testing.assert_allclose(g, np.linalg.matrix_power(lim_obj.G_1, tau),
+                                   atol=1e-10)
+
+
+def test_lim_propagators_fractional_leads(lim_obj):
+    g_half, g_one = lim_obj.get_propagators([6, 12], in_samples=True)
+    np.testing.assert_allclose(np.dot(g_half, g_half), g_one, atol=1e-10)
+
+
+def test_lim_forecast_lag1(lim_obj):
+    fcast, eofs = lim_obj.forecast(_red_noise_obj(seed=1), use_h5=False)
+    t0 = _red_noise_obj(seed=1)
+    t0.calc_running_mean(12, shave_yr=True, save=False)
+    t0.calc_anomaly(12, save=False, climo=lim_obj._climo)
+    proj = np.dot(eofs.T, t0.data.T)
+    for tau, xf in zip(lim_obj.fcast_times, fcast):
+        g = np.linalg.matrix_power(lim_obj.G_1, int(tau))
+        np.testing.assert_allclose(xf, np.dot(g, proj), atol=1e-8)
+
+
+def test_lim_forecast_direct_g(lim_obj):
+    fcast, eofs = lim_obj.forecast(_red_noise_obj(seed=1), use_lag1=False,
+                                   use_h5=False)
+    t0 = _red_noise_obj(seed=1)
+    t0.calc_running_mean(12, shave_yr=True, save=False)
+    t0.calc_anomaly(12, save=False, climo=lim_obj._climo)
+    proj = np.dot(eofs.T, t0.data.T)
+
+    train = lim_obj._calib.train_data
+    taus = LIM._lead_samples(lim_obj.fcast_times, 12)
+    tdim = train.shape[1] - taus[-1]
+    for tau, xf in zip(taus, fcast):
+        g = LIM._calc_m(train[:, :tdim], train[:, tau:tau+tdim])
+        np.testing.assert_allclose(xf, np.dot(g, proj), atol=1e-8)
+
+
+def test_lim_forecast_fractional_leads():
+    lim = LIM.LIM(_red_noise_obj(), 12, [0.5, 1, 1.25], 4)
+    fcast, eofs = lim.forecast(_red_noise_obj(seed=1), use_h5=False)
+    t0 = _red_noise_obj(seed=1)
+    t0.calc_running_mean(12, shave_yr=True, save=False)
+    t0.calc_anomaly(12, save=False, climo=lim._climo)
+    proj = np.dot(eofs.T, t0.data.T)
+
+    np.testing.assert_equal(lim.fcast_times, [0.5, 1, 1.25])
+    g_taus = lim.get_propagators([6, 12, 15], in_samples=True)
+    for g, xf in zip(g_taus, fcast):
+        np.testing.assert_allclose(xf, np.dot(g, proj), atol=1e-8)
+
+    # Direct G(tau) is solved at the lags in samples
+    train = lim._calib.train_data
+    tdim = train.shape[1] - 15
+    d_fcast, _ = lim.forecast(_red_noise_obj(seed=1), use_lag1=False,
+                              use_h5=False)
+    for tau, xf in zip([6, 12, 15], d_fcast):
+        g = LIM._calc_m(train[:, :tdim], train[:, tau:tau+tdim])
+        np.testing.assert_allclose(xf, np.dot(g, proj), atol=1e-8)
+
+
+@pytest.mark.xfail(raises=ValueError)
+def test_lim_lead_between_samples():
+    LIM.LIM(_red_noise_obj(), 12, [1, 1.01], 4)
+
+
+@pytest.mark.parametrize("method", ['qr', 'cholesky', 'pinv'])
+def test_calc_m_solvers(method):
+    rng = np.random.RandomState(2)
+    x0 = rng.randn(5, 200)
+    xt = 0.5*x0 + 0.1*rng.randn(5, 200)
+    ref = np.dot(np.dot(xt, x0.T), np.linalg.pinv(np.dot(x0, x0.T)))
+    g, info = LIM._calc_m(x0, xt, method=method, ret_info=True)
+    np.testing.assert_allclose(g, ref, atol=1e-10)
+    assert info['method'] == method
+    assert info['rank'] == 5
+    np.testing.assert_allclose(info['cond_x0'], np.linalg.cond(x0))
+
+
+@pytest.mark.parametrize("method", ['qr', 'cholesky'])
+def test_calc_m_rank_deficient_fallback(method):
+    rng = np.random.RandomState(3)
+    x0 = rng.randn(4, 100)
+    x0[3] = x0[2]
+    xt = 0.5*x0
+    ref = np.dot(np.dot(xt, x0.T), np.linalg.pinv(np.dot(x0, x0.T)))
+    g, info = LIM._calc_m(x0, xt, method=method, ret_info=True)
+    assert info['method'] == 'pinv'
+    assert info['rank'] == 3
+    np.testing.assert_allclose(g, ref, atol=1e-8)
+
+
+def test_calc_m_ridge():
+    rng = np.random.RandomState(4)
+    x0 = rng.randn(3, 50)
+    xt = rng.randn(3, 50)
+    c0 = np.dot(x0, x0.T)
+    lam = 0.1 * np.trace(c0) / 3
+    ref = np.dot(np.dot(xt, x0.T), np.linalg.inv(c0 + lam*np.eye(3)))
+    for method in ['qr', 'cholesky', 'pinv']:
+        g = LIM._calc_m(x0, xt, method=method, ridge=0.1)
+        np.testing.assert_allclose(g, ref, atol=1e-10)
+
+
+def test_resample_lim_parallel_trials():
+    serial = LIM.ResampleLIM(_red_noise_obj(), 12, [1, 2], 4, 0.1, 4)
+    fcast, eofs = serial.forecast()
+    parallel = LIM.ResampleLIM(_red_noise_obj(), 12, [1, 2], 4, 0.1, 4)
+    p_fcast, p_eofs = parallel.forecast(n_workers=2)
+    np.testing.assert_array_equal(fcast, p_fcast)
+    np.testing.assert_array_equal(eofs, p_eofs)
+
+
+def test_lim_calibrate_stateless(lim_obj):
+    g_1 = lim_obj.G_1.copy()
+    calib = lim_obj.calibrate(_red_noise_obj(seed=2))
+    assert isinstance(calib, LIM.CalibratedLIM)
+    np.testing.assert_array_equal(lim_obj.G_1, g_1)
+    assert not np.allclose(calib.G_1, g_1)
+
+
+def test_lim_concurrent_forecasts(lim_obj):
+    from multiprocessing.pool import ThreadPool
+    calibs = [lim_obj.calibrate(_red_noise_obj(seed=s)) for s in (3, 4)]
+    ref = [lim_obj.forecast(_red_noise_obj(seed=5), use_h5=False,
+                            calib=c)[0] for c in calibs]
+    pool = ThreadPool(2)
+    res = pool.map(lambda c: lim_obj.forecast(_red_noise_obj(seed=5),
+                                              use_h5=False, calib=c)[0],
+                   calibs * 2)
+    pool.close()
+    for r, expected in zip(res, ref * 2):
+        np.testing.assert_array_equal(r, expected)
+
+
+@pytest.mark.parametrize("detrend", [False, True])
+def test_resample_lim_training_set(detrend):
+    rlim = LIM.ResampleLIM(_red_noise_obj(), 12, [1, 2], 4, 0.1, 4,
+                           detrend_data=detrend)
+    obs = rlim._original_obs
+    rm, _, _ = LIM.run_mean(obs, 12, shave_yr=True)
+    lat_grid = rlim._data_obj.get_coordinate_grids([BDO.LAT])[BDO.LAT]
+    for trial in [0, 3, rlim._test_start_idx[-1]]:
+        bot = rlim._bedge + trial
+        top = bot + rlim._test_tdim
+        train, climo = rlim._training_set(bot, top, obs, rm, lat_grid)
+
+        # Reference from the concatenated observations
+        ref_dat = np.concatenate((obs[:bot], obs[top:]))
+        ref_obj = BDO(ref_dat, force_flat=True, save_none=True,
+                      dim_coords={BDO.TIME: (0, np.arange(len(ref_dat))),
+                                  BDO.LAT: (1, lat_grid)})
+        ref_obj.calc_running_mean(12, save=False, shave_yr=True)
+        ref_obj.calc_anomaly(12, save=False)
+        ref_obj.area_weight_data(save=False)
+        if detrend:
+            ref_obj.detrend_data(save=False)
+        np.testing.assert_allclose(climo, ref_obj.climo, atol=1e-10)
+        np.testing.assert_allclose(train, ref_obj.data, atol=1e-10)
+
+
+@pytest.mark.parametrize("detrend", [False, True])
+def test_resample_lim_gram_downdate(detrend):
+    rlim = LIM.ResampleLIM(_red_noise_obj(), 12, [1, 2], 4, 0.1, 4,
+                           detrend_data=detrend)
+    obs = rlim._original_obs
+    rm, _, _ = LIM.run_mean(obs, 12, shave_yr=True)
+    lat_grid = rlim._data_obj.get_coordinate_grids([BDO.LAT])[BDO.LAT]
+    gram = rlim._full_record_gram(obs, rm.shape[0], lat_grid)
+    for trial in [0, 3, rlim._test_start_idx[-1]]:
+        bot = rlim._bedge + trial
+        top = bot + rlim._test_tdim
+        train, _ = rlim._training_set(bot, top, obs, rm, lat_grid)
+        ref = LIM.LIM._calibrate_data(rlim, train)
+        calib = rlim._downdate_calibration(bot, top, obs, rm, lat_grid, gram)
+
+        signs = np.sign((calib.eofs * ref.eofs).sum(axis=0))
+        np.testing.assert_allclose(calib.eofs * signs, ref.eofs, atol=1e-8)
+        np.testing.assert_allclose(calib.train_data * signs[:, None],
+                                   ref.train_data, atol=1e-8)
+        np.testing.assert_allclose(calib.var_stats['total_var'],
+                                   ref.var_stats['total_var'])
+
+
+def test_resample_lim_full_record_gram_blocks():
+    rlim = LIM.ResampleLIM(_red_noise_obj(), 12, [1, 2], 4, 0.1, 4)
+    obs = rlim._original_obs
+    rm, _, _ = LIM.run_mean(obs, 12, shave_yr=True)
+    lat_grid = rlim._data_obj.get_coordinate_grids([BDO.LAT])[BDO.LAT]
+    gram = rlim._full_record_gram(obs, rm.shape[0], lat_grid)
+
+    # A few columns per block
+    rlim._eof_max_mem = 3 * obs.shape[0] * 8
+    blocked = rlim._full_record_gram(obs, rm.shape[0], lat_grid)
+    for key in ['obs', 'rm']:
+        np.testing.assert_allclose(blocked[key], gram[key], atol=1e-10)
+
+
+def test_resample_lim_gram_downdate_forecast():
+    rlim = LIM.ResampleLIM(_red_noise_obj(), 12, [1, 2], 4, 0.1, 4)
+    fcast, eofs = rlim.forecast()
+    d_rlim = LIM.ResampleLIM(_red_noise_obj(), 12, [1, 2], 4, 0.1, 4,
+                             gram_downdate=True)
+    d_fcast, d_eofs = d_rlim.forecast(n_workers=2)
+    # Compare in physical space, independent of EOF signs
+    np.testing.assert_allclose(np.einsum('tnj,ktjm->ktnm', d_eofs, d_fcast),
+                               np.einsum('tnj,ktjm->ktnm', eofs, fcast),
+                               atol=1e-8)
+
+
+def test_resample_lim_verify():
+    rlim = LIM.ResampleLIM(_red_noise_obj(), 12, [1, 2], 4, 0.1, 4)
+    fcast, eofs = rlim.forecast(verify=True)
+    obs = rlim._data_obj.anomaly
+    for i, tau in enumerate(LIM._lead_samples(rlim.fcast_times, 12)):
+        phys = np.concatenate([np.dot(f.T, e.T)
+                               for f, e in zip(fcast[i], eofs)])
+        trial_obs = [obs[(t + tau):(t + tau + rlim._test_tdim)]
+                     for t in rlim._test_start_idx]
+        np.testing.assert_allclose(rlim.skill['corr'][i],
+                                   St.calc_lac(phys,
+                                                   np.concatenate(trial_obs)))
+        ce = [St.calc_ce(np.dot(f.T, e.T), o, obs)
+              for f, e, o in zip(fcast[i], eofs, trial_obs)]
+        np.testing.assert_allclose(rlim.skill['ce'][i], np.mean(ce, axis=0))
+
+    skill = rlim.skill
+    no_store = LIM.ResampleLIM(_red_noise_obj(), 12, [1, 2], 4, 0.1, 4)
+    assert no_store.forecast(verify=True, store_fcasts=False) == (None, None)
+    for key in skill:
+        np.testing.assert_array_equal(no_store.skill[key], skill[key])
+    assert rlim.skill['pattern_corr'].shape == (2, 4*rlim._test_tdim)
+    np.testing.assert_array_equal(
+        rlim.skill_summary['corr_fdr_signif'],
+        St.fdr_signif(rlim.skill['corr_pval']))
+
+
+def test_extraction_weights():
+    lats = np.repeat([-30., 0., 30.], 4)
+    lons = np.tile([0., 90., 180., 270.], 3)
+    wgt = LIM.extraction_weights(lats, lons, points=[(28., 95.)],
+                                 regions=[(-5, 40, 170, 10),
+                                          lats < 0])
+    assert wgt.shape == (12, 3)
+    np.testing.assert_array_equal(np.flatnonzero(wgt[:, 0]), [9])
+    np.testing.assert_array_equal(np.flatnonzero(wgt[:, 1]),
+                                  [4, 6, 7, 8, 10, 11])
+    np.testing.assert_allclose(wgt[:4, 2], 0.25)
+    np.testing.assert_allclose(wgt.sum(axis=0), 1)
+
+
+def test_lim_extract(lim_obj):
+    fcast, eofs = lim_obj.forecast(_red_noise_obj(seed=1), use_h5=False)
+    wgt = lim_obj.extraction_weights(points=[(20, 72)],
+                                     regions=[(-30, 30, 0, 100)])
+    phys = np.einsum('nj,kjm->kmn', eofs, fcast)
+    np.testing.assert_allclose(LIM.extract(fcast, eofs, wgt),
+                               np.dot(phys, wgt), atol=1e-12)
+
+    rlim = LIM.ResampleLIM(_red_noise_obj(), 12, [1, 2], 4, 0.1, 4)
+    fcast, eofs = rlim.forecast()
+    phys = np.einsum('tnj,ktjm->ktmn', eofs, fcast)
+    np.testing.assert_allclose(LIM.extract(fcast, eofs, wgt),
+                               np.dot(phys, wgt), atol=1e-12)
+
+
+def test_lim_extract_empty_selection(lim_obj):
+    fcast, eofs = lim_obj.forecast(_red_noise_obj(seed=1), use_h5=False)
+    nspace = eofs.shape[0]
+    with pytest.raises(ValueError, match='No points or regions'):
+        LIM.extract(fcast, eofs, np.zeros((nspace, 0)))
+    wgt = np.zeros((nspace, 2))
+    wgt[3, 0] = 1
+    with pytest.raises(ValueError, match=r'columns \[1\]'):
+        LIM.extract(fcast, eofs, wgt)
+    with pytest.raises(ValueError, match='spatial points'):
+        LIM.extract(fcast, eofs, wgt[:-1])
+
+
+@pytest.mark.parametrize("use_lag1", [True, False])
+def test_lim_forecast_batch(lim_obj, use_lag1):
+    seeds = [1, 6, 7]
+    ref = [lim_obj.forecast(_red_noise_obj(seed=s), use_lag1=use_lag1,
+                            use_h5=False)[0] for s in seeds]
+    fcast, eofs = lim_obj.forecast_batch([_red_noise_obj(seed=s)
+                                          for s in seeds],
+                                         use_lag1=use_lag1, use_h5=False)
+    assert fcast.shape[:2] == (3, 3)
+    for i, r in enumerate(ref):
+        np.testing.assert_allclose(fcast[:, i], r, atol=1e-10)
+
+    stacked = np.array([_red_noise_obj(seed=s).data for s in seeds])
+    np.testing.assert_allclose(lim_obj.forecast_batch(stacked,
+                                                      use_lag1=use_lag1,
+                                                      use_h5=False)[0],
+                               fcast, atol=1e-10)
+
+
+@pytest.mark.xfail(raises=ValueError)
+def test_lim_forecast_batch_mixed_stages(lim_obj):
+    pre = _red_noise_obj(seed=1)
+    pre.calc_running_mean(12, shave_yr=True, save=False)
+    lim_obj.forecast_batch([pre, _red_noise_obj(seed=2)], use_h5=False)
+
+
+def test_lim_calibrate_hdf5_streams_carray(tmpdir, monkeypatch):
+    import tables as tb
+    from pylim.DataTools import Hdf5DataObject as HDO
+
+    eof_inputs = []
+
+    def record_calc_eofs(data, *args, **kwargs):
+        eof_inputs.append(data)
+        return St.calc_eofs(data, *args, **kwargs)
+
+    monkeypatch.setattr(LIM, 'calc_eofs', record_calc_eofs)
+
+    ref = LIM.LIM(_red_noise_obj(), 12, [1, 2], 4)
+    data, coords = _red_noise_data()
+    with tb.open_file(str(tmpdir.join('calib.h5')), 'w') as h5file:
+        hdo = HDO(data, h5file, dim_coords=coords, force_flat=True)
+        lim = LIM.LIM(hdo, 12, [1, 2], 4)
+
+        assert isinstance(eof_inputs[-1], tb.CArray)
+        assert eof_inputs[-1]._v_pathname in h5file
+        np.testing.assert_allclose(eof_inputs[-1][:], eof_inputs[0],
+                                   atol=1e-10)
+        np.testing.assert_allclose(lim.G_1, ref.G_1, atol=1e-8)
@@ -0,0 +1,247 @@
+__author__ = 'wperkins'
+
+import tables as tb
+import numpy as np
+import pytest
+from pylim import LIM
+from pylim import LIMTools
+from pylim import Stats as St
+from pylim import DataTools as Dt
+from test_lim import _red_noise_obj
+
+
+def _resample_fcast_file(filename, fcast_times, num_trials=4):
+    """
+    Write a verified ResampleLIM forecast (and its anomalies) to filename.
+    Returns the resampling LIM with the skill attribute set.
+    """
+    with tb.open_file(filename, 'w') as h5file:
+        rlim = LIM.ResampleLIM(_red_noise_obj(), 12, fcast_times, 4, 0.1,
+                               num_trials, h5file=h5file)
+        rlim.forecast(verify=True)
+        rlim.save_attrs()
+        Dt.var_to_hdf5_carray(h5file, '/data', 'anomaly',
+                              rlim._data_obj.anomaly)
+        rlim._h5file = None
+    return rlim
+
+
+@pytest.fixture(scope='module')
+def fcast_file(tmpdir_factory):
+    filename = str(tmpdir_factory.mktemp('limtools').join('fcast.h5'))
+    rlim = _resample_fcast_file(filename, [1, 2, 3])
+    return filename, rlim
+
+
+def test_forecast_archive_matches_trial_fcast(fcast_file):
+    filename, rlim = fcast_file
+    with tb.open_file(filename, 'r') as h5file:
+        eofs = h5file.root.data.eofs[:]
+        fcasts = [h5file.root.data.fcast_bin._f_get_child(
+                  LIM._fcast_node_name(lead))[:]
+                  for lead in rlim.fcast_times]
+
+    with LIMTools.ForecastArchive(filename) as archive:
+        ntrials, ntime, nspace = archive.shape[1:]
+        assert archive.shape[0] == len(rlim.fcast_times)
+        for i, fcast in enumerate(fcasts):
+            full = LIMTools.build_trial_fcast(fcast, eofs)
+            np.testing.assert_allclose(
+                archive[i].reshape(-1, nspace), full, atol=1e-10)
+
+        full = LIMTools.build_trial_fcast(fcasts[1], eofs)
+        full = full.reshape(ntrials, ntime, nspace)
+        np.testing.assert_allclose(archive[1, :, 2:5, [3, 7]],
+                                   full[:, 2:5][..., [3, 7]], atol=1e-10)
+        np.testing.assert_allclose(archive[1, 2, :, 4], full[2, :, 4],
+                                   atol=1e-10)
+
+        with pytest.raises(IndexError):
+            archive[0, :, :, []]
+
+
+def test_build_trial_obs_stacks_trials():
+    obs = np.arange(200.).reshape(50, 4)
+    start_idxs = [0, 10, 20]
+    trial_obs = LIMTools.build_trial_obs(obs, start_idxs, 5, 8)
+
+    ref = np.concatenate([obs[(idx + 5):(idx + 13)] for idx in start_idxs])
+    np.testing.assert_equal(trial_obs, ref)
+
+
+@pytest.mark.parametrize("start_idxs", [[0, 10, 20], [0, 7, 20]])
+def test_trial_windows(start_idxs):
+    obs = np.arange(200.).reshape(50, 4)
+    taus = [2, 4, 6]
+    windows = LIMTools._trial_windows(obs, start_idxs, taus, 8)
+
+    assert windows.shape == (3, 3, 8, 4)
+    for i, idx in enumerate(start_idxs):
+        for j, tau in enumerate(taus):
+            np.testing.assert_equal(windows[i, j],
+                                    obs[(idx + tau):(idx + tau + 8)])
+
+
+def test_trial_windows_view_readonly():
+    obs = np.arange(200.).reshape(50, 4)
+    windows = LIMTools._trial_windows(obs, [0, 4, 8], [0, 4], 8)
+
+    assert np.may_share_memory(windows, obs)
+    with pytest.raises(ValueError):
+        windows[0, 1, 0] = -1
+    assert obs.flags.writeable
+
+
+def test_build_trial_obs_leads_view():
+    obs = np.arange(200.).reshape(50, 4)
+    trial_obs = LIMTools.build_trial_obs(obs, [0, 10], [2, 4], 8)
+
+    assert trial_obs.shape == (2, 2, 8, 4)
+    assert not trial_obs.flags.writeable
+    np.testing.assert_equal(trial_obs[1, 1], obs[14:22])
+
+
+def test_trial_windows_past_obs():
+    obs = np.zeros((20, 4))
+    with pytest.raises(AssertionError):
+        LIMTools._trial_windows(obs, [0, 10], [4], 8)
+
+
+@pytest.mark.parametrize("start_idxs,taus", [([40, 0], [0]),
+                                             ([0, 10], [24, 0])])
+def test_trial_windows_descending_past_obs(start_idxs, taus):
+    obs = np.arange(100.).reshape(50, 2)
+    with pytest.raises(AssertionError):
+        LIMTools._trial_windows(obs, start_idxs, taus, 20)
+
+
+def test_trial_windows_descending():
+    obs = np.arange(200.).reshape(50, 4)
+    start_idxs = [20, 10, 0]
+    taus = [6, 4, 2]
+    windows = LIMTools._trial_windows(obs, start_idxs, taus, 8)
+    trial_obs = LIMTools.build_trial_obs(obs, start_idxs, taus, 8)
+
+    for i, idx in enumerate(start_idxs):
+        for j, tau in enumerate(taus):
+            ref = obs[(idx + tau):(idx + tau + 8)]
+            np.testing.assert_equal(windows[i, j], ref)
+            np.testing.assert_equal(trial_obs[i, j], ref)
+
+
+def test_fcast_corr_matches_resample_skill(fcast_file):
+    filename, rlim = fcast_file
+    with tb.open_file(filename, 'a') as h5file:
+        corr, signif = LIMTools.fcast_corr(h5file)
+        corr = corr[:]
+        signif = signif[:]
+
+    np.testing.assert_allclose(corr, rlim.skill['corr'], atol=1e-10)
+    np.testing.assert_equal(signif, rlim.skill['corr_signif'])
+
+
+@pytest.mark.parametrize("max_mem", [None, 4096])
+def test_fcast_ce_matches_resample_skill(fcast_file, max_mem):
+    filename, rlim = fcast_file
+    with tb.open_file(filename, 'a') as h5file:
+        ce = LIMTools.fcast_ce(h5file, max_mem=max_mem)[:]
+
+    np.testing.assert_allclose(ce, rlim.skill['ce'], atol=1e-10)
+
+
+@pytest.mark.parametrize("n_workers", [None, 2])
+def test_fcast_skill_matches_resample_skill(fcast_file, n_workers):
+    filename, rlim = fcast_file
+    skill = LIMTools.fcast_skill(filename, n_workers=n_workers)
+
+    for key in ['corr', 'corr_pval', 'ce', 'pattern_corr']:
+        np.testing.assert_allclose(skill[key], rlim.skill[key], atol=1e-10)
+    np.testing.assert_equal(skill['corr_signif'], rlim.skill['corr_signif'])
+    for key, stat in rlim.skill_summary.items():
+        np.testing.assert_allclose(skill['summary'][key], stat, atol=1e-10)
+
+    with tb.open_file(filename, 'r') as h5file:
+        np.testing.assert_allclose(h5file.root.stats.corr[:], skill['corr'])
+        np.testing.assert_allclose(h5file.root.stats.summary.corr_global[:],
+                                   skill['summary']['corr_global'])
+
+
+def test_fcast_skill_trial_avg(fcast_file):
+    filename, rlim = fcast_file
+    skill = LIMTools.fcast_skill(filename, avg_trial=True)
+
+    with tb.open_file(filename, 'a') as h5file:
+        corr, _ = LIMTools.fcast_corr(h5file, avg_trial=True)
+        corr = corr[:]
+
+    np.testing.assert_allclose(skill['corr_trial_avg'], corr, atol=1e-10)
+    assert skill['pattern_corr'].shape == rlim.skill['pattern_corr'].shape
+
+
+def test_bootstrap_lead_skill(fcast_file):
+    filename, rlim = fcast_file
+    bootstrap = {'n_resamples': 50, 'random_state': 4}
+    with tb.open_file(filename, 'r') as h5file:
+        inputs = LIMTools._load_skill_inputs(h5file)
+        obs = inputs['obs'][:]
+        clim_var = obs.var(axis=0, ddof=1)
+        stats = LIMTools._bootstrap_lead_skill(inputs, 1, clim_var, bootstrap)
+
+        tau = inputs['fcast_times'][1] * inputs['yrsize']
+        fcast = LIMTools.build_trial_fcast(inputs['fcasts'][1][:],
+                                           inputs['eofs'][:])
+        trial_obs = LIMTools.build_trial_obs(obs, inputs['test_start_idxs'],
+                                             tau, inputs['test_tdim'])
+
+    ref = St.bootstrap_skill(fcast, trial_obs, inputs['yrsize'],
+                             clim_var=clim_var, **bootstrap)
+    for key, stat in stats.items():
+        np.testing.assert_allclose(stat, ref[key], atol=1e-10)
+    np.testing.assert_allclose(stats['corr'], rlim.skill['corr'][1],
+                               atol=1e-10)
+
+
+def test_fcast_skill_bootstrap_worker_pool(fcast_file):
+    filename, rlim = fcast_file
+    serial = LIMTools.fcast_skill(filename, n_resamples=50, random_state=3)
+    pooled = LIMTools.fcast_skill(filename, n_workers=2, n_resamples=50,
+                                  random_state=3)
+
+    for key in ['corr', 'corr_pval', 'ce', 'ce_pval', 'pattern_corr']:
+        np.testing.assert_allclose(pooled[key], serial[key], atol=1e-12)
+    np.testing.assert_allclose(serial['corr'], rlim.skill['corr'], atol=1e-10)
+
+    with pytest.raises(ValueError):
+        LIMTools.fcast_skill(filename, avg_trial=True, n_resamples=50)
+
+
+def test_skill_lead_order_ten_plus_leads(tmpdir):
+    # Listing fcast_bin sorts the nodes as f1, f10, f11, f2, ...
+    filename = str(tmpdir.join('fcast_leads.h5'))
+    rlim = _resample_fcast_file(filename, range(1, 12), num_trials=3)
+
+    with tb.open_file(filename, 'a') as h5file:
+        inputs = LIMTools._load_skill_inputs(h5file)
+        assert [node.name for node in inputs['fcasts']] == \
+            ['f{:d}'.format(lead) for lead in range(1, 12)]
+        corr, _ = LIMTools.fcast_corr(h5file)
+        corr = corr[:]
+    np.testing.assert_allclose(corr, rlim.skill['corr'], atol=1e-10)
+
+    skill = LIMTools.fcast_skill(filename)
+    np.testing.assert_allclose(skill['corr'], rlim.skill['corr'], atol=1e-10)
+    np.testing.assert_allclose(skill['ce'], rlim.skill['ce'], atol=1e-10)
+
+
+def test_skill_fractional_leads(tmpdir):
+    filename = str(tmpdir.join('fcast_months.h5'))
+    rlim = _resample_fcast_file(filename, [0.25, 1, 1.5], num_trials=3)
+
+    with tb.open_file(filename, 'a') as h5file:
+        assert 'f0_25' in h5file.root.data.fcast_bin
+        corr, _ = LIMTools.fcast_corr(h5file)
+        corr = corr[:]
+    np.testing.assert_allclose(corr, rlim.skill['corr'], atol=1e-10)
+
+    skill = LIMTools.fcast_skill(filename)
+    np.testing.assert_allclose(skill['ce'], rlim.skill['ce'], atol=1e-10)
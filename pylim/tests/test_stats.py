@@ -0,0 +1,303 @@
+__author__ = 'wperkins'
+
+import tables as tb
+import numpy as np
+import pytest
+import os
+from math import ceil
+from pylim import Stats as St
+
+
+@pytest.fixture(scope='module')
+def tb_file(request):
+    tbf = tb.open_file('test_stats.h5', 'w',
+                       filters=tb.Filters(complevel=0, complib='blosc'))
+
+    def fin():
+        tbf.close()
+        os.system('rm -f test_stats.h5')
+
+    request.addfinalizer(fin)
+    return tbf
+
+
+def _loop_run_mean(data, window_size, shave_yr=False, year_len=12):
+    """Reference (per-window loop) running mean implementation."""
+    if shave_yr:
+        tedge = window_size//2
+        cut_from_top = year_len * int(ceil(tedge/float(year_len)))
+        bedge = (window_size//2) + (window_size % 2) - 1
+        cut_from_bot = year_len * int(ceil(bedge/float(year_len)))
+    else:
+        cut_from_top = window_size//2
+        bedge = cut_from_bot = (window_size//2) + (window_size % 2) - 1
+
+    nout = data.shape[0] - cut_from_top - cut_from_bot
+    result = np.zeros((nout,) + data.shape[1:], dtype=data.dtype)
+    for i in xrange(nout):
+        cntr = cut_from_bot - bedge + i
+        result[i] = data[cntr:(cntr+window_size)].mean(axis=0)
+
+    return result, cut_from_bot, cut_from_top
+
+
+#### Running Mean Tests ####
+@pytest.mark.parametrize("shape", [(120,), (120, 7), (120, 3, 4)])
+@pytest.mark.parametrize("window_size", [1, 5, 12, 13])
+@pytest.mark.parametrize("shave_yr", [True, False])
+def test_run_mean_matches_loop(shape, window_size, shave_yr):
+    data = np.random.RandomState(0).randn(*shape)
+    res, bot, top = St.run_mean(data, window_size, shave_yr=shave_yr)
+    ref, ref_bot, ref_top = _loop_run_mean(data, window_size,
+                                           shave_yr=shave_yr)
+    assert (bot, top) == (ref_bot, ref_top)
+    assert res.shape == ref.shape
+    np.testing.assert_allclose(res, ref, rtol=1e-10, atol=1e-12)
+
+
+def test_run_mean_float32_offset():
+    # Long float32 series with a large offset (e.g. temperature in K)
+    data = (np.random.RandomState(1).randn(12000, 3) + 288).astype(np.float32)
+    res, _, _ = St.run_mean(data, 12, shave_yr=True)
+    ref, _, _ = _loop_run_mean(data.astype(np.float64), 12, shave_yr=True)
+    assert res.dtype == np.float32
+    np.testing.assert_allclose(res, ref, rtol=0, atol=1e-4)
+
+
+def test_run_mean_blocked():
+    data = np.random.RandomState(2).randn(96, 3, 5)
+    res, _, _ = St.run_mean(data, 12, shave_yr=True, block_size=4)
+    ref, _, _ = _loop_run_mean(data, 12, shave_yr=True)
+    np.testing.assert_allclose(res, ref, rtol=1e-10, atol=1e-12)
+
+
+def test_run_mean_carray(tb_file):
+    data = np.random.RandomState(3).randn(120, 20).astype(np.float32)
+    in_arr = tb_file.create_carray('/', 'rm_in', obj=data)
+    out_arr = tb_file.create_carray('/', 'rm_out', atom=tb.Float32Atom(),
+                                    shape=(96, 20))
+    res, _, _ = St.run_mean(in_arr, 12, shave_yr=True, block_size=6,
+                            out=out_arr)
+    ref, _, _ = _loop_run_mean(data, 12, shave_yr=True)
+    assert res is out_arr
+    np.testing.assert_allclose(out_arr[:], ref, rtol=0, atol=1e-5)
+
+
+#### EOF Tests ####
+def _low_rank_data(nt, ns, rank=6, seed=4):
+    rng = np.random.RandomState(seed)
+    pcs = rng.randn(nt, rank) * np.linspace(10, 1, rank)
+    patterns = rng.randn(rank, ns)
+    return np.dot(pcs, patterns) + 0.01*rng.randn(nt, ns)
+
+
+def _match_modes(eofs, ref):
+    """Absolute pattern correlation between matching EOF columns."""
+    return np.abs((eofs * ref).sum(axis=0) /
+                  (np.linalg.norm(eofs, axis=0)*np.linalg.norm(ref, axis=0)))
+
+
+@pytest.mark.parametrize("solver", ['randomized', 'gram', 'auto'])
+def test_calc_eofs_truncated_solvers(solver):
+    data = _low_rank_data(60, 400)
+    full_stats = {}
+    trunc_stats = {}
+    ref, ref_svals = St.calc_eofs(data, 4, var_stats_dict=full_stats)
+    eofs, svals, pcs = St.calc_eofs(data, 4, ret_pcs=True, solver=solver,
+                                    var_stats_dict=trunc_stats,
+                                    random_state=0)
+    assert eofs.shape == (400, 4)
+    assert pcs.shape == (4, 60)
+    np.testing.assert_allclose(svals, ref_svals, rtol=1e-6)
+    np.testing.assert_allclose(_match_modes(eofs, ref), 1, rtol=1e-6)
+    np.testing.assert_allclose(trunc_stats['total_var'],
+                               full_stats['total_var'])
+    np.testing.assert_allclose(trunc_stats['var_expl_by_ret'],
+                               full_stats['var_expl_by_ret'])
+
+
+@pytest.mark.parametrize("k", [4, 39])
+def test_gram_eigsh_matches_gram_eig(k):
+    data = np.random.RandomState(2).randn(40, 60)
+    gram = np.dot(data, data.T)
+    svals, evecs = St._gram_eigsh(lambda v: np.dot(gram, v), 40, k)
+    ref_svals, ref_evecs = St._gram_eig(gram, k)
+
+    np.testing.assert_allclose(svals, ref_svals)
+    signs = np.sign((evecs * ref_evecs).sum(axis=0))
+    np.testing.assert_allclose(evecs * signs, ref_evecs, atol=1e-8)
+
+
+@pytest.mark.xfail(raises=ValueError)
+def test_calc_eofs_bad_solver():
+    St.calc_eofs(np.ones((5, 5)), 2, solver='magic')
+
+
+@pytest.mark.parametrize("solver", ['randomized', 'gram', 'auto'])
+def test_calc_eofs_out_of_core(solver, tb_file):
+    data = _low_rank_data(50, 300).astype(np.float32)
+    carray = tb_file.create_carray('/', 'eof_' + solver, obj=data)
+    ref, ref_svals = St.calc_eofs(data, 3)
+    # Budget of 20 columns per block
+    eofs, svals = St.calc_eofs(carray, 3, solver=solver, random_state=0,
+                               max_mem=50*8*20)
+    assert isinstance(eofs, np.ndarray)
+    np.testing.assert_allclose(svals, ref_svals, rtol=1e-4)
+    np.testing.assert_allclose(_match_modes(eofs, ref), 1, rtol=1e-4)
+
+
+@pytest.mark.xfail(raises=ValueError)
+def test_calc_eofs_full_out_of_core():
+    St.calc_eofs(np.ones((5, 5)), 2, solver='full', max_mem=100)
+
+
+#### Skill Tests ####
+def test_skill_accumulator_matches_stacked():
+    rng = np.random.RandomState(5)
+    obs = rng.randn(60, 8).cumsum(axis=0)
+    fcast = 0.7*obs + rng.randn(60, 8)
+    acc = St.SkillAccumulator(8)
+    for i0 in xrange(0, 60, 15):
+        acc.update(fcast[i0:i0+15], obs[i0:i0+15])
+
+    np.testing.assert_allclose(acc.corr(), St.calc_lac(fcast, obs))
+    np.testing.assert_allclose(acc.n_eff(), St.calc_n_eff(fcast, obs))
+    corr, signif = acc.corr_signif()
+    ref_signif = St.calc_corr_signif(St.calc_lac(fcast, obs),
+                                     St.calc_n_eff(fcast, obs))
+    np.testing.assert_array_equal(signif, ref_signif)
+
+    clim_var = obs.var(axis=0, ddof=1)
+    ref_ce = np.mean([St.calc_ce(fcast[i0:i0+15], obs[i0:i0+15], obs)
+                      for i0 in xrange(0, 60, 15)], axis=0)
+    np.testing.assert_allclose(acc.ce(clim_var), ref_ce)
+
+
+def test_skill_accumulator_eof_space():
+    rng = np.random.RandomState(6)
+    obs = rng.randn(40, 30)
+    eof_acc = St.SkillAccumulator(30)
+    phys_acc = St.SkillAccumulator(30)
+    for i0 in xrange(0, 40, 10):
+        fcast = rng.randn(3, 10)
+        eofs = np.linalg.qr(rng.randn(30, 3))[0]
+        eof_acc.update_eof(fcast, eofs, obs[i0:i0+10])
+        phys_acc.update(np.dot(fcast.T, eofs.T), obs[i0:i0+10])
+
+    np.testing.assert_allclose(eof_acc.corr(), phys_acc.corr())
+    np.testing.assert_allclose(eof_acc.n_eff(), phys_acc.n_eff())
+    np.testing.assert_allclose(eof_acc.ce(1.), phys_acc.ce(1.))
+
+
+@pytest.mark.parametrize("max_mem", [None, 3*8*400])
+def test_calc_ce_trials(max_mem):
+    rng = np.random.RandomState(7)
+    obs = rng.randn(80, 25)
+    fcasts = rng.randn(2, 3, 4, 10)
+    eofs = rng.randn(3, 25, 4)
+    start_idxs = [0, 20, 45]
+    leads = [12, 24]
+    ce = St.calc_ce_trials(fcasts, eofs, obs, start_idxs, leads, 10,
+                           max_mem=max_mem)
+    for i, lead in enumerate(leads):
+        ref = np.mean([St.calc_ce(np.dot(f.T, e.T),
+                                  obs[(idx+lead):(idx+lead+10)], obs)
+                       for f, e, idx in zip(fcasts[i], eofs, start_idxs)],
+                      axis=0)
+        np.testing.assert_allclose(ce[i], ref)
+        np.testing.assert_allclose(
+            St.calc_ce_trials(fcasts[i], eofs, obs, start_idxs, lead, 10),
+            ref)
+
+
+def test_bootstrap_skill():
+    rng = np.random.RandomState(8)
+    obs = rng.randn(120, 6)
+    fcast = obs * np.array([0.9, 0.5, 0.2, 0., 0., -0.5]) + rng.randn(120, 6)
+    skill = St.bootstrap_skill(fcast, obs, 12, n_resamples=500,
+                               random_state=0)
+    np.testing.assert_allclose(skill['corr'], St.calc_lac(fcast, obs))
+    np.testing.assert_allclose(skill['ce'],
+                               St.calc_ce(fcast, obs, obs))
+    assert skill['corr_signif'][0] and not skill['corr_signif'][-1]
+    assert ((skill['corr_pval'] >= 0) & (skill['corr_pval'] <= 1)).all()
+
+    # Same resamples from a seed, and blocked evaluation
+    blocked = St.bootstrap_skill(fcast, obs, 12, n_resamples=500,
+                                 random_state=0, max_mem=6*500*8*2)
+    for key in skill:
+        np.testing.assert_allclose(blocked[key], skill[key])
+
+
+def test_bootstrap_skill_eof_space():
+    rng = np.random.RandomState(9)
+    obs = rng.randn(2, 24, 10)
+    fcast = rng.randn(2, 3, 24)
+    eofs = rng.randn(2, 10, 3)
+    phys = np.concatenate([np.dot(f.T, e.T) for f, e in zip(fcast, eofs)])
+    ref = St.bootstrap_skill(phys, obs.reshape(48, 10), 12, n_resamples=50,
+                             random_state=1)
+    skill = St.bootstrap_skill(fcast, obs, 12, eofs=eofs, n_resamples=50,
+                               random_state=1)
+    for key in ref:
+        np.testing.assert_allclose(skill[key], ref[key])
+
+
+def test_fdr_signif():
+    pvals = np.array([[0.001, 0.008, 0.039, 0.041, 0.042, 0.06, 0.074, 0.205,
+                       0.212, 0.216],
+                      [0.2, 0.3, 0.4, 0.5, 0.6, 0.7, 0.8, 0.9, 0.95, 1.]])
+    signif = St.fdr_signif(pvals, alpha=0.05)
+    # Only the two smallest p-values fall under the BH line
+    np.testing.assert_array_equal(signif[0], np.arange(10) < 2)
+    assert not signif[1].any()
+
+    # Order of the points does not matter
+    perm = np.random.RandomState(10).permutation(10)
+    np.testing.assert_array_equal(St.fdr_signif(pvals[:, perm]),
+                                  signif[:, perm])
+
+
+def test_fdr_signif_1d():
+    pvals = np.array([0.001, 0.008, 0.039, 0.041, 0.042, 0.06, 0.074, 0.205,
+                      0.212, 0.216])
+    signif = St.fdr_signif(pvals, alpha=0.05)
+    assert signif.shape == pvals.shape
+    np.testing.assert_array_equal(signif, np.arange(10) < 2)
+    assert not St.fdr_signif(pvals + 0.5).any()
+
+
+def test_area_means():
+    lats = np.array([-60., -30., 0., 30., 60.])
+    data = np.array([[1., 1., 2., 3., 3.], [1., np.nan, 2., 3., np.nan]])
+    means = St.area_means(data, lats)
+    np.testing.assert_allclose(means['nh'], [3., 3.])
+    np.testing.assert_allclose(means['sh'], [1., 1.])
+    wgt = np.cos(np.radians(lats))
+    np.testing.assert_allclose(means['global'][0],
+                               (data[0] * wgt).sum() / wgt.sum())
+    np.testing.assert_allclose(means['global'][1],
+                               (wgt[0] + 2 + 3*wgt[3]) / (wgt[0] + 1 + wgt[3]))
+
+
+def test_skill_accumulator_pattern_corr():
+    rng = np.random.RandomState(11)
+    obs = rng.randn(20, 30)
+    weights = np.cos(np.radians(np.linspace(-80, 80, 30)))
+    eof_acc = St.SkillAccumulator(30, weights=weights)
+    phys_acc = St.SkillAccumulator(30, weights=weights)
+    phys = []
+    for i0 in xrange(0, 20, 10):
+        fcast = rng.randn(3, 10)
+        eofs = np.linalg.qr(rng.randn(30, 3))[0]
+        phys.append(np.dot(fcast.T, eofs.T))
+        eof_acc.update_eof(fcast, eofs, obs[i0:i0+10])
+        phys_acc.update(phys[-1], obs[i0:i0+10])
+
+    phys = np.concatenate(phys)
+    f_anom = phys - np.dot(phys, weights)[:, None] / weights.sum()
+    o_anom = obs - np.dot(obs, weights)[:, None] / weights.sum()
+    ref = (np.dot(f_anom * o_anom, weights) /
+           np.sqrt(np.dot(f_anom**2, weights) * np.dot(o_anom**2, weights)))
+    np.testing.assert_allclose(phys_acc.pattern_corr(), ref)
+    np.testing.assert_allclose(eof_acc.pattern_corr(), ref)